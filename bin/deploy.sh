@@ -3,10 +3,10 @@ RELEASE=$1
 if [ -z "$RELEASE" ]; then
     echo "No release specified - defaulting to production" 
     echo "Production mode"
-    sudo docker compose -f "docker-compose-prod.yml" build api
-    sudo docker compose -f "docker-compose-prod.yml" up -d --force-recreate api
+    sudo docker compose -f "docker-compose-prod.yml" build api status_counters analytics retention
+    sudo docker compose -f "docker-compose-prod.yml" up -d --force-recreate api status_counters analytics retention
 else
     echo "Dev mode"
-    sudo docker compose -f "docker-compose-dev.yml" build api
-    sudo docker compose -f "docker-compose-dev.yml" up -d --force-recreate api
+    sudo docker compose -f "docker-compose-dev.yml" build api status_counters analytics retention
+    sudo docker compose -f "docker-compose-dev.yml" up -d --force-recreate api status_counters analytics retention
 fi
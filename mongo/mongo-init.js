@@ -1,15 +1,62 @@
+// mirrors the indexes declared in rhythm_api/indexes.py
+// python -m rhythm_api.scripts.indexes report - lists the differences with a running database
+
 function createIndexesOnTasksCollection() {
     const collection = db.getCollection('celery_taskmeta');
     collection.createIndex({ "status": 1 });
     collection.createIndex({ "kwargs.app_id": 1 });
     collection.createIndex({ "kwargs.step": 1 });
+    collection.createIndex(
+        { "kwargs.app_id": 1, "kwargs.step": 1 },
+        { partialFilterExpression: { "kwargs.step": { $exists: true } } }
+    );
+    collection.createIndex(
+        { "kwargs.app_id": 1, "status": 1, "kwargs.step": 1, "_id": 1 },
+        { partialFilterExpression: { "kwargs.step": { $exists: true } } }
+    );
+    collection.createIndex({ "date_done": 1 });
 }
 
 function createIndexesOnWorkflowCollection() {
     const collection = db.getCollection('workflow_meta');
     collection.createIndex({ "_status": 1 });
     collection.createIndex({ "app_id": 1 });
+    collection.createIndex({ "app_id": 1, "_status": 1, "_id": 1 });
+
+    // back the sort keys of GET /workflows (rhythm_api.listing.SortBy)
+    // _id is the tie-breaker of every sort, app_id is the equality filter of most list queries
+    const sortFields = ["created_at", "updated_at", "_status", "name"];
+    sortFields.forEach((field) => {
+        collection.createIndex({ [field]: 1, "_id": 1 });
+        collection.createIndex({ "app_id": 1, [field]: 1, "_id": 1 });
+    });
+
+    // GET /workflows/search - text search, and equality on step kwargs and args (rhythm_api.search)
+    collection.createIndex({ "name": "text", "description": "text" });
+    collection.createIndex({ "_search": 1 });
+}
+
+function createIndexesOnStatusCountsCollection() {
+    // rhythm_api.counters - one document per (app_id, status)
+    const collection = db.getCollection('workflow_status_counts');
+    collection.createIndex({ "app_id": 1, "status": 1 }, { unique: true });
+}
+
+function createIndexesOnStepRollupsCollections() {
+    // rhythm_api.analytics - one document per (app_id, step, hour)
+    const rollups = db.getCollection('step_duration_rollups');
+    rollups.createIndex({ "app_id": 1, "step": 1, "bucket": 1 }, { unique: true });
+    rollups.createIndex({ "app_id": 1, "bucket": 1 });
+    db.getCollection('step_duration_ledger').createIndex({ "recorded_at": 1 }, { expireAfterSeconds: 604800 });
+}
+
+function createIndexesOnArchiveCollection() {
+    // rhythm_api.retention - one document per archived workflow
+    db.getCollection('workflow_archive').createIndex({ "app_id": 1, "archived_at": 1 });
 }
 
 createIndexesOnTasksCollection();
 createIndexesOnWorkflowCollection();
+createIndexesOnStatusCountsCollection();
+createIndexesOnStepRollupsCollections();
+createIndexesOnArchiveCollection();
@@ -0,0 +1,118 @@
+import logging
+import math
+import threading
+import time
+from collections import Counter
+
+import celery.states
+
+from rhythm_api import counters, metrics
+from rhythm_api.config import config
+
+# Admission control of workflow submissions, so that one app cannot flood the queues and mongo.
+#
+# - a token bucket per caller (the JWT sub): every submitted workflow takes a token, tokens are added at rate
+#   per second up to burst. buckets are kept in memory, so with several API processes each process admits rate.
+# - a limit on the ACTIVE (PENDING / STARTED) workflows of an app, read from the status counters (rhythm_api.counters)
+#   the counters only follow the statuses the workers set while their watcher runs. when its heartbeat is older than
+#   counters_heartbeat_timeout, the limit is not applied rather than rejecting on counts that no longer change
+#
+# Rejected submissions get a 429 with Retry-After. A bulk submission is admitted or rejected as a whole.
+
+ACTIVE_STATES = [celery.states.PENDING, celery.states.STARTED]
+
+logger = logging.getLogger(__name__)
+
+
+class AdmissionRejected(Exception):
+    def __init__(self, message: str, retry_after: float):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+class TokenBucket:
+    def __init__(self, rate: float, burst: float):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.updated_at = time.monotonic()
+
+    def take(self, n: int) -> float:
+        """
+        take n tokens if there are enough
+
+        :return: 0 if they were taken, otherwise the seconds until there are enough
+        """
+        now = time.monotonic()
+        self.tokens = min(self.burst, self.tokens + (now - self.updated_at) * self.rate)
+        self.updated_at = now
+        if n <= self.tokens:
+            self.tokens -= n
+            return 0
+        if n > self.burst or self.rate <= 0:
+            return math.inf
+        return (n - self.tokens) / self.rate
+
+
+class AdmissionController:
+    def __init__(self, admission_config: dict):
+        self.config = admission_config
+        self._buckets: dict[str, TokenBucket] = {}
+        self._lock = threading.Lock()
+
+    def limits(self, key: str) -> dict:
+        """
+        limits of a caller or an app, the defaults with their overrides
+        """
+        return {**self.config, **(self.config.get('limits', None) or {}).get(key, {})}
+
+    def take_tokens(self, sub: str, n: int) -> None:
+        limits = self.limits(sub)
+        if limits['rate'] is None:
+            return
+        with self._lock:
+            bucket = self._buckets.get(sub, None)
+            if bucket is None or (bucket.rate, bucket.burst) != (limits['rate'], limits['burst']):
+                bucket = self._buckets[sub] = TokenBucket(limits['rate'], limits['burst'])
+            wait = bucket.take(n)
+        if wait > 0:
+            metrics.ADMISSION_REJECTIONS.labels('rate').inc()
+            if math.isinf(wait):
+                raise AdmissionRejected(f'{sub} can submit at most {limits["burst"]} workflows at once', wait)
+            raise AdmissionRejected(f'{sub} is submitting workflows faster than {limits["rate"]} per second', wait)
+
+    def check_active(self, db, app_counts: Counter) -> None:
+        """
+        :param app_counts: app_id -> number of workflows to submit
+        """
+        limited = {app_id: self.limits(app_id)['max_active'] for app_id in app_counts}
+        limited = {app_id: max_active for app_id, max_active in limited.items() if max_active is not None}
+        if not limited:
+            return
+        if not counters.watcher_alive(db, self.config['counters_heartbeat_timeout']):
+            logger.warning('the status counters watcher is not running, max_active is not applied to %s',
+                           sorted(limited))
+            return
+        active = Counter()
+        for c in db.get_collection(counters.COUNTS).find({'app_id': {'$in': list(limited.keys())},
+                                                          'status': {'$in': ACTIVE_STATES}}):
+            active[c['app_id']] += c.get('count', 0)
+        for app_id, max_active in limited.items():
+            if active[app_id] + app_counts[app_id] > max_active:
+                metrics.ADMISSION_REJECTIONS.labels('active').inc()
+                raise AdmissionRejected(f'{app_id} has {active[app_id]} active workflows, '
+                                        f'at most {max_active} are allowed',
+                                        self.config['active_retry_after'])
+
+    def admit(self, db, sub: str, app_ids: list[str]) -> None:
+        """
+        raise AdmissionRejected if the workflows of app_ids cannot be submitted now
+        """
+        if not self.config['enabled']:
+            return
+        # the active limit first, rejected submissions do not take tokens
+        self.check_active(db, Counter(app_ids))
+        self.take_tokens(sub, len(app_ids))
+
+
+admission_controller = AdmissionController(config['admission'])
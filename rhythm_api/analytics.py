@@ -0,0 +1,326 @@
+import bisect
+import datetime
+import time
+import uuid
+from collections import defaultdict
+
+import celery.states
+import pymongo
+from pymongo.errors import BulkWriteError
+
+from rhythm_api import counters
+
+# Hourly rollups of finished step tasks that back GET /analytics/steps.
+#
+# step_duration_rollups - {app_id, step, bucket, count, status.<STATE>, duration_count, duration_sum,
+#                          duration_min, duration_max, histogram.<bin>}, one document per (app_id, step, hour)
+# step_duration_ledger - {_id: task_id, recorded_at, claim}, the tasks already rolled up. claim is set while
+#                        the rollups of the task are being written
+#
+# sync reads the tasks finished since the last sync (by celery_taskmeta.date_done) and adds them to the rollups.
+# Like the status counters, the ledger makes re-reading idempotent: a task is only rolled up the first time it
+# is inserted in the ledger, so every sync re-reads an overlap window to catch tasks written late by the workers.
+# The ledger entries are inserted with a claim before the rollups are written: a task whose rollup write failed is
+# removed from the ledger, and one left claimed by a sync that died is claimed again by a later sync.
+# Ledger entries expire (TTL index) once they are well past the overlap window.
+#
+# Durations are from the task run's date_start (workflow_meta) to the task's date_done, of successful tasks only.
+# They are kept as a histogram with fixed bins so that rollups of any time range can be merged into percentiles.
+
+ROLLUPS = 'step_duration_rollups'
+LEDGER = 'step_duration_ledger'
+STATE_ID = 'step_duration_rollups'
+
+DUPLICATE_KEY = 11000
+# seconds after which the ledger entries claimed by a sync that did not write their rollups are claimed again
+CLAIM_TIMEOUT = 600
+
+FINISHED_STATES = [celery.states.SUCCESS, celery.states.FAILURE, celery.states.REVOKED]
+
+# upper bounds in seconds of the duration histogram bins, the last bin is unbounded
+BINS = [1, 2, 5, 10, 30, 60, 120, 300, 600, 1200, 1800, 3600, 7200, 14400, 28800, 43200, 86400, 172800]
+
+
+def parse_date(value) -> datetime.datetime | None:
+    # celery stores date_done as an ISO string
+    if value is None or isinstance(value, datetime.datetime):
+        return value
+    try:
+        return datetime.datetime.fromisoformat(value).replace(tzinfo=None)
+    except ValueError:
+        return None
+
+
+def naive_utc(date: datetime.datetime) -> datetime.datetime:
+    # the rollup buckets are naive UTC, query parameters may carry an offset
+    if date.tzinfo is None:
+        return date
+    return date.astimezone(datetime.timezone.utc).replace(tzinfo=None)
+
+
+def date_done_query(value: datetime.datetime) -> dict:
+    # date_done is compared as a string, ISO strings sort in time order
+    return {'$gt': value.isoformat()}
+
+
+def bin_index(seconds: float) -> int:
+    return bisect.bisect_left(BINS, seconds)
+
+
+def bucket_of(date: datetime.datetime) -> datetime.datetime:
+    return date.replace(minute=0, second=0, microsecond=0)
+
+
+def task_start_dates(db, tasks: list[dict]) -> dict[str, datetime.datetime]:
+    """
+    date_start of the task runs of tasks, from their workflows
+    """
+    workflow_ids = list({task['kwargs']['workflow_id'] for task in tasks if task['kwargs'].get('workflow_id', None)})
+    if len(workflow_ids) == 0:
+        return {}
+    task_ids = {task['_id'] for task in tasks}
+    return {
+        task_run['task_id']: task_run['date_start']
+        for wf in db.get_collection('workflow_meta').find({'_id': {'$in': workflow_ids}},
+                                                          {'steps.task_runs': 1})
+        for step in wf.get('steps', [])
+        for task_run in step.get('task_runs', None) or []
+        if task_run.get('task_id', None) in task_ids and task_run.get('date_start', None) is not None
+    }
+
+
+def rollup_key(task: dict) -> tuple | None:
+    """
+    (app_id, step, hour) of the rollup of the task, None if the task has no date_done
+    """
+    date_done = parse_date(task.get('date_done', None))
+    if date_done is None:
+        return None
+    return task['kwargs'].get('app_id', None), task['kwargs']['step'], bucket_of(date_done)
+
+
+def rollup_ops(tasks: list[dict], start_dates: dict[str, datetime.datetime]) -> list:
+    """
+    one upsert per (app_id, step, hour) that adds the tasks to the rollup, in the order the tasks first reference them
+    """
+    updates = defaultdict(lambda: {'$inc': defaultdict(int), '$min': {}, '$max': {}})
+    for task in tasks:
+        key = rollup_key(task)
+        if key is None:
+            continue
+        date_done = parse_date(task['date_done'])
+        update = updates[key]
+        update['$inc']['count'] += 1
+        update['$inc'][f'status.{task["status"]}'] += 1
+
+        date_start = start_dates.get(task['_id'], None)
+        if task['status'] == celery.states.SUCCESS and date_start is not None:
+            seconds = max((date_done - date_start).total_seconds(), 0)
+            update['$inc']['duration_count'] += 1
+            update['$inc']['duration_sum'] += seconds
+            update['$inc'][f'histogram.{bin_index(seconds)}'] += 1
+            update['$min']['duration_min'] = min(update['$min'].get('duration_min', seconds), seconds)
+            update['$max']['duration_max'] = max(update['$max'].get('duration_max', seconds), seconds)
+
+    ops = []
+    for (app_id, step, bucket), update in updates.items():
+        update = {op: dict(fields) for op, fields in update.items() if fields}
+        ops.append(pymongo.UpdateOne({'app_id': app_id, 'step': step, 'bucket': bucket}, update, upsert=True))
+    return ops
+
+
+def claim_tasks(db, tasks: list[dict], claim: str, now: datetime.datetime, claim_timeout: float) -> set[str]:
+    """
+    insert the ledger entries of the tasks with the claim.
+    tasks whose entry has a claim older than claim_timeout were claimed by a sync that died before rolling them up,
+    their entries are claimed again.
+
+    :return: ids of the tasks claimed
+    """
+    ledger = db.get_collection(LEDGER)
+    task_ids = [task['_id'] for task in tasks]
+    duplicates = []
+    try:
+        ledger.insert_many([{'_id': task_id, 'recorded_at': now, 'claim': claim} for task_id in task_ids],
+                           ordered=False)
+    except BulkWriteError as e:
+        errors = e.details['writeErrors']
+        if any(err['code'] != DUPLICATE_KEY for err in errors):
+            ledger.delete_many({'_id': {'$in': task_ids}, 'claim': claim})
+            raise
+        duplicates = [task_ids[err['index']] for err in errors]
+
+    claimed = set(task_ids) - set(duplicates)
+    if duplicates:
+        # entries without a claim are rolled up
+        stale = {'_id': {'$in': duplicates}, 'claim': {'$ne': None},
+                 'recorded_at': {'$lt': now - datetime.timedelta(seconds=claim_timeout)}}
+        if ledger.update_many(stale, {'$set': {'claim': claim, 'recorded_at': now}}).modified_count > 0:
+            claimed.update(entry['_id'] for entry in ledger.find({'_id': {'$in': duplicates}, 'claim': claim},
+                                                                 {'_id': 1}))
+    return claimed
+
+
+def record_tasks(db, tasks: list[dict], claim_timeout: float = CLAIM_TIMEOUT) -> int:
+    """
+    add the tasks that are not rolled up yet to the rollups.
+    the ledger entries of the tasks are claimed before the rollups are written, and the claim is removed after.
+    the entries of the tasks whose rollup could not be written are deleted so that the next sync adds them.
+
+    :return: number of tasks added
+    """
+    if len(tasks) == 0:
+        return 0
+    ledger = db.get_collection(LEDGER)
+    claim = str(uuid.uuid4())
+    claimed = claim_tasks(db, tasks, claim, datetime.datetime.utcnow(), claim_timeout)
+    new_tasks = [task for task in tasks if task['_id'] in claimed]
+
+    def release(_tasks: list[dict]) -> None:
+        ledger.delete_many({'_id': {'$in': [task['_id'] for task in _tasks]}, 'claim': claim})
+
+    try:
+        ops = rollup_ops(new_tasks, task_start_dates(db, new_tasks))
+        if ops:
+            db.get_collection(ROLLUPS).bulk_write(ops, ordered=False)
+    except BulkWriteError as e:
+        # the other upserts were written. there is one op per rollup key, in the order the tasks reference them
+        keys = list(dict.fromkeys(key for key in map(rollup_key, new_tasks) if key is not None))
+        failed_keys = {keys[err['index']] for err in e.details['writeErrors']}
+        release([task for task in new_tasks if rollup_key(task) in failed_keys])
+        ledger.update_many({'_id': {'$in': list(claimed)}, 'claim': claim}, {'$unset': {'claim': ''}})
+        raise
+    except Exception:
+        release(new_tasks)
+        raise
+    ledger.update_many({'_id': {'$in': list(claimed)}, 'claim': claim}, {'$unset': {'claim': ''}})
+    return len(new_tasks)
+
+
+def sync(db, since: datetime.datetime | None, overlap: float = 600, batch_size: int = 1000) -> datetime.datetime:
+    """
+    roll up the step tasks finished since "since" minus overlap seconds
+
+    :param since: None to roll up every finished task
+    :return: the latest date_done seen, the "since" of the next sync
+    """
+    query = {
+        'status': {'$in': FINISHED_STATES},
+        'kwargs.step': {'$exists': True},
+    }
+    if since is not None:
+        query['date_done'] = date_done_query(since - datetime.timedelta(seconds=overlap))
+
+    latest = since
+    cursor = db.get_collection('celery_taskmeta').find(query, {'status': 1, 'date_done': 1, 'kwargs': 1})
+    batch = []
+    for task in cursor:
+        batch.append(task)
+        if len(batch) == batch_size:
+            record_tasks(db, batch)
+            batch = []
+        date_done = parse_date(task.get('date_done', None))
+        if date_done is not None and (latest is None or date_done > latest):
+            latest = date_done
+    record_tasks(db, batch)
+    return latest
+
+
+def watch(db, interval: float = 60, overlap: float = 600) -> None:
+    """
+    keep the rollups up to date, the watermark is saved after every sync
+    """
+    state_col = db.get_collection(counters.STATE)
+    while True:
+        state = state_col.find_one({'_id': STATE_ID}) or {}
+        since = sync(db, state.get('since', None), overlap=overlap)
+        if since is not None:
+            state_col.update_one({'_id': STATE_ID}, {'$set': {'since': since}}, upsert=True)
+        time.sleep(interval)
+
+
+def rebuild(db) -> None:
+    """
+    drop the rollups and roll up every finished task again
+    """
+    db.get_collection(ROLLUPS).delete_many({})
+    db.get_collection(LEDGER).delete_many({})
+    since = sync(db, None)
+    db.get_collection(counters.STATE).update_one({'_id': STATE_ID}, {'$set': {'since': since}}, upsert=True)
+
+
+def percentile(histogram: dict[int, int], count: int, p: float) -> float | None:
+    """
+    estimate a percentile from histogram bin counts, interpolating linearly within the bin
+    """
+    if count == 0:
+        return None
+    rank = count * p / 100
+    seen = 0
+    for i in sorted(histogram):
+        n = histogram[i]
+        if seen + n >= rank:
+            lower = BINS[i - 1] if i > 0 else 0
+            upper = BINS[i] if i < len(BINS) else BINS[-1] * 2
+            return lower + (upper - lower) * (rank - seen) / n
+        seen += n
+    return BINS[-1] * 2
+
+
+def summarize(rollups: list[dict], bucket: str = 'hour') -> dict:
+    """
+    merge rollup documents into per-step totals and a per-bucket series
+
+    :param bucket: hour or day
+    """
+    def new_totals():
+        return {'count': 0, 'status': defaultdict(int), 'duration_count': 0, 'duration_sum': 0,
+                'duration_min': None, 'duration_max': None, 'histogram': defaultdict(int)}
+
+    steps = defaultdict(new_totals)
+    series = defaultdict(lambda: defaultdict(int))
+    for r in rollups:
+        totals = steps[r['step']]
+        totals['count'] += r.get('count', 0)
+        for status, n in (r.get('status', None) or {}).items():
+            totals['status'][status] += n
+        totals['duration_count'] += r.get('duration_count', 0)
+        totals['duration_sum'] += r.get('duration_sum', 0)
+        for i, n in (r.get('histogram', None) or {}).items():
+            totals['histogram'][int(i)] += n
+        for attr, fn in [('duration_min', min), ('duration_max', max)]:
+            if r.get(attr, None) is not None:
+                totals[attr] = r[attr] if totals[attr] is None else fn(totals[attr], r[attr])
+
+        b = r['bucket'] if bucket == 'hour' else r['bucket'].replace(hour=0)
+        point = series[(b, r['step'])]
+        point['completed'] += r.get('count', 0)
+        for status, n in (r.get('status', None) or {}).items():
+            point[status] += n
+
+    return {
+        'steps': [
+            {
+                'step': step,
+                'count': t['count'],
+                'status': dict(t['status']),
+                'success_rate': t['status'][celery.states.SUCCESS] / t['count'] if t['count'] else None,
+                'failure_rate': t['status'][celery.states.FAILURE] / t['count'] if t['count'] else None,
+                'duration': {
+                    'count': t['duration_count'],
+                    'mean': t['duration_sum'] / t['duration_count'] if t['duration_count'] else None,
+                    'min': t['duration_min'],
+                    'max': t['duration_max'],
+                    'p50': percentile(t['histogram'], t['duration_count'], 50),
+                    'p90': percentile(t['histogram'], t['duration_count'], 90),
+                    'p95': percentile(t['histogram'], t['duration_count'], 95),
+                    'p99': percentile(t['histogram'], t['duration_count'], 99),
+                }
+            }
+            for step, t in sorted(steps.items())
+        ],
+        'series': [
+            {'bucket': b, 'step': step, **point}
+            for (b, step), point in sorted(series.items())
+        ]
+    }
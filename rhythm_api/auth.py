@@ -1,5 +1,9 @@
+import functools
+import hashlib
 import json
+import threading
 import time
+from collections import OrderedDict
 from pathlib import Path
 
 from jwcrypto.jwt import JWT, JWK
@@ -14,11 +18,15 @@ def load_key(key_filename: Path | str) -> JWK:
     return JWK.from_pem(key_pem)
 
 
-public_key_path = Path('.').resolve() / config['auth']['jwt']['pub']
-public_key = load_key(public_key_path)
+# keys are read on first use. the API only validates tokens and never reads the private key
+@functools.cache
+def public_key() -> JWK:
+    return load_key(Path('.').resolve() / config['auth']['jwt']['pub'])
 
-private_key_path = Path('.').resolve() / config['auth']['jwt']['key']
-private_key = load_key(private_key_path)
+
+@functools.cache
+def private_key() -> JWK:
+    return load_key(Path('.').resolve() / config['auth']['jwt']['key'])
 
 
 def issue_JWT(sub: str, expires_in: int = None) -> str:
@@ -37,7 +45,7 @@ def issue_JWT(sub: str, expires_in: int = None) -> str:
         claims["exp"] = now + expires_in
 
     token = JWT(header=header, claims=claims)
-    token.make_signed_token(private_key)
+    token.make_signed_token(private_key())
     return token.serialize()
 
 
@@ -45,7 +53,7 @@ def validate_JWT(token: str) -> dict:
     iss = config['auth']['jwt']['iss']
     jwt = JWT()
     jwt.deserialize(token)
-    jwt.validate(public_key)
+    jwt.validate(public_key())
     decoded_token = json.loads(jwt.claims)
 
     assert 'iss' in decoded_token and decoded_token['iss'] == iss, 'Invalid iss'
@@ -54,6 +62,77 @@ def validate_JWT(token: str) -> dict:
     return decoded_token
 
 
+class TokenCache:
+    """
+    Bounded LRU of already validated tokens, keyed by the sha256 of the token.
+
+    An entry expires after ttl seconds or at the token's "exp" claim, whichever comes first,
+    so a cached token is never accepted after it would have failed validation.
+    """
+
+    def __init__(self, max_size: int, ttl: int):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._entries: OrderedDict[str, tuple[float, dict]] = OrderedDict()
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def key(token: str) -> str:
+        return hashlib.sha256(token.encode()).hexdigest()
+
+    def get(self, token: str) -> dict | None:
+        key = self.key(token)
+        with self._lock:
+            entry = self._entries.get(key, None)
+            if entry is not None:
+                expires_at, claims = entry
+                if time.time() < expires_at:
+                    self._entries.move_to_end(key)
+                    self.hits += 1
+                    return claims
+                del self._entries[key]
+            self.misses += 1
+            return None
+
+    def put(self, token: str, claims: dict) -> None:
+        if self.max_size <= 0:
+            return
+        expires_at = time.time() + self.ttl
+        if 'exp' in claims:
+            expires_at = min(expires_at, claims['exp'])
+        key = self.key(token)
+        with self._lock:
+            self._entries[key] = (expires_at, claims)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                'size': len(self._entries),
+                'hits': self.hits,
+                'misses': self.misses
+            }
+
+
+token_cache = TokenCache(max_size=config['auth']['jwt']['cache']['max_size'],
+                         ttl=config['auth']['jwt']['cache']['ttl'])
+
+
+def validate_JWT_cached(token: str) -> dict:
+    """
+    validate_JWT that skips the signature check for tokens validated in the last few minutes
+    """
+    claims = token_cache.get(token)
+    if claims is None:
+        claims = validate_JWT(token)
+        token_cache.put(token, claims)
+    return claims
+
+
 if __name__ == '__main__':
     token = ''
     claims = validate_JWT(token)
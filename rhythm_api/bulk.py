@@ -0,0 +1,77 @@
+import itertools
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Iterable
+
+from rhythm_api import counters
+
+
+def batched(items: Iterable, n: int):
+    it = iter(items)
+    while batch := list(itertools.islice(it, n)):
+        yield batch
+
+
+def find_workflow_ids(wf_col, query: dict, limit: int) -> list[str]:
+    """
+    ids of the workflows that match the query, at most limit of them
+    """
+    # a bulk operation without a filter would act on every workflow
+    assert query, 'at least one of app_id, status or workflow_ids is required'
+    workflow_ids = [wf['_id'] for wf in wf_col.find(query, {'_id': 1}).limit(limit + 1)]
+    assert len(workflow_ids) <= limit, f'more than {limit} workflows match the filter, narrow it down'
+    return workflow_ids
+
+
+def apply_concurrently(fn: Callable[[str], dict], workflow_ids: list[str], max_workers: int) -> dict:
+    """
+    call fn on every workflow with at most max_workers calls in flight
+
+    :return: summary {'matched': int, 'results': {workflow_id: result}, 'failed': [{'workflow_id', 'error'}]}
+    """
+    def run(workflow_id):
+        try:
+            return workflow_id, fn(workflow_id), None
+        except Exception as e:
+            return workflow_id, None, str(e)
+
+    results = {}
+    failed = []
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        for workflow_id, result, error in executor.map(run, workflow_ids):
+            if error is None:
+                results[workflow_id] = result
+            else:
+                failed.append({'workflow_id': workflow_id, 'error': error})
+    return {
+        'matched': len(workflow_ids),
+        'results': results,
+        'failed': failed
+    }
+
+
+def delete_workflows(db, workflow_ids: list[str], batch_size: int) -> dict:
+    """
+    delete workflows and the celery_taskmeta documents of all their task runs, batch_size workflows at a time.
+
+    the workflows are deleted before their tasks, so an interrupted delete leaves orphaned tasks
+    rather than workflows whose task runs are missing.
+    """
+    wf_col = db.get_collection('workflow_meta')
+    task_col = db.get_collection('celery_taskmeta')
+    deleted_count = 0
+    deleted_task_count = 0
+    for batch in batched(workflow_ids, batch_size):
+        task_ids = [
+            task_run['task_id']
+            for wf in wf_col.find({'_id': {'$in': batch}}, {'steps.task_runs.task_id': 1})
+            for step in wf.get('steps', [])
+            for task_run in step.get('task_runs', None) or []
+        ]
+        deleted_count += wf_col.delete_many({'_id': {'$in': batch}}).deleted_count
+        counters.record_deletes(db, batch)
+        if len(task_ids) > 0:
+            deleted_task_count += task_col.delete_many({'_id': {'$in': task_ids}}).deleted_count
+    return {
+        'deleted_count': deleted_count,
+        'deleted_task_count': deleted_task_count
+    }
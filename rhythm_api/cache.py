@@ -0,0 +1,250 @@
+import hashlib
+import json
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from typing import Any, Awaitable, Callable
+
+import celery.states
+from fastapi import Request, Response
+from fastapi.encoders import jsonable_encoder
+
+from rhythm_api import encoding, groups, metrics, sparse
+from rhythm_api.config import config
+
+# Cache of rendered GET /workflows/{workflow_id} and GET /workflows responses.
+#
+# Workflows in a terminal state only change through the API (resume / delete), so they are cached until the API
+# invalidates them. A FAILURE / REVOKED workflow with groups is not settled while the other steps of the failed group
+# are still running (rhythm_api.groups), nor is one whose response does not show the statuses and groups of its
+# steps. Active workflows are advanced by the celery workers, which the API does not see,
+# so they are cached for a few seconds only.
+# Invalidations of the memory backend are only seen by the process that makes them, not by the other workers of
+# rhythm_api.serve nor by the retention service, so it caches terminal workflows for terminal_ttl seconds instead.
+#
+# Invalidation replaces a version token instead of deleting entries: the version is part of the entry keys,
+# and a response is stored under the version that was read before it was computed. A response computed from
+# a workflow that changed in the meantime is then stored under a key nobody reads anymore and ages out,
+# instead of being served until the next invalidation.
+
+TERMINAL_STATES = {celery.states.SUCCESS, celery.states.FAILURE, celery.states.REVOKED}
+
+
+def settled(workflow: dict, fields: dict = None) -> bool:
+    """
+    whether the workflow only changes through the API
+    """
+    status = workflow.get('status', None)
+    if status not in TERMINAL_STATES:
+        return False
+    if status == celery.states.SUCCESS:
+        return True
+    if not (sparse.selected(fields, 'steps', 'status') and sparse.selected(fields, 'steps', 'group')):
+        return False
+    steps = workflow.get('steps', [])
+    return not groups.stage_running(groups.stages(steps), [step['status'] for step in steps])
+
+
+class MemoryBackend:
+    """
+    in-process LRU, invalidations are only seen by the process that makes them. max_size 0 disables caching.
+    """
+
+    def __init__(self, max_size: int):
+        self.max_size = max_size
+        self._entries: OrderedDict[str, tuple[float | None, bytes]] = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: str) -> bytes | None:
+        with self._lock:
+            entry = self._entries.get(key, None)
+            if entry is None:
+                return None
+            expires_at, value = entry
+            if expires_at is not None and expires_at <= time.monotonic():
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return value
+
+    def set(self, key: str, value: bytes, ttl: float = None) -> None:
+        expires_at = time.monotonic() + ttl if ttl is not None else None
+        with self._lock:
+            self._entries[key] = (expires_at, value)
+            self._entries.move_to_end(key)
+            self._evict()
+
+    def setdefault(self, key: str, value: bytes) -> bytes:
+        with self._lock:
+            if key not in self._entries:
+                self._entries[key] = (None, value)
+            self._entries.move_to_end(key)
+            value = self._entries[key][1]
+            self._evict()
+            return value
+
+    def _evict(self) -> None:
+        while len(self._entries) > self.max_size:
+            self._entries.popitem(last=False)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+
+
+class RedisBackend:
+    """
+    shared by every API process. configure the server with an eviction policy (ex: maxmemory-policy allkeys-lru),
+    entries of terminal workflows and versions do not expire.
+    """
+
+    def __init__(self, url: str, prefix: str = 'rhythm_api:'):
+        # optional dependency: pip install redis
+        import redis
+        self.client = redis.Redis.from_url(url)
+        self.prefix = prefix
+
+    def get(self, key: str) -> bytes | None:
+        return self.client.get(self.prefix + key)
+
+    def set(self, key: str, value: bytes, ttl: float = None) -> None:
+        self.client.set(self.prefix + key, value, px=int(ttl * 1000) if ttl is not None else None)
+
+    def setdefault(self, key: str, value: bytes) -> bytes:
+        self.client.set(self.prefix + key, value, nx=True)
+        return self.client.get(self.prefix + key) or value
+
+    def clear(self) -> None:
+        for key in self.client.scan_iter(match=self.prefix + '*'):
+            self.client.delete(key)
+
+
+def etag(body: bytes) -> str:
+    return f'"{hashlib.sha1(body).hexdigest()}"'
+
+
+def etag_matches(if_none_match: str | None, tag: str) -> bool:
+    """
+    :param if_none_match: value of the If-None-Match request header
+    """
+    if not if_none_match:
+        return False
+    candidates = [c.strip().removeprefix('W/') for c in if_none_match.split(',')]
+    return '*' in candidates or tag in candidates
+
+
+class ResponseCache:
+    def __init__(self, backend, active_ttl: float, list_ttl: float, terminal_ttl: float = None):
+        """
+        :param terminal_ttl: seconds to cache workflows in a terminal state, None - until invalidated
+        """
+        self.backend = backend
+        self.active_ttl = active_ttl
+        self.list_ttl = list_ttl
+        self.terminal_ttl = terminal_ttl
+        self.hits = 0
+        self.misses = 0
+
+    def _version(self, name: str) -> str:
+        return self.backend.setdefault(f'version:{name}', uuid.uuid4().hex.encode()).decode()
+
+    def workflow_key(self, workflow_id: str, **params) -> str:
+        """
+        key of a response of GET /workflows/{workflow_id}, read it before computing the response to store
+        """
+        return f'workflow:{workflow_id}:{self._version(workflow_id)}:{self._params(params)}'
+
+    def list_key(self, **params) -> str:
+        """
+        key of a response of GET /workflows, read it before computing the response to store
+        """
+        return f'list:{self._version("lists")}:{self._params(params)}'
+
+    def key(self, name: str, **params) -> str:
+        """
+        key of a response that is not invalidated, only expires
+        """
+        return f'{name}:{self._params(params)}'
+
+    @staticmethod
+    def _params(params: dict) -> str:
+        return json.dumps(jsonable_encoder(params), sort_keys=True, separators=(',', ':'))
+
+    def get(self, key: str) -> tuple[str, bytes] | None:
+        """
+        :return: (etag, body) of the cached response
+        """
+        entry = self.backend.get(key)
+        if entry is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        tag, body = entry.split(b'\n', 1)
+        return tag.decode(), body
+
+    def put(self, key: str, body: bytes, ttl: float = None) -> str:
+        """
+        :return: etag of the response
+        """
+        tag = etag(body)
+        self.backend.set(key, tag.encode() + b'\n' + body, ttl=ttl)
+        return tag
+
+    def workflow_ttl(self, workflow: dict, fields: dict = None) -> float | None:
+        """
+        :param workflow: embellished workflow, pruned to fields
+        :param fields: selection of rhythm_api.sparse the workflow was pruned to
+        """
+        return self.terminal_ttl if settled(workflow, fields) else self.active_ttl
+
+    def invalidate(self, workflow_ids: list[str]) -> None:
+        """
+        drop the cached responses of workflows, and of every list since they may include them
+        """
+        for workflow_id in workflow_ids:
+            self.backend.set(f'version:{workflow_id}', uuid.uuid4().hex.encode())
+        self.invalidate_lists()
+
+    def invalidate_lists(self) -> None:
+        self.backend.set('version:lists', uuid.uuid4().hex.encode())
+
+    async def response(self, request: Request, key: str, compute: Callable[[], Awaitable],
+                       ttl: Callable[[Any], float | None]) -> Response:
+        """
+        serve the cached response, or compute and cache it.
+        clients that send the ETag of the response in If-None-Match get a 304 without a body.
+
+        :param key: from workflow_key / list_key
+        :param compute: async function that returns the content of the response
+        :param ttl: seconds to cache the content for, None for no expiry
+        """
+        entry = self.get(key)
+        if entry is None:
+            content = await compute()
+            with metrics.stage('serialization'):
+                body = encoding.dumps(content)
+            tag = self.put(key, body, ttl=ttl(content))
+        else:
+            tag, body = entry
+        if etag_matches(request.headers.get('if-none-match', None), tag):
+            return Response(status_code=304, headers={'ETag': tag})
+        return Response(content=body, media_type='application/json', headers={'ETag': tag})
+
+    def stats(self) -> dict:
+        return {'hits': self.hits, 'misses': self.misses}
+
+
+def create_cache() -> ResponseCache:
+    cache_config = config['cache']
+    if cache_config['backend'] == 'redis':
+        backend = RedisBackend(cache_config['redis_url'])
+        terminal_ttl = None
+    else:
+        backend = MemoryBackend(cache_config['max_size'])
+        terminal_ttl = cache_config['memory_terminal_ttl']
+    return ResponseCache(backend, active_ttl=cache_config['active_ttl'], list_ttl=cache_config['list_ttl'],
+                         terminal_ttl=terminal_ttl)
+
+
+response_cache = create_cache()
@@ -4,6 +4,154 @@ config = {
             'iss': 'localhost',
             'pub': 'keys/auth.pub',
             'key': 'keys/auth.key',
+            # validated tokens are cached for at most ttl seconds, and never past their exp claim
+            'cache': {
+                'max_size': 1024,
+                'ttl': 300,
+            }
         }
+    },
+    'server': {
+        # rhythm_api.serve - gunicorn with uvicorn workers
+        'host': '0.0.0.0',
+        'port': 5001,
+        # path prefix of the API behind a proxy, ex: /rhythm
+        'root_path': '',
+        # worker processes, None - one per available core
+        'workers': None,
+        # threads per worker that run the sync handlers (AnyIO's default is 40).
+        # blocking mongo calls hold a thread, keep it in line with mongo.pool.maxPoolSize
+        'threadpool_size': 100,
+        # seconds to keep idle connections open, and the number of pending connections the socket queues
+        'keepalive': 5,
+        'backlog': 2048,
+        # seconds a worker can be silent before it is restarted
+        'timeout': 60,
+        # on SIGTERM, seconds in-flight requests have to complete before the workers are killed
+        'graceful_timeout': 30,
+        # restart a worker after this many requests (plus up to jitter), 0 - never
+        'max_requests': 0,
+        'max_requests_jitter': 0,
+        # query mongo before accepting traffic, so that the first requests do not open the connections
+        'warm_up': True,
+    },
+    'mongo': {
+        # keyword arguments of the mongo client shared by the API, the celery result backend and sca_rhythm
+        # (rhythm_api.resources). one pool per API process
+        # https://pymongo.readthedocs.io/en/stable/api/pymongo/mongo_client.html
+        'pool': {
+            'maxPoolSize': 100,
+            'minPoolSize': 10,
+            'maxIdleTimeMS': 60000,
+            'waitQueueTimeoutMS': 10000,
+            'serverSelectionTimeoutMS': 10000,
+        },
+        # read preferences of the read-only endpoints that can be served from a secondary, by name
+        # (rhythm_api.resources.read_preference). every other read, and every write, goes to the primary:
+        # submission, pause / resume, GET /workflows/{workflow_id} and the event streams.
+        # mode: primary, primaryPreferred, secondary, secondaryPreferred or nearest
+        # max_staleness_seconds: skip secondaries that lag further behind the primary, at least 90. None - no bound
+        # tags: tag sets of the members to read from, ex: [{'use': 'reporting'}]
+        # cached lists (cache.list_ttl) add to the staleness of the lists read from a secondary
+        'read_preferences': {
+            # GET /workflows, GET /workflows/search
+            'listing': {'mode': 'secondaryPreferred', 'max_staleness_seconds': 90},
+            # GET /workflows/counts_by_status
+            'counts': {'mode': 'secondaryPreferred', 'max_staleness_seconds': 90},
+            # GET /workflows/export
+            'export': {'mode': 'secondaryPreferred', 'max_staleness_seconds': 90},
+            # GET /tasks/active, GET /tasks/unique
+            'tasks': {'mode': 'secondaryPreferred', 'max_staleness_seconds': 90},
+            # GET /analytics/steps
+            'analytics': {'mode': 'secondaryPreferred', 'max_staleness_seconds': 90},
+        },
+        # create the indexes declared in rhythm_api.indexes when the API starts. existing indexes are left as they are
+        'apply_indexes_on_startup': True,
+    },
+    'cache': {
+        # rhythm_api.cache - responses of GET /workflows and GET /workflows/{workflow_id}
+        # memory - per process, with several API processes (server.workers) a workflow changed through one of them
+        #   is served stale by the others until its entries expire. use redis instead.
+        # redis - shared by all processes, requires the redis package
+        'backend': 'memory',
+        'redis_url': 'redis://localhost:6379/0',
+        # entries of the memory backend, 0 disables caching
+        'max_size': 10000,
+        # seconds to cache workflows that are not in a terminal state. terminal workflows are cached until invalidated
+        # with redis, and for memory_terminal_ttl seconds with memory, whose invalidations other processes do not see
+        'active_ttl': 2,
+        'memory_terminal_ttl': 30,
+        # seconds to cache pages of workflows
+        'list_ttl': 2,
+    },
+    'tasks': {
+        # seconds to cache the steps served by GET /tasks/unique
+        'steps_ttl': 60,
+        # most tasks GET /tasks/active returns in one page
+        'max_active_limit': 1000,
+    },
+    'events': {
+        # seconds between keep-alive comments on idle event streams
+        'heartbeat_interval': 15,
+        # rhythm_api.watcher.WorkflowWatcher
+        'watcher': {
+            'poll_interval': 2,
+            'overlap': 60,
+            'queue_size': 100,
+            'max_snapshots': 10000,
+        }
+    },
+    'workflows': {
+        # most workflows GET /workflows and GET /workflows/search return in one page
+        'max_list_limit': 1000,
+        # GET /workflows?count=estimated stops counting filtered workflows at this number
+        'estimated_count_limit': 10000,
+        # most workflows POST /workflows/bulk accepts in one request, and the bulk endpoints act on
+        'max_bulk_size': 1000,
+        # workflows paused / resumed concurrently by the bulk endpoints
+        'bulk_concurrency': 8,
+        # workflows deleted per batch by POST /workflows/bulk/delete
+        'delete_batch_size': 500,
+        # workflows read and joined with their task runs at a time by GET /workflows/export
+        'export_batch_size': 500,
+        'max_export_batch_size': 10000,
+        # accept steps with a group (rhythm_api.groups). only enable once every worker that runs the tasks of
+        # grouped workflows uses rhythm_api.groups.WorkflowTask as their base class instead of
+        # sca_rhythm.WorkflowTask: with sca_rhythm's, they run the steps one after the other and can start a step
+        # twice. steps with a group are rejected with a 400 while it is False
+        'groups_enabled': False,
+    },
+    'admission': {
+        # rhythm_api.admission - limits on workflow submissions, rejected submissions get a 429
+        'enabled': True,
+        # token bucket per caller (JWT sub): workflows per second, and the most submitted at once. None - no limit
+        # kept per API process
+        'rate': 50,
+        'burst': 1000,
+        # most PENDING / STARTED workflows per app_id, None - no limit
+        'max_active': None,
+        # Retry-After of submissions rejected for max_active
+        'active_retry_after': 60,
+        # max_active is not applied while the heartbeat of the status counters watcher is older than this (seconds),
+        # the counters do not follow the workers without it
+        'counters_heartbeat_timeout': 120,
+        # overrides by sub or app_id, ex: {'my-app': {'rate': 100, 'burst': 2000, 'max_active': 10000}}
+        'limits': {},
+    },
+    'retention': {
+        # rhythm_api.retention - workflows in a terminal state that were not updated for archive_after_days are
+        # archived with their tasks and deleted. None keeps them forever
+        'archive_after_days': None,
+        # app_id -> archive_after_days, overrides archive_after_days for the app
+        'apps': {},
+        # workflows archived at a time
+        'batch_size': 500,
+        # collection - compressed documents in workflow_archive
+        # files - gzipped NDJSON files under archive_dir, indexed in workflow_archive. the API reads them back,
+        #   archive_dir (/app/archive in the image) is a volume of the api and retention services
+        'target': 'collection',
+        'archive_dir': 'archive',
+        # days to keep archived workflows of the collection target, None keeps them forever
+        'expire_archived_after_days': None,
     }
 }
@@ -0,0 +1,230 @@
+import datetime
+import logging
+import time
+import uuid
+from collections import Counter
+
+import pymongo
+from bson import Timestamp
+from pymongo.errors import BulkWriteError, OperationFailure
+
+logger = logging.getLogger(__name__)
+
+# Materialized workflow counts per (app_id, status) that back GET /workflows/counts_by_status.
+#
+# workflow_status_counts - {app_id, status, count}, one document per (app_id, status)
+# workflow_status_ledger - {_id: workflow_id, app_id, status}, the status each workflow is counted under
+#
+# The ledger makes every update idempotent: a status is only moved from one counter to another
+# if it differs from the status the workflow is currently counted under. So the same transition can be
+# recorded by the API and by the watcher, or replayed after a restart, without double counting.
+# If the counters ever drift (ex: a crash between the ledger update and the counter update), reconcile rebuilds them.
+#
+# The statuses the workers set are only counted by watch (rhythm_api.scripts.status_counters watch). It saves a
+# heartbeat in its sync_state document at least every heartbeat_interval seconds, see watcher_alive.
+
+COUNTS = 'workflow_status_counts'
+LEDGER = 'workflow_status_ledger'
+STATE = 'sync_state'
+STATE_ID = 'workflow_status_counts'
+
+
+def _inc_ops(app_id: str | None, status: str | None, n: int) -> list:
+    if status is None:
+        return []
+    return [pymongo.UpdateOne({'app_id': app_id, 'status': status}, {'$inc': {'count': n}}, upsert=True)]
+
+
+def record_status(db, workflow_id: str, app_id: str | None, status: str | None) -> None:
+    """
+    count the workflow under status, moving it from the status it was counted under before
+    """
+    prev = db.get_collection(LEDGER).find_one_and_update(
+        {'_id': workflow_id},
+        {'$set': {'app_id': app_id, 'status': status}},
+        upsert=True
+    )
+    prev_app_id, prev_status = (prev.get('app_id', None), prev.get('status', None)) if prev else (app_id, None)
+    if (prev_app_id, prev_status) == (app_id, status):
+        return
+    ops = _inc_ops(prev_app_id, prev_status, -1) + _inc_ops(app_id, status, 1)
+    if ops:
+        db.get_collection(COUNTS).bulk_write(ops, ordered=False)
+
+
+def record_created(db, workflows: list[dict]) -> None:
+    """
+    count newly inserted workflows, with one write per collection
+    """
+    if len(workflows) == 0:
+        return
+    entries = [
+        {'_id': wf['_id'], 'app_id': wf.get('app_id', None), 'status': wf.get('_status', None)}
+        for wf in workflows
+    ]
+    failed = set()
+    try:
+        db.get_collection(LEDGER).insert_many(entries, ordered=False)
+    except BulkWriteError as e:
+        # already recorded, ex: by the watcher
+        failed = {err['index'] for err in e.details['writeErrors']}
+
+    increments = Counter(
+        (entry['app_id'], entry['status'])
+        for i, entry in enumerate(entries)
+        if i not in failed
+    )
+    ops = [op for (app_id, status), n in increments.items() for op in _inc_ops(app_id, status, n)]
+    if ops:
+        db.get_collection(COUNTS).bulk_write(ops, ordered=False)
+
+
+def record_deletes(db, workflow_ids: list[str]) -> None:
+    """
+    stop counting deleted workflows.
+
+    the API and the watcher can both record the same delete, so the ledger entries are first claimed
+    with a token. only the entries claimed by this call are decremented.
+    """
+    if len(workflow_ids) == 0:
+        return
+    ledger = db.get_collection(LEDGER)
+    claim = str(uuid.uuid4())
+    ledger.update_many({'_id': {'$in': workflow_ids}, 'deleted_by': None}, {'$set': {'deleted_by': claim}})
+    claimed = {'_id': {'$in': workflow_ids}, 'deleted_by': claim}
+    entries = list(ledger.find(claimed))
+    ledger.delete_many(claimed)
+
+    decrements = Counter((entry.get('app_id', None), entry.get('status', None)) for entry in entries)
+    ops = [op for (app_id, status), n in decrements.items() for op in _inc_ops(app_id, status, -n)]
+    if ops:
+        db.get_collection(COUNTS).bulk_write(ops, ordered=False)
+
+
+def reconcile(db) -> None:
+    """
+    rebuild the ledger and the counters from workflow_meta
+    """
+    db.get_collection('workflow_meta').aggregate([
+        {
+            '$project': {
+                'app_id': 1,
+                'status': '$_status'
+            }
+        },
+        {
+            '$out': LEDGER
+        }
+    ])
+    db.get_collection(LEDGER).aggregate([
+        {
+            '$match': {
+                'status': {
+                    '$ne': None
+                }
+            }
+        },
+        {
+            '$group': {
+                '_id': {
+                    'app_id': '$app_id',
+                    'status': '$status'
+                },
+                'count': {
+                    '$sum': 1
+                }
+            }
+        },
+        {
+            '$project': {
+                '_id': 0,
+                'app_id': '$_id.app_id',
+                'status': '$_id.status',
+                'count': 1
+            }
+        },
+        {
+            '$out': COUNTS
+        }
+    ])
+
+
+def _save_state(db, **state) -> None:
+    db.get_collection(STATE).update_one({'_id': STATE_ID}, {'$set': state}, upsert=True)
+
+
+def watcher_alive(db, timeout: float) -> bool:
+    """
+    whether watch has saved its heartbeat in the last timeout seconds
+    """
+    state = db.get_collection(STATE).find_one({'_id': STATE_ID}, {'heartbeat_at': 1}) or {}
+    heartbeat_at = state.get('heartbeat_at', None)
+    return heartbeat_at is not None and heartbeat_at > datetime.datetime.utcnow() - datetime.timedelta(seconds=timeout)
+
+
+def watch_change_stream(db, resume_token=None, since: datetime.datetime = None, heartbeat_interval: float = 10) -> None:
+    """
+    apply every insert / update / delete of workflow_meta to the counters. requires a replica set.
+    the stream resumes after resume_token, or if there is none, starts at since.
+    """
+    pipeline = [{'$match': {'operationType': {'$in': ['insert', 'update', 'replace', 'delete']}}}]
+    start_at = Timestamp(since, 0) if resume_token is None and since is not None else None
+    with db.get_collection('workflow_meta').watch(pipeline,
+                                                  full_document='updateLookup',
+                                                  resume_after=resume_token,
+                                                  start_at_operation_time=start_at,
+                                                  max_await_time_ms=int(heartbeat_interval * 1000)) as stream:
+        while stream.alive:
+            # None when there was no change for heartbeat_interval
+            change = stream.try_next()
+            if change is not None:
+                workflow_id = change['documentKey']['_id']
+                workflow = change.get('fullDocument', None)
+                if change['operationType'] == 'delete':
+                    record_deletes(db, [workflow_id])
+                elif workflow is not None:
+                    record_status(db, workflow_id, workflow.get('app_id', None), workflow.get('_status', None))
+            _save_state(db, resume_token=stream.resume_token, heartbeat_at=datetime.datetime.utcnow())
+
+
+def watch_polling(db, since: datetime.datetime, interval: float = 5, overlap: float = 60) -> None:
+    """
+    fallback for standalone servers: poll for workflows created or updated since the last poll.
+
+    created_at / updated_at are set by the celery workers' clocks, so every poll re-reads
+    the last "overlap" seconds. record_status is idempotent, re-reading is harmless.
+    deletes are recorded by the API which is the only path that deletes workflows.
+    """
+    wf_col = db.get_collection('workflow_meta')
+    while True:
+        start = since - datetime.timedelta(seconds=overlap)
+        cursor = wf_col.find(
+            {'$or': [{'updated_at': {'$gt': start}}, {'created_at': {'$gt': start}}]},
+            {'app_id': 1, '_status': 1, 'created_at': 1, 'updated_at': 1}
+        )
+        for workflow in cursor:
+            record_status(db, workflow['_id'], workflow.get('app_id', None), workflow.get('_status', None))
+            since = max(since, workflow.get('updated_at', None) or since, workflow.get('created_at', None) or since)
+        _save_state(db, since=since, heartbeat_at=datetime.datetime.utcnow())
+        time.sleep(interval)
+
+
+def watch(db, poll_interval: float = 5) -> None:
+    """
+    keep the counters up to date with workflow_meta. reconciles first if the counters have never been built.
+    """
+    state = db.get_collection(STATE).find_one({'_id': STATE_ID})
+    if state is None:
+        started_at = datetime.datetime.utcnow()
+        reconcile(db)
+        state = {'since': started_at}
+        _save_state(db, **state)
+
+    try:
+        watch_change_stream(db, resume_token=state.get('resume_token', None), since=state.get('since', None))
+    except OperationFailure as e:
+        # 40573 - The $changeStream stage is only supported on replica sets
+        if e.code != 40573:
+            raise
+        logger.warning('change streams are not supported, falling back to polling')
+        watch_polling(db, since=state.get('since', None) or datetime.datetime.utcnow(), interval=poll_interval)
@@ -0,0 +1,53 @@
+import datetime
+import decimal
+import enum
+import uuid
+
+import orjson
+from bson import ObjectId
+from fastapi.responses import JSONResponse
+from pydantic import BaseModel
+
+# Serializes mongo documents to JSON in one pass with orjson instead of
+# fastapi's jsonable_encoder (a recursive copy of the whole tree) followed by json.dumps.
+# The output is the same as before: datetimes keep the API's format, ObjectIds are strings.
+
+# https://stackoverflow.com/a/69541044
+DATETIME_FORMAT = '%Y-%m-%dT%H:%M:%S.%fZ'
+
+OPTIONS = orjson.OPT_PASSTHROUGH_DATETIME | orjson.OPT_NON_STR_KEYS
+
+
+def default(obj):
+    # called by orjson for the types it does not serialize itself, and for datetimes (OPT_PASSTHROUGH_DATETIME)
+    if isinstance(obj, datetime.datetime):
+        return obj.strftime(DATETIME_FORMAT)
+    if isinstance(obj, (datetime.date, datetime.time)):
+        return obj.isoformat()
+    if isinstance(obj, (ObjectId, uuid.UUID)):
+        return str(obj)
+    if isinstance(obj, BaseModel):
+        return obj.dict()
+    if isinstance(obj, (set, frozenset)):
+        return list(obj)
+    if isinstance(obj, bytes):
+        return obj.decode()
+    if isinstance(obj, decimal.Decimal):
+        return float(obj)
+    if isinstance(obj, enum.Enum):
+        return obj.value
+    raise TypeError(f'Object of type {type(obj).__name__} is not JSON serializable')
+
+
+def dumps(content) -> bytes:
+    return orjson.dumps(content, default=default, option=OPTIONS)
+
+
+class ORJSONResponse(JSONResponse):
+    """
+    response class of the app. handlers that return large documents return it directly,
+    which skips fastapi's jsonable_encoder
+    """
+
+    def render(self, content) -> bytes:
+        return dumps(content)
@@ -0,0 +1,53 @@
+import zlib
+from typing import AsyncIterator
+
+import pymongo
+
+from rhythm_api import encoding
+from rhythm_api.hydration import all_referenced_task_ids, assemble, async_fetch_tasks
+
+# Export of workflows as newline-delimited JSON, one embellished workflow per line.
+# Workflows are read from one cursor in created_at order and their task runs are joined batch_size workflows
+# at a time, so memory use depends on the batch size and not on the number of exported workflows.
+
+
+async def export_workflows(wf_col, task_col, query: dict, batch_size: int,
+                           last_task_run=True, prev_task_runs=False) -> AsyncIterator[bytes]:
+    """
+    :return: chunks of NDJSON, one per batch
+    """
+    # created_at then _id, backed by the listing sort indexes. an interrupted export can be restarted
+    # from the created_at of the last received workflow
+    cursor = wf_col.find(query) \
+        .sort([('created_at', pymongo.ASCENDING), ('_id', pymongo.ASCENDING)]) \
+        .batch_size(batch_size)
+
+    batch = []
+    async for wf in cursor:
+        batch.append(wf)
+        if len(batch) == batch_size:
+            yield await _export_batch(task_col, batch, last_task_run, prev_task_runs)
+            batch = []
+    if batch:
+        yield await _export_batch(task_col, batch, last_task_run, prev_task_runs)
+
+
+async def _export_batch(task_col, batch: list[dict], last_task_run, prev_task_runs) -> bytes:
+    wf_docs = {wf['_id']: wf for wf in batch}
+    tasks = await async_fetch_tasks(task_col, all_referenced_task_ids(wf_docs, prev_task_runs=prev_task_runs))
+    workflows = assemble(list(wf_docs.keys()), wf_docs, tasks,
+                         last_task_run=last_task_run, prev_task_runs=prev_task_runs)
+    return b''.join(encoding.dumps(wf) + b'\n' for wf in workflows)
+
+
+async def gzip_chunks(chunks: AsyncIterator[bytes], level: int = 6) -> AsyncIterator[bytes]:
+    """
+    gzip a stream of chunks incrementally
+    """
+    # wbits 31 - gzip header and trailer
+    compressor = zlib.compressobj(level, zlib.DEFLATED, 31)
+    async for chunk in chunks:
+        compressed = compressor.compress(chunk)
+        if compressed:
+            yield compressed
+    yield compressor.flush()
@@ -0,0 +1,291 @@
+import datetime
+import logging
+
+import celery.states
+import sca_rhythm
+from pymongo import ReturnDocument
+
+logger = logging.getLogger(__name__)
+
+# Parallel groups: consecutive steps with the same `group` run at the same time, and the step after them starts
+# once all of them have succeeded. ex: steps
+#   stage, validate_a (group: validate), validate_b (group: validate), archive
+#   -> stage, then validate_a and validate_b, then archive
+# The steps of a group get the same args, the first element of the return value of the step before the group.
+# The step after a group gets the first element of the return value of the task that completed the group, tasks of
+# a group are expected to return the same first element (ex: the dataset id), as they do in linear workflows.
+#
+# Workflows are advanced by their tasks (sca_rhythm.WorkflowTask), which only know about linear steps.
+# Tasks of workflows with groups need WorkflowTask below as their base class:
+# - it starts every step of the next stage
+# - the tasks of a group join with an atomic update of workflow_meta, exactly one of them starts the next stage
+# - tasks of a group update the same workflow concurrently, so it writes single fields where sca_rhythm writes
+#   the whole document
+# Workflows without groups are run by sca_rhythm as before.
+#
+# This module is imported by workers, keep its imports to celery, pymongo and sca_rhythm.
+
+# names of the steps of a group that have succeeded, by group
+JOINS_FIELD = 'group_joins'
+
+RUNNING_STATES = [celery.states.STARTED, celery.states.RETRY, celery.states.PENDING]
+
+# times a task that starts recomputes the workflow status when another task of the workflow changed it meanwhile
+STATUS_UPDATE_ATTEMPTS = 5
+
+
+def has_groups(steps: list[dict]) -> bool:
+    return any(step.get('group', None) is not None for step in steps)
+
+
+def stages(steps: list[dict]) -> list[list[int]]:
+    """
+    indices of the steps by stage: consecutive steps of a group make one stage, every other step is a stage of its own
+    """
+    _stages = []
+    for i, step in enumerate(steps):
+        group = step.get('group', None)
+        if group is not None and len(_stages) > 0 and steps[_stages[-1][0]].get('group', None) == group:
+            _stages[-1].append(i)
+        else:
+            _stages.append([i])
+    return _stages
+
+
+def validate_groups(steps: list[dict]) -> None:
+    seen = set()
+    for stage in stages(steps):
+        group = steps[stage[0]].get('group', None)
+        if group is None:
+            continue
+        assert '.' not in group and not group.startswith('$'), f'group {group} cannot contain "." or start with "$"'
+        assert group not in seen, f'steps of group {group} are not consecutive'
+        seen.add(group)
+
+
+def stage_status(step_statuses: list[str], first: bool) -> str:
+    """
+    status of a stage that has not succeeded. for a single step, same as sca_rhythm.Workflow.get_workflow_status.
+    a failed or revoked step fails or revokes its group, while the other steps of the group can still be running
+
+    :param first: whether this is the first stage of the workflow
+    """
+    if first and all(s == celery.states.PENDING for s in step_statuses):
+        return celery.states.PENDING
+    remaining = [s for s in step_statuses if s != celery.states.SUCCESS]
+    for status in [celery.states.FAILURE, celery.states.REVOKED]:
+        if status in remaining:
+            return status
+    return next((s for s in remaining if s not in RUNNING_STATES), celery.states.STARTED)
+
+
+def pending_stage(_stages: list[list[int]], step_statuses: list[str]) -> int | None:
+    """
+    index of the first stage with a step that has not succeeded, None if all steps have succeeded
+    """
+    return next((k for k, stage in enumerate(_stages) if any(step_statuses[i] != celery.states.SUCCESS for i in stage)),
+                None)
+
+
+def stage_running(_stages: list[list[int]], step_statuses: list[str]) -> bool:
+    """
+    whether a step of the first stage that has not succeeded is still queued or running,
+    ex: the other steps of a group that has failed
+    """
+    k = pending_stage(_stages, step_statuses)
+    return k is not None and any(step_statuses[i] in RUNNING_STATES for i in _stages[k])
+
+
+class Workflow(sca_rhythm.Workflow):
+    """
+    sca_rhythm.Workflow that runs the steps of a group in parallel
+    """
+
+    def step_index(self, step_name: str) -> int:
+        return next(i for i, step in enumerate(self.workflow['steps']) if step['name'] == step_name)
+
+    def set_fields(self, fields: dict) -> None:
+        now = datetime.datetime.utcnow()
+        self.workflow.update(fields)
+        self.workflow['updated_at'] = now
+        self.wf_col.update_one({'_id': self.workflow['_id']}, {'$set': {**fields, 'updated_at': now}})
+
+    def get_workflow_status(self, starting_step: str = None) -> celery.states.state:
+        """
+        status of the first stage that has not succeeded, see stage_status
+
+        :param starting_step: name of a step whose task is starting, counted as STARTED.
+            the backend has no status for the task yet, or the status of the previous task run of the step
+        """
+        steps = self.workflow['steps']
+        if not has_groups(steps):
+            return super().get_workflow_status()
+        step_statuses = [
+            celery.states.STARTED if step['name'] == starting_step else self.get_step_status(step) for step in steps
+        ]
+        _stages = stages(steps)
+        k = pending_stage(_stages, step_statuses)
+        if k is None:
+            return celery.states.SUCCESS
+        return stage_status([step_statuses[i] for i in _stages[k]], first=k == 0)
+
+    def get_pending_stage(self) -> list[tuple[int, str]] | None:
+        """
+        (index, status) of the steps of the first stage that has not succeeded, None if all steps have succeeded
+        """
+        steps = self.workflow['steps']
+        _stages = stages(steps)
+        step_statuses = [self.get_step_status(step) for step in steps]
+        k = pending_stage(_stages, step_statuses)
+        if k is None:
+            return None
+        return [(i, step_statuses[i]) for i in _stages[k]]
+
+    def pause(self, refresh=True):
+        """
+        revoke the running tasks of the pending stage
+        """
+        if not has_groups(self.workflow['steps']):
+            return super().pause(refresh=refresh)
+        if refresh:
+            self.refresh()
+
+        revoked = []
+        for i, status in self.get_pending_stage() or []:
+            step = self.workflow['steps'][i]
+            task_runs = step.get('task_runs', None) or []
+            if status not in [celery.states.SUCCESS, celery.states.FAILURE] and len(task_runs) > 0:
+                task_id = task_runs[-1]['task_id']
+                self.app.control.revoke(task_id, terminate=True)
+                revoked.append({'task_id': task_id, 'task': step['task'], 'name': step['name']})
+        if len(revoked) == 0:
+            return {'paused': False}
+
+        self.set_fields({'_status': celery.states.REVOKED})
+        return {
+            'paused': True,
+            'revoked_step': revoked[0],
+            'revoked_steps': revoked
+        }
+
+    def resume(self, force: bool = False, args: list = None, refresh=True) -> dict:
+        """
+        submit new tasks for the steps of the pending stage that have FAILED / REVOKED (all of its steps that have
+        not succeeded with force)
+        """
+        if not has_groups(self.workflow['steps']):
+            return super().resume(force=force, args=args, refresh=refresh)
+        if refresh:
+            self.refresh()
+        if self.is_resume_locked():
+            return {'resumed': False}
+
+        restart = [
+            i for i, status in self.get_pending_stage() or []
+            if status in [celery.states.FAILURE, celery.states.REVOKED] or (force and status != celery.states.SUCCESS)
+        ]
+        if len(restart) == 0:
+            return {'resumed': False}
+
+        restarted = []
+        for i in restart:
+            step = self.workflow['steps'][i]
+            task_inst = self.get_last_run_task_instance(step)
+            assert not (task_inst is None and args is None), 'no args are provided and there is no last run task'
+            task_args = task_inst['args'] if task_inst is not None else args
+            self.wf_send_task(step, step_position=i + 1, task_args=task_args)
+            restarted.append({'name': step['name'], 'task': step['task']})
+
+        self.set_fields({self.RESUME_LOCK_ATTR: datetime.datetime.utcnow()})
+        return {
+            'resumed': True,
+            'restarted_step': restarted[0],
+            'restarted_steps': restarted
+        }
+
+    def on_step_start(self, step_name: str, task_id: str) -> None:
+        if not has_groups(self.workflow['steps']):
+            return super().on_step_start(step_name, task_id)
+
+        i = self.step_index(step_name)
+        # the task run is not added again if the task is resubmitted with the same id
+        self.wf_col.update_one(
+            {'_id': self.workflow['_id'], f'steps.{i}.task_runs.task_id': {'$ne': task_id}},
+            {'$push': {f'steps.{i}.task_runs': {'date_start': datetime.datetime.utcnow(), 'task_id': task_id}}}
+        )
+
+        # a failed or revoked step of the group keeps the workflow FAILURE / REVOKED while this step runs.
+        # the status is only written if no other task of the workflow wrote one since it was read
+        for _ in range(STATUS_UPDATE_ATTEMPTS):
+            self.refresh()
+            prev_status = self.workflow.get('_status', None)
+            fields = {'_status': self.get_workflow_status(starting_step=step_name)}
+            if self.RESUME_LOCK_ATTR in self.workflow:
+                fields[self.RESUME_LOCK_ATTR] = None
+            now = datetime.datetime.utcnow()
+            result = self.wf_col.update_one({'_id': self.workflow['_id'], '_status': prev_status},
+                                            {'$set': {**fields, 'updated_at': now}})
+            if result.matched_count > 0:
+                self.workflow.update(fields)
+                self.workflow['updated_at'] = now
+                return
+        logger.warning('status of workflow %s was not updated when step %s started, it kept changing',
+                       self.workflow['_id'], step_name)
+
+    def join(self, step_name: str) -> bool:
+        """
+        record that the step of a group has succeeded
+
+        :return: whether this completed the group. False if the step was already recorded
+        """
+        steps = self.workflow['steps']
+        i = self.step_index(step_name)
+        group = steps[i]['group']
+        path = f'{JOINS_FIELD}.{group}'
+        workflow = self.wf_col.find_one_and_update(
+            {'_id': self.workflow['_id'], path: {'$ne': step_name}},
+            {'$addToSet': {path: step_name}, '$set': {'updated_at': datetime.datetime.utcnow()}},
+            return_document=ReturnDocument.AFTER
+        )
+        if workflow is None:
+            return False
+        self.workflow = workflow
+        joined = set(workflow[JOINS_FIELD][group])
+        return all(step['name'] in joined for step in steps if step.get('group', None) == group)
+
+    def on_step_success(self, retval: tuple, step_name: str) -> None:
+        steps = self.workflow['steps']
+        if not has_groups(steps):
+            return super().on_step_success(retval, step_name)
+
+        _stages = stages(steps)
+        i = self.step_index(step_name)
+        k = next(k for k, stage in enumerate(_stages) if i in stage)
+        if len(_stages[k]) > 1 and not self.join(step_name):
+            return
+
+        if k + 1 < len(_stages):
+            for next_step_idx in _stages[k + 1]:
+                self.wf_send_task(steps[next_step_idx], step_position=next_step_idx + 1, task_args=(retval[0],))
+            self.set_fields({})
+        else:
+            self.set_fields({'_status': celery.states.SUCCESS})
+
+    def on_step_failure(self):
+        if not has_groups(self.workflow['steps']):
+            return super().on_step_failure()
+        self.set_fields({'_status': celery.states.FAILURE})
+
+
+class WorkflowTask(sca_rhythm.WorkflowTask):  # noqa
+    """
+    base class of the tasks of workflows with groups, a drop-in replacement of sca_rhythm.WorkflowTask
+    """
+
+    def before_start(self, task_id, args, kwargs):
+        self.id = task_id
+        if 'workflow_id' in kwargs and 'step' in kwargs:
+            self.workflow_id = kwargs['workflow_id']
+            self.step = kwargs['step']
+            self.workflow = Workflow(self.app, self.workflow_id)
+            self.workflow.on_step_start(self.step, task_id)
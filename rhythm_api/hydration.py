@@ -0,0 +1,198 @@
+import datetime
+import json
+import logging
+
+import celery.states
+from sca_rhythm import Workflow
+
+from rhythm_api import groups, metrics, sparse
+
+logger = logging.getLogger(__name__)
+
+
+# Batched equivalent of sca_rhythm.Workflow.get_embellished_workflow.
+# A page of workflows is hydrated with one $in query on workflow_meta and one $in query on celery_taskmeta
+# instead of loading a Workflow per id and reading celery_taskmeta once per task run.
+
+def last_task_run_id(step: dict) -> str | None:
+    task_runs = step.get('task_runs', None) or []
+    if len(task_runs) > 0:
+        return task_runs[-1]['task_id']
+
+
+def referenced_task_ids(workflow: dict, prev_task_runs: bool = False) -> list[str]:
+    """
+    ids of the tasks needed to embellish the workflow.
+    the last task run of every step is always needed to compute step and workflow statuses.
+    """
+    task_ids = []
+    for step in workflow.get('steps', []):
+        task_runs = step.get('task_runs', None) or []
+        runs = task_runs if prev_task_runs else task_runs[-1:]
+        task_ids.extend(run['task_id'] for run in runs)
+    return task_ids
+
+
+def fetch_tasks(task_col, task_ids, projection: dict = None) -> dict[str, dict]:
+    task_ids = list(set(task_ids))
+    if len(task_ids) == 0:
+        return {}
+    return {task['_id']: task for task in task_col.find({'_id': {'$in': task_ids}}, projection)}
+
+
+async def async_fetch_tasks(task_col, task_ids, projection: dict = None) -> dict[str, dict]:
+    task_ids = list(set(task_ids))
+    if len(task_ids) == 0:
+        return {}
+    return {task['_id']: task async for task in task_col.find({'_id': {'$in': task_ids}}, projection)}
+
+
+def task_instance(tasks: dict[str, dict], task_id: str, date_start=None) -> dict | None:
+    """
+    same as Workflow.get_task_instance, but reads the task from the pre-fetched tasks
+    """
+    task = tasks.get(task_id, None)
+    if task is None:
+        return None
+    task = dict(task)
+    task['date_start'] = date_start
+    if 'result' in task and task['result'] is not None:
+        try:
+            task['result'] = json.loads(task['result'])
+        except Exception as e:
+            logger.warning('unable to parse the result json of task %s: %s', task['_id'], e)
+    if 'date_done' in task:
+        try:
+            task['date_done'] = datetime.datetime.strptime(task['date_done'], "%Y-%m-%dT%H:%M:%S.%f")
+        except Exception as e:
+            logger.warning('unable to parse date_done %r of task %s: %s', task['date_done'], task['_id'], e)
+    return task
+
+
+def step_status(step: dict, tasks: dict[str, dict]) -> str:
+    """
+    status of the last task run of the step, PENDING if the step has not run yet.
+    a task without a document in celery_taskmeta is PENDING, which is what the celery backend reports.
+    """
+    task_id = last_task_run_id(step)
+    if task_id is None or task_id not in tasks:
+        return celery.states.PENDING
+    return tasks[task_id]['status']
+
+
+def workflow_status(step_statuses: list[str], stages: list[list[int]] = None) -> tuple[str, int | None]:
+    """
+    :param stages: indices of the steps by stage (rhythm_api.groups.stages), one step per stage by default
+    :return: (workflow status, number of steps done or None if all steps have succeeded)
+    see Workflow.get_workflow_status for the rules, and rhythm_api.groups.stage_status for groups.
+    without groups, the number of steps done is the index of the pending step
+    """
+    stages = stages if stages is not None else [[i] for i in range(len(step_statuses))]
+    k = groups.pending_stage(stages, step_statuses)
+    if k is None:
+        return celery.states.SUCCESS, None
+
+    steps_done = sum(len(stage) for stage in stages[:k])
+    steps_done += sum(1 for i in stages[k] if step_statuses[i] == celery.states.SUCCESS)
+    return groups.stage_status([step_statuses[i] for i in stages[k]], first=k == 0), steps_done
+
+
+def embellish(workflow: dict, tasks: dict[str, dict], last_task_run=True, prev_task_runs=False) -> dict:
+    """
+    Build the same document as Workflow.get_embellished_workflow from a workflow_meta document
+    and the celery_taskmeta documents it references.
+    """
+    step_statuses = [step_status(step, tasks) for step in workflow['steps']]
+    status, steps_done = workflow_status(step_statuses, groups.stages(workflow['steps']))
+
+    steps = []
+    for step, status_ in zip(workflow['steps'], step_statuses):
+        task_runs = step.get('task_runs', None) or []
+        emb_step = {
+            'name': step['name'],
+            'task': step['task'],
+            'status': status_
+        }
+        if step.get('group', None) is not None:
+            emb_step['group'] = step['group']
+        if last_task_run:
+            emb_step['last_task_run'] = None
+            if len(task_runs) > 0:
+                emb_step['last_task_run'] = task_instance(tasks,
+                                                          task_runs[-1]['task_id'],
+                                                          task_runs[-1].get('date_start', None))
+        if prev_task_runs:
+            emb_step['prev_task_runs'] = [
+                task_instance(tasks, t['task_id'], t.get('date_start', None)) for t in task_runs[:-1]
+            ]
+        steps.append(emb_step)
+
+    return {
+        'id': workflow['_id'],
+        'name': workflow.get('name', None),
+        'app_id': workflow.get('app_id', None),
+        'description': workflow.get('description', None),
+        'created_at': workflow.get('created_at', None),
+        'updated_at': workflow.get('updated_at', None),
+        'status': status,
+        'steps_done': steps_done if steps_done is not None else len(steps),
+        'total_steps': len(steps),
+        'steps': steps,
+        Workflow.RESUME_LOCK_ATTR: workflow.get(Workflow.RESUME_LOCK_ATTR, None)
+    }
+
+
+def assemble(workflow_ids: list[str], wf_docs: dict[str, dict], tasks: dict[str, dict],
+             last_task_run=True, prev_task_runs=False, fields: dict = None) -> list[dict]:
+    # the order of workflow_ids is preserved, ids that are no longer in the collection are skipped
+    with metrics.stage('hydration'):
+        return [
+            sparse.select(embellish(wf_docs[wf_id], tasks, last_task_run=last_task_run, prev_task_runs=prev_task_runs),
+                          fields)
+            for wf_id in workflow_ids
+            if wf_id in wf_docs
+        ]
+
+
+def all_referenced_task_ids(wf_docs: dict[str, dict], prev_task_runs=False) -> list[str]:
+    return [
+        task_id
+        for wf in wf_docs.values()
+        for task_id in referenced_task_ids(wf, prev_task_runs=prev_task_runs)
+    ]
+
+
+def fetch_embellished_workflows(wf_col, task_col, workflow_ids: list[str],
+                                last_task_run=True, prev_task_runs=False, fields: dict = None) -> list[dict]:
+    """
+    Embellish a page of workflows with two queries.
+
+    :param fields: selection of rhythm_api.sparse, only the selected fields are read and returned
+    """
+    if len(workflow_ids) == 0:
+        return []
+
+    last_task_run, prev_task_runs = sparse.task_runs(fields, last_task_run, prev_task_runs)
+    wf_docs = {wf['_id']: wf for wf in wf_col.find({'_id': {'$in': workflow_ids}}, sparse.workflow_projection(fields))}
+    tasks = fetch_tasks(task_col, all_referenced_task_ids(wf_docs, prev_task_runs=prev_task_runs),
+                        sparse.task_projection(fields))
+    return assemble(workflow_ids, wf_docs, tasks,
+                    last_task_run=last_task_run, prev_task_runs=prev_task_runs, fields=fields)
+
+
+async def async_fetch_embellished_workflows(wf_col, task_col, workflow_ids: list[str],
+                                            last_task_run=True, prev_task_runs=False,
+                                            fields: dict = None) -> list[dict]:
+    """
+    fetch_embellished_workflows for motor collections
+    """
+    if len(workflow_ids) == 0:
+        return []
+
+    last_task_run, prev_task_runs = sparse.task_runs(fields, last_task_run, prev_task_runs)
+    wf_docs = {wf['_id']: wf async for wf in wf_col.find({'_id': {'$in': workflow_ids}},
+                                                        sparse.workflow_projection(fields))}
+    tasks = await async_fetch_tasks(task_col, all_referenced_task_ids(wf_docs, prev_task_runs=prev_task_runs),
+                                    sparse.task_projection(fields))
+    return assemble(workflow_ids, wf_docs, tasks,
+                    last_task_run=last_task_run, prev_task_runs=prev_task_runs, fields=fields)
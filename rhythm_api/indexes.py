@@ -0,0 +1,115 @@
+import pymongo
+from pymongo import IndexModel
+from pymongo.errors import OperationFailure
+
+from rhythm_api import analytics, counters, retention, search
+from rhythm_api.listing import SortBy
+
+ASC = pymongo.ASCENDING
+
+
+def sort_indexes() -> list[IndexModel]:
+    # GET /workflows sorts on a SortBy field with _id as the tie-breaker,
+    # optionally after an equality match on app_id. keyset pages add a range on (field, _id).
+    models = []
+    for sort_by in SortBy:
+        field = sort_by.value
+        models.append(IndexModel([(field, ASC), ('_id', ASC)], name=f'{field}_1__id_1'))
+        models.append(IndexModel([('app_id', ASC), (field, ASC), ('_id', ASC)], name=f'app_id_1_{field}_1__id_1'))
+    return models
+
+
+# Every index the API relies on, by collection, with the queries that use it.
+INDEXES: dict[str, list[IndexModel]] = {
+    'workflow_meta': [
+        # listing filters without an app_id
+        IndexModel([('_status', ASC)], name='_status_1'),
+        IndexModel([('app_id', ASC)], name='app_id_1'),
+        # bulk operations and status filtered lists: {app_id, _status: {$in}} -> _id
+        IndexModel([('app_id', ASC), ('_status', ASC), ('_id', ASC)], name='app_id_1__status_1__id_1'),
+        # listing sorts, and the watchers' polls on created_at / updated_at
+        *sort_indexes(),
+        # /workflows/search - text search, and equality on step kwargs and args
+        IndexModel([('name', pymongo.TEXT), ('description', pymongo.TEXT)], name='name_text_description_text'),
+        IndexModel([(search.SEARCH_FIELD, ASC)], name=f'{search.SEARCH_FIELD}_1'),
+    ],
+    'celery_taskmeta': [
+        IndexModel([('status', ASC)], name='status_1'),
+        IndexModel([('kwargs.app_id', ASC)], name='kwargs.app_id_1'),
+        # /tasks/unique - distinct('kwargs.step')
+        IndexModel([('kwargs.step', ASC)], name='kwargs.step_1'),
+        # /tasks/unique - steps of an app. only workflow tasks have a step
+        IndexModel([('kwargs.app_id', ASC), ('kwargs.step', ASC)],
+                   name='kwargs.app_id_1_kwargs.step_1',
+                   partialFilterExpression={'kwargs.step': {'$exists': True}}),
+        # /tasks/active - unfinished tasks of an app in step order
+        IndexModel([('kwargs.app_id', ASC), ('status', ASC), ('kwargs.step', ASC), ('_id', ASC)],
+                   name='kwargs.app_id_1_status_1_kwargs.step_1__id_1',
+                   partialFilterExpression={'kwargs.step': {'$exists': True}}),
+        # rhythm_api.analytics.sync - tasks finished since the last sync
+        IndexModel([('date_done', ASC)], name='date_done_1'),
+    ],
+    counters.COUNTS: [
+        # /workflows/counts_by_status
+        IndexModel([('app_id', ASC), ('status', ASC)], name='app_id_1_status_1', unique=True),
+    ],
+    analytics.ROLLUPS: [
+        # rollup upserts
+        IndexModel([('app_id', ASC), ('step', ASC), ('bucket', ASC)], name='app_id_1_step_1_bucket_1', unique=True),
+        # /analytics/steps - time range of an app
+        IndexModel([('app_id', ASC), ('bucket', ASC)], name='app_id_1_bucket_1'),
+    ],
+    analytics.LEDGER: [
+        # ledger entries are only needed while their tasks can be re-read by the overlap of a sync
+        IndexModel([('recorded_at', ASC)], name='recorded_at_1', expireAfterSeconds=7 * 24 * 3600),
+    ],
+    retention.ARCHIVE: [
+        # archived workflows of an app. the optional expiry is created by rhythm_api.retention.run from the config
+        IndexModel([('app_id', ASC), ('archived_at', ASC)], name='app_id_1_archived_at_1'),
+    ],
+}
+
+
+def apply(db) -> dict[str, list[str]]:
+    """
+    create the declared indexes that do not exist yet. existing indexes are left as they are.
+
+    :return: names of the indexes that could not be created, by collection.
+        ex: an index with the same name and different options
+    """
+    errors = {}
+    for collection_name, models in INDEXES.items():
+        collection = db.get_collection(collection_name)
+        for model in models:
+            try:
+                collection.create_indexes([model])
+            except OperationFailure as e:
+                errors.setdefault(collection_name, []).append(f'{model.document["name"]}: {e}')
+    return errors
+
+
+def report(db) -> dict[str, dict[str, list[str]]]:
+    """
+    compare the declared indexes with the ones in the database
+
+    :return: by collection,
+        missing - declared indexes that do not exist,
+        undeclared - existing indexes that are not declared (candidates for removal),
+        unused - existing indexes that have not been used since the server started
+    """
+    result = {}
+    for collection_name, models in INDEXES.items():
+        collection = db.get_collection(collection_name)
+        declared = {model.document['name'] for model in models}
+        existing = set(collection.index_information().keys()) - {'_id_'}
+        unused = [
+            stats['name']
+            for stats in collection.aggregate([{'$indexStats': {}}])
+            if stats['name'] != '_id_' and stats['accesses']['ops'] == 0
+        ]
+        result[collection_name] = {
+            'missing': sorted(declared - existing),
+            'undeclared': sorted(existing - declared),
+            'unused': sorted(unused)
+        }
+    return result
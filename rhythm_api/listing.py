@@ -0,0 +1,298 @@
+import asyncio
+import base64
+import binascii
+import datetime
+import json
+from enum import unique, Enum
+
+import celery.states
+from bson import json_util
+
+from rhythm_api import metrics, sparse
+from rhythm_api.config import config
+from rhythm_api.hydration import embellish
+
+
+def omit_none(d):
+    return {k: v for k, v in d.items() if v is not None}
+
+
+@unique
+class Status(str, Enum):
+    PENDING = celery.states.PENDING
+    STARTED = celery.states.STARTED
+    SUCCESS = celery.states.SUCCESS
+    FAILURE = celery.states.FAILURE
+    REVOKED = celery.states.REVOKED
+    DONE = 'DONE'
+    ACTIVE = 'ACTIVE'
+    EXCEPTION = 'EXCEPTION'
+
+
+def status_query_values(status: Status) -> list[str]:
+    ACTIVE_STATES = [celery.states.PENDING, celery.states.STARTED]
+    DONE_STATES = [celery.states.SUCCESS, celery.states.FAILURE, celery.states.REVOKED]
+    EXCEPTION_STATES = [celery.states.FAILURE, celery.states.REVOKED]
+    if status is not None:
+        if status == Status.DONE:
+            return DONE_STATES
+        elif status == Status.ACTIVE:
+            return ACTIVE_STATES
+        elif status == Status.EXCEPTION:
+            return EXCEPTION_STATES
+        else:
+            return [status.value]
+
+
+@unique
+class SortBy(str, Enum):
+    """
+    workflow_meta fields the list can be sorted on.
+    every field has a matching (field, _id) and (app_id, field, _id) index in mongo/create_indexes.py
+    """
+    CREATED_AT = 'created_at'
+    UPDATED_AT = 'updated_at'
+    STATUS = '_status'
+    NAME = 'name'
+
+
+@unique
+class CountMode(str, Enum):
+    EXACT = 'exact'
+    ESTIMATED = 'estimated'
+    NONE = 'none'
+
+
+def wf_query(status: Status = None, app_id: str = None, workflow_ids: list[str] = None,
+             created_after: datetime.datetime = None, created_before: datetime.datetime = None) -> dict:
+    query = omit_none({
+        'app_id': app_id
+    })
+
+    created_at = omit_none({
+        '$gte': created_after,
+        '$lt': created_before
+    })
+    if created_at:
+        query['created_at'] = created_at
+
+    if status is not None:
+        query['_status'] = {
+            '$in': status_query_values(status)
+        }
+
+    # workflow_ids - non-empty list - search only these workflows
+    # workflow_ids - None - search all workflows - no filter by _id
+    # workflow_ids - empty list - given queries yield no results. results will be an empty list
+    # and response will be []
+    if workflow_ids is not None:
+        query['_id'] = {
+            '$in': workflow_ids
+        }
+    return query
+
+
+def sort_spec(sort_by: SortBy = None, sort_order_asc: bool = True) -> dict:
+    # _id breaks ties between workflows with the same sort key so that pages are stable
+    sort_by = sort_by or SortBy.CREATED_AT
+    direction = 1 if sort_order_asc else -1  # 1 for ascending, -1 for descending
+    return {
+        sort_by.value: direction,
+        '_id': direction
+    }
+
+
+def encode_cursor(sort_by: SortBy, workflow: dict) -> str:
+    """
+    opaque token that points just past the given workflow in the sort order of sort_by
+    """
+    sort_by = sort_by or SortBy.CREATED_AT
+    position = {
+        'k': sort_by.value,
+        'v': workflow.get(sort_by.value, None),
+        'id': workflow['_id']
+    }
+    return base64.urlsafe_b64encode(json_util.dumps(position).encode()).decode()
+
+
+def decode_cursor(sort_by: SortBy, token: str) -> tuple:
+    """
+    :return: (sort key value, _id) of the last workflow of the previous page
+    """
+    sort_by = sort_by or SortBy.CREATED_AT
+    try:
+        position = json_util.loads(base64.urlsafe_b64decode(token.encode()).decode())
+        key, value, _id = position['k'], position['v'], position['id']
+    except (binascii.Error, UnicodeDecodeError, json.JSONDecodeError, TypeError, KeyError):
+        raise AssertionError('Invalid cursor')
+    assert key == sort_by.value, f'cursor was issued for sort_by={key}'
+    return value, _id
+
+
+def after_query(sort_by: SortBy, sort_order_asc: bool, value, _id) -> dict:
+    """
+    range predicate that selects the workflows after (value, _id) in the sort order.
+
+    null / missing sort keys sort before every other value, and range operators ($gt / $lt)
+    never match them, so they need their own branches.
+    """
+    key = (sort_by or SortBy.CREATED_AT).value
+    op = '$gt' if sort_order_asc else '$lt'
+
+    if value is None:
+        branches = [{key: None, '_id': {op: _id}}]
+        if sort_order_asc:
+            branches.append({key: {'$ne': None}})
+    else:
+        branches = [
+            {key: {op: value}},
+            {key: value, '_id': {op: _id}}
+        ]
+        if not sort_order_asc:
+            branches.append({key: None})
+    return {'$or': branches} if len(branches) > 1 else branches[0]
+
+
+async def count_workflows(wf_col, query: dict, count: CountMode) -> int | None:
+    """
+    EXACT counts every match, ESTIMATED reads the collection metadata when there is no filter
+    and otherwise stops counting at config['workflows']['estimated_count_limit'], NONE does not count.
+    """
+    if count == CountMode.NONE:
+        return None
+    if count == CountMode.ESTIMATED:
+        if not query:
+            return await wf_col.estimated_document_count()
+        return await wf_col.count_documents(query, limit=config['workflows']['estimated_count_limit'])
+    return await wf_col.count_documents(query)
+
+
+def task_ids_expr(prev_task_runs: bool = False) -> dict:
+    """
+    aggregation expression that evaluates to the ids of the celery tasks needed to embellish a workflow.
+    the last task run of each step, and with prev_task_runs, every task run of every step.
+    """
+    if prev_task_runs:
+        return {
+            '$reduce': {
+                'input': {'$ifNull': ['$steps', []]},
+                'initialValue': [],
+                'in': {'$concatArrays': ['$$value', {'$ifNull': ['$$this.task_runs.task_id', []]}]}
+            }
+        }
+    return {
+        '$map': {
+            'input': {'$ifNull': ['$steps', []]},
+            'as': 'step',
+            'in': {'$last': {'$ifNull': ['$$step.task_runs.task_id', [None]]}}
+        }
+    }
+
+
+def lookup_tasks_stages(prev_task_runs: bool = False, task_projection: dict = None) -> list[dict]:
+    # localField is an array of task ids, $lookup matches each of them against the _id index of celery_taskmeta
+    lookup = {
+        'from': 'celery_taskmeta',
+        'localField': '_task_ids',
+        'foreignField': '_id',
+        'as': '_tasks'
+    }
+    if task_projection is not None:
+        # localField with a pipeline requires MongoDB 5.0
+        lookup['pipeline'] = [{'$project': task_projection}]
+    return [
+        {
+            '$addFields': {
+                '_task_ids': task_ids_expr(prev_task_runs=prev_task_runs)
+            }
+        },
+        {
+            '$lookup': lookup
+        },
+        {
+            '$project': {
+                '_task_ids': 0
+            }
+        }
+    ]
+
+
+def project_stages(projection: dict | None, sort_by: SortBy = None) -> list[dict]:
+    if projection is None:
+        return []
+    # the sort key of the last workflow is the cursor of the next page
+    return [{'$project': {**projection, (sort_by or SortBy.CREATED_AT).value: 1}}]
+
+
+def page_pipeline(query: dict, skip: int, limit: int,
+                  sort_by: SortBy = None, sort_order_asc: bool = True, prev_task_runs: bool = False,
+                  projection: dict = None, task_projection: dict = None) -> list[dict]:
+    """
+    match, sort, paginate and join the task runs of a page of workflows in one aggregation.
+    the matches are counted separately (count_workflows): a $facet could not sort with an index,
+    and its single result document is capped at 16 MB
+    """
+    return [
+        {
+            '$match': query,
+        },
+        {
+            '$sort': sort_spec(sort_by, sort_order_asc)
+        },
+        {
+            '$skip': skip,
+        },
+        {
+            '$limit': limit,
+        },
+        *project_stages(projection, sort_by),
+        *lookup_tasks_stages(prev_task_runs=prev_task_runs, task_projection=task_projection)
+    ]
+
+
+def embellish_joined(workflow: dict, last_task_run=True, prev_task_runs=False, fields: dict = None) -> dict:
+    """
+    embellish a workflow document that carries its task documents in "_tasks"
+    """
+    tasks = {task['_id']: task for task in workflow.pop('_tasks', [])}
+    return sparse.select(embellish(workflow, tasks, last_task_run=last_task_run, prev_task_runs=prev_task_runs),
+                         fields)
+
+
+async def list_workflows(wf_col, query: dict, skip: int, limit: int,
+                         sort_by: SortBy = None, sort_order_asc: bool = True,
+                         last_task_run=True, prev_task_runs=False,
+                         after: str = None, count: CountMode = CountMode.EXACT,
+                         fields: dict = None) -> tuple[list[dict], int | None, str | None]:
+    """
+    :param after: cursor of the previous page. the page starts right after it instead of counting skip documents.
+    :param count: how to compute the total
+    :param fields: selection of rhythm_api.sparse, only the selected fields are read and returned
+    :return: (embellished workflows, total, cursor of the next page or None if this is the last page)
+    """
+    if after is not None:
+        value, _id = decode_cursor(sort_by, after)
+        range_query = after_query(sort_by, sort_order_asc, value, _id)
+        page_query = {'$and': [query, range_query]} if query else range_query
+    else:
+        page_query = query
+
+    last_task_run, prev_task_runs = sparse.task_runs(fields, last_task_run, prev_task_runs)
+    projections = {
+        'projection': sparse.workflow_projection(fields),
+        'task_projection': sparse.task_projection(fields),
+    }
+
+    # one extra workflow tells whether there is a next page
+    cursor = wf_col.aggregate(page_pipeline(page_query, skip=skip, limit=limit + 1,
+                                            sort_by=sort_by, sort_order_asc=sort_order_asc,
+                                            prev_task_runs=prev_task_runs, **projections))
+    total, docs = await asyncio.gather(count_workflows(wf_col, query, count), cursor.to_list(None))
+
+    next_cursor = encode_cursor(sort_by, docs[limit - 1]) if 0 < limit < len(docs) else None
+    with metrics.stage('hydration'):
+        workflows = [
+            embellish_joined(wf, last_task_run=last_task_run, prev_task_runs=prev_task_runs, fields=fields)
+            for wf in docs[:limit]
+        ]
+    return workflows, total, next_cursor
@@ -1,19 +1,61 @@
+import asyncio
+import logging
+import math
+from contextlib import asynccontextmanager
 from datetime import datetime
 
+import anyio.to_thread
 import uvicorn
 from fastapi import FastAPI, Request, Depends, HTTPException
 from fastapi.encoders import ENCODERS_BY_TYPE
 from fastapi.responses import JSONResponse
+from pymongo.errors import PyMongoError
 from sca_rhythm import WFNotFound
 
-from rhythm_api.auth import validate_JWT
-from rhythm_api.routers import workflows, tasks
+from rhythm_api import indexes, metrics, resources
+from rhythm_api.admission import AdmissionRejected
+from rhythm_api.auth import public_key, validate_JWT_cached
+from rhythm_api.config import config
+from rhythm_api.encoding import DATETIME_FORMAT, ORJSONResponse
+from rhythm_api.routers import workflows, tasks, analytics
+from rhythm_api.watcher import watcher
+
+logger = logging.getLogger(__name__)
+
+# responses of handlers that return dicts still go through jsonable_encoder, keep it in line with rhythm_api.encoding
+ENCODERS_BY_TYPE[datetime] = lambda d: d.strftime(DATETIME_FORMAT)
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # nothing is connected or read at import, the clients and the public key are created before the first request
+    resources.get()
+    public_key()
+    # the limiter belongs to the event loop, it can only be resized from it
+    anyio.to_thread.current_default_thread_limiter().total_tokens = config['server']['threadpool_size']
+    if config['mongo']['apply_indexes_on_startup']:
+        try:
+            errors = await asyncio.to_thread(indexes.apply, resources.database())
+            if errors:
+                logger.error('indexes could not be created: %s', errors)
+        except PyMongoError as e:
+            logger.error('indexes could not be created: %s', e)
+    if config['server']['warm_up']:
+        try:
+            await resources.warm_up()
+        except PyMongoError as e:
+            logger.warning('warm up failed: %s', e)
+    yield
+    watcher.stop()
+    resources.close()
 
-# https://stackoverflow.com/a/69541044
-ENCODERS_BY_TYPE[datetime] = lambda d: d.strftime('%Y-%m-%dT%H:%M:%S.%fZ')
 
 app = FastAPI(title="Rhythm API",
-              description="An API to create and manage workflows using Celery tasks")
+              description="An API to create and manage workflows using Celery tasks",
+              default_response_class=ORJSONResponse,
+              root_path=config['server']['root_path'],
+              lifespan=lifespan)
+app.add_middleware(metrics.MetricsMiddleware)
 
 
 @app.exception_handler(WFNotFound)
@@ -32,18 +74,36 @@ def assertion_exception(request: Request, exc: AssertionError):
     )
 
 
+@app.exception_handler(AdmissionRejected)
+def admission_rejected_exception(request: Request, exc: AdmissionRejected):
+    headers = {}
+    if not math.isinf(exc.retry_after):
+        headers['Retry-After'] = str(math.ceil(exc.retry_after))
+    return JSONResponse(
+        status_code=429,
+        content={"message": str(exc)},
+        headers=headers,
+    )
+
+
 @app.get("/health")
 def health():
     return {"health": "OK"}
 
 
+@app.get("/metrics", include_in_schema=False)
+async def prometheus_metrics():
+    return metrics.metrics_response()
+
+
 async def auth(request: Request):
     try:
         authorization = request.headers.get('Authorization', '')
         assert (authorization or '').startswith('Bearer '), 'Invalid token'
 
         token = authorization.split()[1]
-        decoded_token = validate_JWT(token)
+        with metrics.stage('auth'):
+            decoded_token = validate_JWT_cached(token)
 
         request.state.user = decoded_token['sub']
 
@@ -53,6 +113,7 @@ async def auth(request: Request):
 
 app.include_router(workflows.router, dependencies=[Depends(auth)])
 app.include_router(tasks.router, dependencies=[Depends(auth)])
+app.include_router(analytics.router, dependencies=[Depends(auth)])
 
 
 def start_dev():
@@ -0,0 +1,166 @@
+import os
+import time
+
+import anyio.to_thread
+from prometheus_client import CollectorRegistry, Counter, Gauge, Histogram, generate_latest, CONTENT_TYPE_LATEST
+from prometheus_client import multiprocess
+from pymongo import monitoring
+from starlette.responses import Response
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+# Prometheus metrics served by GET /metrics.
+#
+# - request latency by route template and status, from the ASGI middleware
+# - latency of the stages of a request: auth, hydration (building the response from workflow and task documents)
+#   and serialization. mongo time is measured per command by a pymongo listener, for both pymongo and motor clients.
+# - saturation: mongo connections in use / waiting for one, and threads in use / requests waiting for one
+#
+# With several worker processes (gunicorn), set PROMETHEUS_MULTIPROC_DIR to an empty directory
+# so that /metrics aggregates all of them.
+
+REQUEST_SECONDS = Histogram('rhythm_api_request_duration_seconds', 'Time to respond to a request',
+                            ['method', 'route', 'status'])
+STAGE_SECONDS = Histogram('rhythm_api_stage_duration_seconds', 'Time spent in a stage of request handling',
+                          ['stage'])
+MONGO_SECONDS = Histogram('rhythm_api_mongo_command_duration_seconds', 'Time to run a mongo command',
+                          ['collection', 'command'])
+MONGO_COMMAND_FAILURES = Counter('rhythm_api_mongo_command_failures_total', 'Mongo commands that failed',
+                                 ['collection', 'command'])
+MONGO_CONNECTIONS_IN_USE = Gauge('rhythm_api_mongo_connections_in_use', 'Connections checked out of the pool',
+                                 ['address'], multiprocess_mode='livesum')
+MONGO_CONNECTIONS_WAITING = Gauge('rhythm_api_mongo_connections_waiting', 'Operations waiting for a connection',
+                                  ['address'], multiprocess_mode='livesum')
+MONGO_CHECKOUT_FAILURES = Counter('rhythm_api_mongo_connection_checkout_failures_total',
+                                  'Operations that could not get a connection', ['address', 'reason'])
+ADMISSION_REJECTIONS = Counter('rhythm_api_admission_rejections_total',
+                               'Workflow submissions rejected by admission control', ['reason'])
+THREADS_IN_USE = Gauge('rhythm_api_threadpool_threads_in_use', 'Threads running sync handlers',
+                       multiprocess_mode='livesum')
+THREADS_TOTAL = Gauge('rhythm_api_threadpool_threads_total', 'Size of the threadpool that runs sync handlers',
+                      multiprocess_mode='livesum')
+THREADS_WAITING = Gauge('rhythm_api_threadpool_tasks_waiting', 'Sync handlers waiting for a thread',
+                        multiprocess_mode='livesum')
+
+
+def stage(name: str):
+    """
+    time a block of code: with stage('auth'): ...
+    """
+    return STAGE_SECONDS.labels(name).time()
+
+
+class CommandListener(monitoring.CommandListener):
+    def __init__(self):
+        # request_id -> collection, commands are matched with their result by request_id
+        self._collections: dict[int, str] = {}
+
+    def started(self, event: monitoring.CommandStartedEvent) -> None:
+        collection = event.command.get(event.command_name, None)
+        if event.command_name == 'getMore':
+            collection = event.command.get('collection', None)
+        self._collections[event.request_id] = collection if isinstance(collection, str) else ''
+
+    def succeeded(self, event: monitoring.CommandSucceededEvent) -> None:
+        collection = self._collections.pop(event.request_id, '')
+        MONGO_SECONDS.labels(collection, event.command_name).observe(event.duration_micros / 1e6)
+
+    def failed(self, event: monitoring.CommandFailedEvent) -> None:
+        collection = self._collections.pop(event.request_id, '')
+        MONGO_SECONDS.labels(collection, event.command_name).observe(event.duration_micros / 1e6)
+        MONGO_COMMAND_FAILURES.labels(collection, event.command_name).inc()
+
+
+class PoolListener(monitoring.ConnectionPoolListener):
+    def connection_check_out_started(self, event):
+        MONGO_CONNECTIONS_WAITING.labels(str(event.address)).inc()
+
+    def connection_check_out_failed(self, event):
+        MONGO_CONNECTIONS_WAITING.labels(str(event.address)).dec()
+        MONGO_CHECKOUT_FAILURES.labels(str(event.address), str(event.reason)).inc()
+
+    def connection_checked_out(self, event):
+        MONGO_CONNECTIONS_WAITING.labels(str(event.address)).dec()
+        MONGO_CONNECTIONS_IN_USE.labels(str(event.address)).inc()
+
+    def connection_checked_in(self, event):
+        MONGO_CONNECTIONS_IN_USE.labels(str(event.address)).dec()
+
+    def pool_created(self, event):
+        pass
+
+    def pool_ready(self, event):
+        pass
+
+    def pool_cleared(self, event):
+        pass
+
+    def pool_closed(self, event):
+        pass
+
+    def connection_created(self, event):
+        pass
+
+    def connection_ready(self, event):
+        pass
+
+    def connection_closed(self, event):
+        pass
+
+
+# listeners apply to the clients created after they are registered,
+# rhythm_api.resources imports this module before creating its client
+monitoring.register(CommandListener())
+monitoring.register(PoolListener())
+
+
+def observe_threadpool() -> None:
+    # the threadpool limiter belongs to the event loop of this worker, so it is read from a request
+    # rather than by a callback. Every worker updates its own gauges, the livesum gauges add them up.
+    limiter = anyio.to_thread.current_default_thread_limiter()
+    THREADS_IN_USE.set(limiter.borrowed_tokens)
+    THREADS_TOTAL.set(limiter.total_tokens)
+    THREADS_WAITING.set(limiter.statistics().tasks_waiting)
+
+
+class MetricsMiddleware:
+    """
+    observes the time to respond to each request, labelled by the path template of the matched route
+    so that /workflows/{workflow_id} is one series, and the threadpool of this worker when a request
+    enters and leaves
+    """
+
+    def __init__(self, app: ASGIApp):
+        self.app = app
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope['type'] != 'http':
+            await self.app(scope, receive, send)
+            return
+
+        observe_threadpool()
+        start = time.perf_counter()
+        status_code = 500
+
+        async def send_wrapper(message: Message) -> None:
+            nonlocal status_code
+            if message['type'] == 'http.response.start':
+                status_code = message['status']
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            route = scope.get('route', None)
+            REQUEST_SECONDS.labels(scope['method'],
+                                   getattr(route, 'path', '<unmatched>'),
+                                   str(status_code)).observe(time.perf_counter() - start)
+            observe_threadpool()
+
+
+def metrics_response() -> Response:
+    observe_threadpool()
+    if 'PROMETHEUS_MULTIPROC_DIR' in os.environ:
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+        return Response(generate_latest(registry), media_type=CONTENT_TYPE_LATEST)
+    return Response(generate_latest(), media_type=CONTENT_TYPE_LATEST)
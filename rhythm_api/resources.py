@@ -0,0 +1,106 @@
+import celery
+from motor.motor_asyncio import AsyncIOMotorClient, AsyncIOMotorCollection
+from pymongo import MongoClient
+from pymongo.collection import Collection
+from pymongo.database import Database
+from pymongo.read_preferences import ReadPreference, make_read_preference, read_pref_mode_from_name
+
+# registers the mongo listeners, they only apply to clients created after
+from rhythm_api import metrics  # noqa: F401
+from rhythm_api.config import config, celeryconfig
+
+# Clients shared by every request of an API process, created by the app's lifespan rather than at import
+# so that importing the app (gunicorn workers, tests, scripts) does not connect to anything.
+#
+# - one mongo client: motor for the async read endpoints, and its pymongo delegate for the sync code
+#   (sca_rhythm.Workflow, bulk writes). motor runs pymongo in a thread pool, so both share one connection pool.
+# - one celery app, whose result backend uses the same mongo client. celery creates a result backend per thread
+#   and each of them would otherwise open its own client.
+#
+# Scripts and tests that use these without the app get them created on first use.
+#
+# Reads go to the primary, which also takes the task state writes of the celery workers. The heavy read-only
+# endpoints read with the preferences in config['mongo']['read_preferences'] instead, ex: from a secondary that is
+# at most max_staleness_seconds behind. Writes, and reads that have to see them, stay on the primary.
+
+
+class Celery(celery.Celery):
+    def __init__(self, *args, mongo_client: MongoClient = None, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.mongo_client = mongo_client
+
+    def _get_backend(self):
+        backend = super()._get_backend()
+        if self.mongo_client is not None:
+            # read by MongoBackend._get_connection
+            backend._connection = self.mongo_client
+        return backend
+
+
+class Resources:
+    def __init__(self):
+        self.async_client = AsyncIOMotorClient(celeryconfig.result_backend, **config['mongo']['pool'])
+        self.client: MongoClient = self.async_client.delegate
+        self.celery_app = Celery('tasks', mongo_client=self.client)
+        self.celery_app.config_from_object(celeryconfig)
+
+    def close(self) -> None:
+        self.async_client.close()
+
+
+_resources: Resources | None = None
+
+
+def get() -> Resources:
+    global _resources
+    if _resources is None:
+        _resources = Resources()
+    return _resources
+
+
+def close() -> None:
+    global _resources
+    if _resources is not None:
+        _resources.close()
+        _resources = None
+
+
+def celery_app() -> Celery:
+    return get().celery_app
+
+
+def database() -> Database:
+    # the database is the one in the result backend url, same as celery_app.backend.database
+    return get().client.get_default_database()
+
+
+def collection(name: str) -> Collection:
+    return database().get_collection(name)
+
+
+def read_preference(name: str | None) -> ReadPreference:
+    """
+    :param name: key of config['mongo']['read_preferences'], primary if None or not configured
+    """
+    pref = config['mongo']['read_preferences'].get(name, None) if name is not None else None
+    if pref is None:
+        return ReadPreference.PRIMARY
+    max_staleness = pref.get('max_staleness_seconds', None)
+    return make_read_preference(read_pref_mode_from_name(pref['mode']),
+                                pref.get('tags', None),
+                                max_staleness if max_staleness is not None else -1)
+
+
+def async_collection(name: str, reads: str = None) -> AsyncIOMotorCollection:
+    """
+    :param reads: name of the read preference of the collection, see read_preference
+    """
+    return get().async_client.get_default_database().get_collection(name, read_preference=read_preference(reads))
+
+
+async def warm_up() -> None:
+    """
+    open connections to mongo and run the first queries of the collections the API reads most
+    """
+    for name in ['workflow_meta', 'celery_taskmeta']:
+        await async_collection(name).find_one({}, {'_id': 1})
@@ -0,0 +1,226 @@
+import datetime
+import gzip
+import logging
+import time
+import uuid
+import zlib
+from pathlib import Path
+
+import bson
+import celery.states
+import pymongo
+from bson import json_util
+from pymongo.errors import OperationFailure
+
+from rhythm_api import counters
+from rhythm_api.cache import response_cache
+
+logger = logging.getLogger(__name__)
+
+# Moves completed workflows, with the celery_taskmeta documents of all their task runs, out of the working set.
+#
+# A workflow is archived when it is in a terminal state and has not been updated for the number of days of its
+# app's policy. Archives are written in batches, either
+#   collection - one document per workflow in workflow_archive, {_id, app_id, created_at, archived_at, data}
+#                where data is the zlib compressed BSON of {'workflow', 'tasks'}
+#   files - one gzipped NDJSON file per batch under archive_dir/<app_id>/, lines of
+#           {'workflow', 'tasks'} in MongoDB extended JSON, and one document per workflow in
+#           workflow_archive with the file instead of data
+# and the workflows and their tasks are deleted only after their batch is written.
+# A workflow that was resumed after it was read no longer matches the policy, it is not deleted and its archive is
+# dropped. archive_dir has to be shared with the API (a volume of both containers), which reads the files back.
+# Archived workflows are read back by id with read_archived.
+
+ARCHIVE = 'workflow_archive'
+
+TERMINAL_STATES = [celery.states.SUCCESS, celery.states.FAILURE, celery.states.REVOKED]
+
+
+def policies(retention_config: dict) -> list[tuple[dict, int | None]]:
+    """
+    (query, archive_after_days) of each policy: one per app with its own policy and a default for the others
+    """
+    apps = retention_config.get('apps', None) or {}
+    result = [({'app_id': app_id}, days) for app_id, days in apps.items()]
+    result.append(({'app_id': {'$nin': list(apps.keys())}}, retention_config.get('archive_after_days', None)))
+    return result
+
+
+def archivable_query(policy_query: dict, archive_after_days: int, now: datetime.datetime) -> dict:
+    cutoff = now - datetime.timedelta(days=archive_after_days)
+    return {
+        **policy_query,
+        '_status': {'$in': TERMINAL_STATES},
+        'updated_at': {'$lt': cutoff},
+    }
+
+
+def task_ids_of(workflow: dict) -> list[str]:
+    return [
+        task_run['task_id']
+        for step in workflow.get('steps', [])
+        for task_run in step.get('task_runs', None) or []
+    ]
+
+
+def _archive_entry(workflow: dict, now: datetime.datetime) -> dict:
+    return {
+        '_id': workflow['_id'],
+        'app_id': workflow.get('app_id', None),
+        'created_at': workflow.get('created_at', None),
+        'archived_at': now,
+    }
+
+
+def write_to_collection(db, records: list[dict], now: datetime.datetime) -> None:
+    entries = [
+        {**_archive_entry(r['workflow'], now), 'data': bson.Binary(zlib.compress(bson.encode(r)))}
+        for r in records
+    ]
+    # replace, a batch that was written but not deleted is written again by the next run
+    archive_col = db.get_collection(ARCHIVE)
+    archive_col.delete_many({'_id': {'$in': [e['_id'] for e in entries]}})
+    archive_col.insert_many(entries)
+
+
+def write_to_file(db, records: list[dict], now: datetime.datetime, archive_dir: Path | str) -> None:
+    app_id = records[0]['workflow'].get('app_id', None) or '_'
+    path = Path(archive_dir) / app_id / f'{now:%Y%m%dT%H%M%S}-{uuid.uuid4().hex[:8]}.ndjson.gz'
+    path.parent.mkdir(parents=True, exist_ok=True)
+    with gzip.open(path, 'wt') as f:
+        for r in records:
+            f.write(json_util.dumps(r) + '\n')
+
+    entries = [{**_archive_entry(r['workflow'], now), 'file': str(path)} for r in records]
+    archive_col = db.get_collection(ARCHIVE)
+    archive_col.delete_many({'_id': {'$in': [e['_id'] for e in entries]}})
+    archive_col.insert_many(entries)
+
+
+def delete_archived(db, workflows: list[dict], query: dict) -> dict:
+    """
+    delete the archived workflows that still match query, and the tasks of the deleted ones.
+    the workflows are deleted before their tasks, as in rhythm_api.bulk.delete_workflows
+    """
+    wf_col = db.get_collection('workflow_meta')
+    workflow_ids = [wf['_id'] for wf in workflows]
+    deleted_count = wf_col.delete_many({'$and': [query, {'_id': {'$in': workflow_ids}}]}).deleted_count
+
+    kept = {wf['_id'] for wf in wf_col.find({'_id': {'$in': workflow_ids}}, {'_id': 1})}
+    if kept:
+        # changed since it was archived, the archive is outdated
+        db.get_collection(ARCHIVE).delete_many({'_id': {'$in': list(kept)}})
+    deleted = [wf for wf in workflows if wf['_id'] not in kept]
+    counters.record_deletes(db, [wf['_id'] for wf in deleted])
+    # the API caches terminal workflows until they are invalidated
+    response_cache.invalidate([wf['_id'] for wf in deleted])
+
+    task_ids = [task_id for wf in deleted for task_id in task_ids_of(wf)]
+    deleted_task_count = 0
+    if len(task_ids) > 0:
+        deleted_task_count = db.get_collection('celery_taskmeta').delete_many({'_id': {'$in': task_ids}}).deleted_count
+    return {
+        'deleted_count': deleted_count,
+        'deleted_task_count': deleted_task_count
+    }
+
+
+def archive_batch(db, workflows: list[dict], now: datetime.datetime, query: dict,
+                  target: str = 'collection', archive_dir: Path | str = None) -> dict:
+    """
+    archive workflows and their tasks, then delete them
+
+    :param query: archivable_query the workflows were read with
+    :return: {'deleted_count', 'deleted_task_count'}
+    """
+    task_ids = [task_id for wf in workflows for task_id in task_ids_of(wf)]
+    tasks = {task['_id']: task for task in db.get_collection('celery_taskmeta').find({'_id': {'$in': task_ids}})}
+    records = [
+        {'workflow': wf, 'tasks': [tasks[task_id] for task_id in task_ids_of(wf) if task_id in tasks]}
+        for wf in workflows
+    ]
+    if target == 'files':
+        # a file holds the workflows of one app
+        by_app = {}
+        for r in records:
+            by_app.setdefault(r['workflow'].get('app_id', None), []).append(r)
+        for app_records in by_app.values():
+            write_to_file(db, app_records, now, archive_dir)
+    else:
+        write_to_collection(db, records, now)
+    return delete_archived(db, workflows, query)
+
+
+def apply_expiry(db, retention_config: dict) -> None:
+    """
+    create or update the TTL index that removes archived workflows after expire_archived_after_days
+    """
+    days = retention_config.get('expire_archived_after_days', None)
+    if days is None:
+        return
+    # only removes archives kept in the collection, archive files have to be removed separately
+    seconds = int(days * 24 * 3600)
+    try:
+        db.get_collection(ARCHIVE).create_index([('archived_at', pymongo.ASCENDING)], name='archived_at_ttl',
+                                                expireAfterSeconds=seconds)
+    except OperationFailure:
+        # exists with another expiry
+        db.command('collMod', ARCHIVE, index={'name': 'archived_at_ttl', 'expireAfterSeconds': seconds})
+
+
+def run(db, retention_config: dict, now: datetime.datetime = None, dry_run: bool = False) -> dict:
+    """
+    archive every workflow that is past its app's retention policy, batch_size workflows at a time
+
+    :return: number of archived workflows and tasks, or of workflows that would be archived when dry_run
+    """
+    now = now or datetime.datetime.utcnow()
+    apply_expiry(db, retention_config)
+    batch_size = retention_config['batch_size']
+    wf_col = db.get_collection('workflow_meta')
+    summary = {'archived_count': 0, 'archived_task_count': 0}
+    for policy_query, days in policies(retention_config):
+        if days is None:
+            continue
+        query = archivable_query(policy_query, days, now)
+        if dry_run:
+            summary['archived_count'] += wf_col.count_documents(query)
+            continue
+        while workflows := list(wf_col.find(query).limit(batch_size)):
+            result = archive_batch(db, workflows, now, query,
+                                   target=retention_config['target'],
+                                   archive_dir=retention_config['archive_dir'])
+            summary['archived_count'] += result['deleted_count']
+            summary['archived_task_count'] += result['deleted_task_count']
+            if result['deleted_count'] == 0:
+                # deleted or resumed by someone else in the meantime
+                break
+    return summary
+
+
+def watch(db, retention_config: dict, interval: float = 3600) -> None:
+    while True:
+        summary = run(db, retention_config)
+        logger.info('retention: %s', summary)
+        time.sleep(interval)
+
+
+def read_archived(db, workflow_id: str) -> dict | None:
+    """
+    :return: {'workflow', 'tasks'} of an archived workflow
+    """
+    entry = db.get_collection(ARCHIVE).find_one({'_id': workflow_id})
+    if entry is None:
+        return None
+    if 'data' in entry:
+        return bson.decode(zlib.decompress(entry['data']))
+    try:
+        with gzip.open(entry['file'], 'rt') as f:
+            for line in f:
+                record = json_util.loads(line)
+                if record['workflow']['_id'] == workflow_id:
+                    return record
+    except FileNotFoundError:
+        # archive_dir is not shared with the retention service, or the file was removed
+        logger.warning('archive file %s of workflow %s is missing', entry['file'], workflow_id)
+    return None
@@ -0,0 +1,49 @@
+import datetime
+from enum import Enum
+from typing import Optional
+
+from fastapi import APIRouter, Query
+
+from rhythm_api import analytics
+from rhythm_api.listing import omit_none
+from rhythm_api.resources import async_collection
+
+router = APIRouter(
+    prefix="/analytics",
+    tags=["analytics"],
+)
+
+
+class Bucket(str, Enum):
+    HOUR = 'hour'
+    DAY = 'day'
+
+
+@router.get("/steps")
+async def step_analytics(
+    app_id: Optional[str] = Query(None, description="Application ID to filter by. Default is every app."),
+    step: Optional[str] = Query(None, description="Step name to filter by"),
+    start: Optional[datetime.datetime] = Query(None, description="Tasks finished at or after. "
+                                                                 "Default is 7 days before end."),
+    end: Optional[datetime.datetime] = Query(None, description="Tasks finished before. Default is now."),
+    bucket: Bucket = Query(Bucket.HOUR, description="Time bucket of the series"),
+) -> dict:
+    """
+    Duration percentiles (seconds, successful tasks), success / failure rates and completions per time bucket
+    of each step, from the hourly rollups maintained by rhythm_api.analytics.
+    """
+    end = analytics.naive_utc(end) if end else datetime.datetime.utcnow()
+    start = analytics.naive_utc(start) if start else end - datetime.timedelta(days=7)
+    assert start < end, 'start must be before end'
+
+    query = omit_none({
+        'app_id': app_id,
+        'step': step,
+    })
+    query['bucket'] = {'$gte': analytics.bucket_of(start), '$lt': end}
+    rollups = await async_collection(analytics.ROLLUPS, reads='analytics').find(query).to_list(None)
+    return {
+        'start': start,
+        'end': end,
+        **analytics.summarize(rollups, bucket=bucket.value)
+    }
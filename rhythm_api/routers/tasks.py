@@ -1,13 +1,11 @@
-from celery import Celery
-from fastapi import APIRouter, Query
+from typing import Optional
 
-from rhythm_api.config import celeryconfig
+from fastapi import APIRouter, Query, Request, Response
 
-celery_app = Celery("tasks")
-celery_app.config_from_object(celeryconfig)
-
-db = celery_app.backend.database
-task_col = db.get_collection('celery_taskmeta')
+from rhythm_api import steps
+from rhythm_api.cache import response_cache
+from rhythm_api.config import config
+from rhythm_api.resources import async_collection
 
 router = APIRouter(
     prefix="/tasks",
@@ -15,37 +13,33 @@ router = APIRouter(
 )
 
 
-# @router.get("/active")
-# def group_active_tasks_by_step(app_id: str = Query(description="Application ID")) -> list[dict]:
-#     cursor = task_col.aggregate(
-#         [
-#             {
-#                 '$match': {
-#                     'kwargs.step': {'$ne': None},
-#                     'kwargs.app_id': app_id,
-#                     'status': {'$nin': [celery.states.SUCCESS]}
-#                 }
-#             },
-#             {
-#                 '$group': {
-#                     '_id': '$kwargs.step',
-#                     'tasks': {'$push': '$$ROOT'}
-#                 }
-#             },
-#             {
-#                 '$project': {
-#                     'step': "$_id",
-#                     'tasks': 1,
-#                     '_id': 0
-#                 }
-#             }
-#
-#         ]
-#     )
-#     return list(cursor)
+@router.get("/active")
+async def group_active_tasks_by_step(
+    app_id: str = Query(description="Application ID"),
+    step: Optional[str] = Query(None, description="Step name to filter by"),
+    skip: int = Query(0, description='Number of tasks to skip. Default is 0.'),
+    limit: int = Query(100, description='Number of tasks to return. Default is 100.'),
+) -> dict:
+    """
+    Unfinished tasks of the app grouped by step, a page at a time, and the number of them in each step.
+    """
+    max_limit = config['tasks']['max_active_limit']
+    assert 0 <= limit <= max_limit, f'limit must be between 0 and {max_limit}'
+    return await steps.active_tasks(async_collection('celery_taskmeta', reads='tasks'),
+                                    app_id, step=step, skip=skip, limit=limit)
 
 
 @router.get('/unique')
-def unique_steps(app_id: str = Query(description="Application ID")) -> list:
-    cursor = task_col.distinct('kwargs.step')
-    return list(cursor)
+async def unique_steps(
+    request: Request,
+    app_id: str = Query(description="Application ID"),
+    task: Optional[str] = Query(None, description="Task name to filter by"),
+) -> Response:
+    """
+    Names of the steps that have run for the app. Cached for a short time.
+    """
+    async def catalog() -> list[str]:
+        return await steps.unique_steps(async_collection('celery_taskmeta', reads='tasks'), app_id, task=task)
+
+    key = response_cache.key('steps', app_id=app_id, task=task)
+    return await response_cache.response(request, key, catalog, ttl=lambda _: config['tasks']['steps_ttl'])
@@ -1,24 +1,24 @@
-from enum import unique, Enum
+import asyncio
+import datetime
 from typing import Optional
 
 import celery.states
-from celery import Celery
-from fastapi import APIRouter, Query
+from fastapi import APIRouter, Query, Request, Response
+from fastapi.responses import StreamingResponse
 from pydantic import BaseModel
-from sca_rhythm import Workflow
+from sca_rhythm import WFNotFound
 
-from rhythm_api.config import celeryconfig
-
-celery_app = Celery("tasks")
-celery_app.config_from_object(celeryconfig)
-
-db = celery_app.backend.database
-wf_col = db.get_collection('workflow_meta')
-task_col = db.get_collection('celery_taskmeta')
-
-
-def omit_none(d):
-    return {k: v for k, v in d.items() if v is not None}
+from rhythm_api import counters, encoding, groups, resources, retention, search, sparse
+from rhythm_api.admission import admission_controller
+from rhythm_api.bulk import find_workflow_ids, apply_concurrently, delete_workflows
+from rhythm_api.cache import response_cache
+from rhythm_api.config import config
+from rhythm_api.export import export_workflows, gzip_chunks
+from rhythm_api.hydration import async_fetch_embellished_workflows, embellish
+from rhythm_api.listing import Status, SortBy, CountMode, wf_query, list_workflows
+from rhythm_api.resources import async_collection
+from rhythm_api.submission import new_workflow, start_workflow, create_workflows
+from rhythm_api.watcher import watcher, snapshot, Subscription
 
 
 router = APIRouter(
@@ -27,94 +27,9 @@ router = APIRouter(
 )
 
 
-@unique
-class Status(str, Enum):
-    PENDING = celery.states.PENDING
-    STARTED = celery.states.STARTED
-    SUCCESS = celery.states.SUCCESS
-    FAILURE = celery.states.FAILURE
-    REVOKED = celery.states.REVOKED
-    DONE = 'DONE'
-    ACTIVE = 'ACTIVE'
-    EXCEPTION = 'EXCEPTION'
-
-
-def status_query_values(status: Status) -> list[str]:
-    ACTIVE_STATES = [celery.states.PENDING, celery.states.STARTED]
-    DONE_STATES = [celery.states.SUCCESS, celery.states.FAILURE, celery.states.REVOKED]
-    EXCEPTION_STATES = [celery.states.FAILURE, celery.states.REVOKED]
-    if status is not None:
-        if status == Status.DONE:
-            return DONE_STATES
-        elif status == Status.ACTIVE:
-            return ACTIVE_STATES
-        elif status == Status.EXCEPTION:
-            return EXCEPTION_STATES
-        else:
-            return [status.value]
-
-
-def query_wf_ids(skip, limit, status=None, app_id=None, workflow_ids=None, sort_by=None, sort_order_asc=True):
-    query = omit_none({
-        'app_id': app_id
-    })
-
-    if status is not None:
-        query['_status'] = {
-            '$in': status_query_values(status)
-        }
-
-    # workflow_ids - non-empty list - search only these workflows
-    # workflow_ids - None - search all workflows - no filter by _id
-    # workflow_ids - empty list - given queries yield no results. results will be an empty list
-    # and response will be []
-    if workflow_ids is not None:
-        query['_id'] = {
-            '$in': workflow_ids
-        }
-
-    cursor = wf_col.aggregate([
-        {
-            '$match': query,
-        },
-        {
-            '$facet': {
-                "metadata": [
-                    {
-                        '$count': 'count'
-                    }
-                ],
-                "results": [
-                    {
-                        '$sort': {
-                            'created_at': 1 if sort_order_asc else -1  # 1 for ascending, -1 for descending
-                        }
-                    },
-                    {
-                        '$skip': skip,
-                    },
-                    {
-                        '$limit': limit,
-                    },
-                    {
-                        '$project': {
-                            '_id': 1
-                        }
-                    }
-                ]
-            }
-        }
-    ])
-    # cursor will always yield a dict with metadata and results keys even if there are no results
-    result = next(cursor)
-
-    metadata = result['metadata']
-    count = metadata[0]['count'] if metadata else 0
-    return result['results'], count
-
-
 @router.get("")
-def get_workflows(
+async def get_workflows(
+    request: Request,
     last_task_run: bool = Query(True, description="Include last task run info"),
     prev_task_runs: bool = Query(False, description="Include previous task runs"),
     status: Status = Query(None, description="Filter by workflow status"),
@@ -122,72 +37,59 @@ def get_workflows(
     skip: int = Query(0, description='Number of items to skip. Default is 0.'),
     limit: int = Query(10, description='Number of items to return. Default is 10.'),
     workflow_id: Optional[list[str]] = Query(None, description="Workflow IDs to filter by"),
-    sort_by: str = Query(None, description="Sort by"),
+    sort_by: SortBy = Query(None, description="Sort by. Default is created_at."),
     sort_order_asc: bool = Query(False, description="Direction of sort; true-asc, false-desc"),
-) -> dict:
-    results, total_count = query_wf_ids(skip=skip,
-                                        limit=limit,
-                                        status=status,
-                                        app_id=app_id,
-                                        workflow_ids=workflow_id,
-                                        sort_by=sort_by,
-                                        sort_order_asc=sort_order_asc
-                                        )
-    wf_ids = [res['_id'] for res in results]
-    workflows = []
-    for workflow_id in wf_ids:
-        try:
-            wf = Workflow(celery_app=celery_app, workflow_id=workflow_id)
-            if wf is not None:
-                workflows.append(
-                    wf.get_embellished_workflow(
-                        last_task_run=last_task_run,
-                        prev_task_runs=prev_task_runs,
-                        refresh=False
-                    )
-                )
-        except Exception as e:
-            print(e)
-    return {
-        'metadata': {
-            'total': total_count,
-            'limit': limit,
-            'skip': skip
-        },
-        'results': workflows
-    }
+    after: Optional[str] = Query(None, description="Cursor from metadata.next of the previous page. "
+                                                   "Pages by the sort key instead of skipping documents."),
+    count: CountMode = Query(CountMode.EXACT, description="How to compute metadata.total. "
+                                                          "estimated - approximate or capped count, "
+                                                          "none - do not count"),
+    fields: Optional[str] = Query(None, description="Comma separated fields to return, ex: "
+                                                    "id,name,status,steps.name,steps.last_task_run.date_done. "
+                                                    "Default is every field."),
+) -> Response:
+    max_limit = config['workflows']['max_list_limit']
+    assert 0 <= limit <= max_limit, f'limit must be between 0 and {max_limit}'
+    assert after is None or skip == 0, 'skip cannot be used with after'
+    selection = sparse.parse(fields)
+
+    async def page() -> dict:
+        workflows, total_count, next_cursor = await list_workflows(async_collection('workflow_meta', reads='listing'),
+                                                                   query=wf_query(status=status,
+                                                                                  app_id=app_id,
+                                                                                  workflow_ids=workflow_id),
+                                                                   skip=skip,
+                                                                   limit=limit,
+                                                                   sort_by=sort_by,
+                                                                   sort_order_asc=sort_order_asc,
+                                                                   last_task_run=last_task_run,
+                                                                   prev_task_runs=prev_task_runs,
+                                                                   after=after,
+                                                                   count=count,
+                                                                   fields=selection)
+        return {
+            'metadata': {
+                'total': total_count,
+                'limit': limit,
+                'skip': skip,
+                'next': next_cursor
+            },
+            'results': workflows
+        }
+
+    key = response_cache.list_key(last_task_run=last_task_run, prev_task_runs=prev_task_runs, status=status,
+                                  app_id=app_id, skip=skip, limit=limit, workflow_id=workflow_id, sort_by=sort_by,
+                                  sort_order_asc=sort_order_asc, after=after, count=count, fields=fields)
+    return await response_cache.response(request, key, page, ttl=lambda _: response_cache.list_ttl)
 
 
 @router.get("/counts_by_status")
-def workflow_counts_by_status(
+async def workflow_counts_by_status(
     app_id: Optional[str] = Query(None, description="Application ID to filter by")
 ) -> dict:
-    cursor = wf_col.aggregate([
-        {
-            '$match': {
-                'app_id': app_id,
-                '_status': {
-                    '$ne': None
-                }
-            }
-        },
-        {
-            '$group': {
-                '_id': '$_status',
-                'count': {
-                    '$sum': 1
-                }
-            }
-        },
-        {
-            '$project': {
-                'status': '$_id',
-                'count': 1,
-                '_id': 0
-            }
-        }
-    ])
-    results = list(cursor)
+    # served from the counters maintained by rhythm_api.counters instead of grouping workflow_meta
+    cursor = async_collection(counters.COUNTS, reads='counts').find({'app_id': app_id})
+    results = await cursor.to_list(None)
     counts = {
         celery.states.PENDING: 0,
         celery.states.STARTED: 0,
@@ -200,13 +102,191 @@ def workflow_counts_by_status(
     return counts
 
 
+@router.get("/export")
+async def export(
+    request: Request,
+    last_task_run: bool = Query(True, description="Include last task run info"),
+    prev_task_runs: bool = Query(False, description="Include previous task runs"),
+    status: Status = Query(None, description="Filter by workflow status"),
+    app_id: Optional[str] = Query(None, description="Application ID to filter by"),
+    created_after: Optional[datetime.datetime] = Query(None, description="Workflows created at or after"),
+    created_before: Optional[datetime.datetime] = Query(None, description="Workflows created before"),
+    batch_size: int = Query(None, description="Workflows joined with their task runs at a time"),
+) -> StreamingResponse:
+    """
+    Stream every matching workflow as newline-delimited JSON, in created_at order.
+    The response is gzip-compressed if the request accepts it (Accept-Encoding: gzip).
+    """
+    batch_size = batch_size or config['workflows']['export_batch_size']
+    max_batch_size = config['workflows']['max_export_batch_size']
+    assert 0 < batch_size <= max_batch_size, f'batch_size must be between 1 and {max_batch_size}'
+
+    chunks = export_workflows(async_collection('workflow_meta', reads='export'),
+                              async_collection('celery_taskmeta', reads='export'),
+                              query=wf_query(status=status,
+                                             app_id=app_id,
+                                             created_after=created_after,
+                                             created_before=created_before),
+                              batch_size=batch_size,
+                              last_task_run=last_task_run,
+                              prev_task_runs=prev_task_runs)
+    headers = {}
+    if 'gzip' in request.headers.get('accept-encoding', ''):
+        chunks = gzip_chunks(chunks)
+        headers['Content-Encoding'] = 'gzip'
+    return StreamingResponse(chunks, media_type='application/x-ndjson', headers=headers)
+
+
+@router.get("/search")
+async def search_workflows(
+    request: Request,
+    q: Optional[str] = Query(None, description="Words to search in the name and description"),
+    name_prefix: Optional[str] = Query(None, description="Workflows whose name starts with (case-sensitive)"),
+    kwarg: Optional[list[str]] = Query(None, description="key=value, workflows with a step whose kwargs have "
+                                                         "the value at key. Nested keys are dotted: a.b=value"),
+    arg: Optional[list[str]] = Query(None, description="value, or key=value for dict args, "
+                                                       "workflows started with the arg"),
+    app_id: Optional[str] = Query(None, description="Application ID to filter by"),
+    status: Status = Query(None, description="Filter by workflow status"),
+    skip: int = Query(0, description='Number of items to skip. Default is 0.'),
+    limit: int = Query(10, description='Number of items to return. Default is 10.'),
+    sort_by: SortBy = Query(None, description="Sort by. Default is created_at."),
+    sort_order_asc: bool = Query(False, description="Direction of sort; true-asc, false-desc"),
+    count: CountMode = Query(CountMode.EXACT, description="How to compute metadata.total"),
+    last_task_run: bool = Query(True, description="Include last task run info"),
+    prev_task_runs: bool = Query(False, description="Include previous task runs"),
+    fields: Optional[str] = Query(None, description="Comma separated fields to return. Default is every field."),
+) -> Response:
+    """
+    Search workflows by text, name prefix, step kwargs and args. kwarg and arg values are case-insensitive.
+    """
+    query = search.search_query(text=q, name_prefix=name_prefix, kwargs=kwarg, args=arg)
+    assert query, 'at least one of q, name_prefix, kwarg or arg is required'
+    max_limit = config['workflows']['max_list_limit']
+    assert 0 <= limit <= max_limit, f'limit must be between 0 and {max_limit}'
+    selection = sparse.parse(fields)
+
+    async def page() -> dict:
+        workflows, total_count, _ = await list_workflows(async_collection('workflow_meta', reads='listing'),
+                                                         query={**wf_query(status=status, app_id=app_id), **query},
+                                                         skip=skip,
+                                                         limit=limit,
+                                                         sort_by=sort_by,
+                                                         sort_order_asc=sort_order_asc,
+                                                         last_task_run=last_task_run,
+                                                         prev_task_runs=prev_task_runs,
+                                                         count=count,
+                                                         fields=selection)
+        return {
+            'metadata': {
+                'total': total_count,
+                'limit': limit,
+                'skip': skip
+            },
+            'results': workflows
+        }
+
+    key = response_cache.list_key(search=q, name_prefix=name_prefix, kwarg=kwarg, arg=arg, app_id=app_id,
+                                  status=status, skip=skip, limit=limit, sort_by=sort_by,
+                                  sort_order_asc=sort_order_asc, count=count, last_task_run=last_task_run,
+                                  prev_task_runs=prev_task_runs, fields=fields)
+    return await response_cache.response(request, key, page, ttl=lambda _: response_cache.list_ttl)
+
+
+def sse(event: dict) -> str:
+    return f'event: workflow\ndata: {encoding.dumps(event).decode()}\n\n'
+
+
+async def event_stream(request: Request, subscription: Subscription, initial: list[dict] = None):
+    heartbeat_interval = config['events']['heartbeat_interval']
+    try:
+        for event in initial or []:
+            yield sse(event)
+        while True:
+            try:
+                event = await asyncio.wait_for(subscription.queue.get(), timeout=heartbeat_interval)
+                yield sse(event)
+            except asyncio.TimeoutError:
+                if await request.is_disconnected():
+                    break
+                # comment line, keeps proxies from closing an idle connection
+                yield ': keep-alive\n\n'
+    finally:
+        watcher.unsubscribe(subscription)
+
+
+@router.get("/events")
+async def app_workflow_events(
+    request: Request,
+    app_id: Optional[str] = Query(None, description="Application ID to filter by")
+) -> StreamingResponse:
+    """
+    Server-sent events with the status and step transitions of every workflow of the app,
+    and the status changes of the task of the current step (task_status).
+    """
+    subscription = watcher.subscribe(app_id=app_id)
+    return StreamingResponse(event_stream(request, subscription), media_type='text/event-stream')
+
+
+@router.get("/{workflow_id}/events")
+async def workflow_events(request: Request, workflow_id: str) -> StreamingResponse:
+    """
+    Server-sent events with the status and step transitions of a workflow, and the status changes of the task
+    of the current step (task_status), starting with its current state.
+    """
+    workflow = await async_collection('workflow_meta').find_one({'_id': workflow_id})
+    if workflow is None:
+        raise WFNotFound(f'Workflow with id {workflow_id} is not found')
+    subscription = watcher.subscribe(workflow_id=workflow_id)
+    return StreamingResponse(event_stream(request, subscription, initial=[snapshot(workflow)]),
+                             media_type='text/event-stream')
+
+
+@router.get("/archive/{workflow_id}")
+async def get_archived_workflow(workflow_id: str,
+                                last_task_run: bool = Query(True, description="Include last task run info"),
+                                prev_task_runs: bool = Query(False, description="Include previous task runs")
+                                ) -> Response:
+    """
+    A workflow archived by the retention policy, with the results of its tasks as they were when it was archived.
+    """
+    record = await asyncio.to_thread(retention.read_archived, resources.database(), workflow_id)
+    if record is None:
+        raise WFNotFound(f'Archived workflow with id {workflow_id} is not found')
+    tasks = {task['_id']: task for task in record['tasks']}
+    return encoding.ORJSONResponse(embellish(record['workflow'], tasks,
+                                             last_task_run=last_task_run, prev_task_runs=prev_task_runs))
+
+
 @router.get("/{workflow_id}")
-def get_workflow(workflow_id: str,
-                 last_task_run: bool = Query(True, description="Include last task run info"),
-                 prev_task_runs: bool = Query(False, description="Include previous task runs")
-                 ) -> dict:
-    wf = Workflow(celery_app=celery_app, workflow_id=workflow_id)
-    return wf.get_embellished_workflow(last_task_run=last_task_run, prev_task_runs=prev_task_runs)
+async def get_workflow(request: Request,
+                       workflow_id: str,
+                       last_task_run: bool = Query(True, description="Include last task run info"),
+                       prev_task_runs: bool = Query(False, description="Include previous task runs"),
+                       fields: Optional[str] = Query(None, description="Comma separated fields to return, ex: "
+                                                                       "id,status,steps.name,steps.status. "
+                                                                       "Default is every field.")
+                       ) -> Response:
+    """
+    Responses have an ETag, send it in If-None-Match to get a 304 if the workflow has not changed.
+    """
+    selection = sparse.parse(fields)
+
+    async def workflow() -> dict:
+        workflows = await async_fetch_embellished_workflows(async_collection('workflow_meta'),
+                                                            async_collection('celery_taskmeta'),
+                                                            [workflow_id],
+                                                            last_task_run=last_task_run,
+                                                            prev_task_runs=prev_task_runs,
+                                                            fields=selection)
+        if len(workflows) == 0:
+            raise WFNotFound(f'Workflow with id {workflow_id} is not found')
+        return workflows[0]
+
+    key = response_cache.workflow_key(workflow_id, last_task_run=last_task_run, prev_task_runs=prev_task_runs,
+                                      fields=fields)
+    return await response_cache.response(request, key, workflow,
+                                         ttl=lambda wf: response_cache.workflow_ttl(wf, selection))
 
 
 class WFStep(BaseModel):
@@ -214,6 +294,9 @@ class WFStep(BaseModel):
     task: str
     queue: str
     kwargs: dict = None
+    priority: int = None
+    # consecutive steps of a group run in parallel, see rhythm_api.groups
+    group: str = None
 
 
 class WFRequest(BaseModel):
@@ -222,28 +305,136 @@ class WFRequest(BaseModel):
     app_id: str
     steps: list[WFStep]
     args: list
+    priority: int = None
+
+
+def submission_request(body: WFRequest) -> dict:
+    return {
+        'steps': [step.dict() for step in body.steps],
+        'name': body.name,
+        'app_id': body.app_id,
+        'description': body.description,
+        'args': body.args,
+        'priority': body.priority
+    }
 
 
 @router.post("")
-def create_workflow(body: WFRequest) -> dict:
-    steps = [step.dict() for step in body.steps]
-    wf = Workflow(celery_app=celery_app,
-                  steps=steps,
-                  name=body.name,
-                  app_id=body.app_id,
-                  description=body.description
-                  )
-    wf.start(*body.args)
-    return {'workflow_id': wf.workflow['_id']}
+def create_workflow(request: Request, body: WFRequest) -> dict:
+    """
+    Create and start a workflow. priority (0 - 9, higher is more urgent) applies to the steps without their own.
+    Submissions over the admission limits of the caller or the app are rejected with 429 and Retry-After.
+    """
+    submission = submission_request(body)
+    workflow = new_workflow(steps=submission['steps'],
+                            name=submission['name'],
+                            app_id=submission['app_id'],
+                            description=submission['description'],
+                            args=submission['args'],
+                            priority=submission['priority'])
+    admission_controller.admit(resources.database(), request.state.user, [workflow['app_id']])
+    resources.collection('workflow_meta').insert_one(workflow)
+    counters.record_created(resources.database(), [workflow])
+    response_cache.invalidate_lists()
+    start_workflow(resources.celery_app(), workflow, submission['args'])
+    return {'workflow_id': workflow['_id']}
+
+
+@router.post("/bulk")
+def create_workflows_in_bulk(request: Request, body: list[WFRequest]) -> dict:
+    """
+    Create and start many workflows with one insert and one broker connection.
+    Each item of results has the workflow_id of the created workflow and / or the error that prevented it.
+    The request is admitted or rejected (429) as a whole.
+    """
+    max_bulk_size = config['workflows']['max_bulk_size']
+    assert len(body) <= max_bulk_size, f'at most {max_bulk_size} workflows can be created in one request'
+    admission_controller.admit(resources.database(), request.state.user, [b.app_id for b in body])
+
+    results = create_workflows(resources.celery_app(), resources.collection('workflow_meta'),
+                               [submission_request(b) for b in body])
+    response_cache.invalidate_lists()
+    return {
+        'created': sum(1 for r in results if 'workflow_id' in r),
+        'failed': sum(1 for r in results if 'error' in r),
+        'results': results
+    }
 
 
-@router.post('/{workflow_id}/pause')
-def pause_workflow(workflow_id: str) -> dict:
-    wf = Workflow(celery_app=celery_app, workflow_id=workflow_id)
+def pause(workflow_id: str) -> dict:
+    wf = groups.Workflow(celery_app=resources.celery_app(), workflow_id=workflow_id)
     status = wf.pause(refresh=False)
+    if status['paused']:
+        counters.record_status(resources.database(), workflow_id,
+                               wf.workflow.get('app_id', None), wf.workflow['_status'])
+    response_cache.invalidate([workflow_id])
+    return status
+
+
+def resume(workflow_id: str, force: bool = False, args: list = None) -> dict:
+    wf = groups.Workflow(celery_app=resources.celery_app(), workflow_id=workflow_id)
+    status = wf.resume(force=force, args=args, refresh=False)
+    response_cache.invalidate([workflow_id])
     return status
 
 
+class BulkFilter(BaseModel):
+    app_id: str = None
+    status: Status = None
+    workflow_ids: list[str] = None
+
+
+class BulkResumeRequest(BulkFilter):
+    args: list = None
+
+
+def bulk_workflow_ids(body: BulkFilter) -> list[str]:
+    query = wf_query(status=body.status, app_id=body.app_id, workflow_ids=body.workflow_ids)
+    return find_workflow_ids(resources.collection('workflow_meta'), query, limit=config['workflows']['max_bulk_size'])
+
+
+@router.post('/bulk/pause')
+def pause_workflows_in_bulk(body: BulkFilter) -> dict:
+    """
+    Pause every workflow that matches the filter, a few at a time.
+    """
+    summary = apply_concurrently(pause, bulk_workflow_ids(body), config['workflows']['bulk_concurrency'])
+    summary['paused'] = sum(1 for r in summary['results'].values() if r['paused'])
+    return summary
+
+
+@router.post('/bulk/resume')
+def resume_workflows_in_bulk(
+    body: BulkResumeRequest,
+    force: bool = Query(False, description="Submit the next task even if its status is not FAILED / REVOKED")
+) -> dict:
+    """
+    Resume every workflow that matches the filter, a few at a time.
+    """
+    summary = apply_concurrently(lambda workflow_id: resume(workflow_id, force=force, args=body.args),
+                                 bulk_workflow_ids(body),
+                                 config['workflows']['bulk_concurrency'])
+    summary['resumed'] = sum(1 for r in summary['results'].values() if r['resumed'])
+    return summary
+
+
+@router.post('/bulk/delete')
+def delete_workflows_in_bulk(body: BulkFilter) -> dict:
+    """
+    Delete every workflow that matches the filter along with the results of its tasks.
+    """
+    workflow_ids = bulk_workflow_ids(body)
+    summary = delete_workflows(resources.database(), workflow_ids, batch_size=config['workflows']['delete_batch_size'])
+    response_cache.invalidate(workflow_ids)
+    summary['matched'] = len(workflow_ids)
+    return summary
+
+
+@router.post('/{workflow_id}/pause')
+def pause_workflow(workflow_id: str) -> dict:
+    return pause(workflow_id)
+
+
 class ArgsRequest(BaseModel):
     args: list = None
 
@@ -254,14 +445,14 @@ def resume_workflow(
     body: ArgsRequest,
     force: bool = Query(False, description="Submit the next task even if its status is not FAILED / REVOKED")
 ) -> dict:
-    wf = Workflow(celery_app=celery_app, workflow_id=workflow_id)
-    status = wf.resume(force=force, args=body.args, refresh=False)
-    return status
+    return resume(workflow_id, force=force, args=body.args)
 
 
 @router.delete('/{workflow_id}')
-def delete_workflow(workflow_id: str):
-    results = wf_col.delete_one({'_id': workflow_id})
-    return {
-        'deleted_count': results.deleted_count
-    }
+def delete_workflow(workflow_id: str) -> dict:
+    """
+    Delete the workflow along with the results of its tasks.
+    """
+    summary = delete_workflows(resources.database(), [workflow_id], batch_size=1)
+    response_cache.invalidate([workflow_id])
+    return summary
@@ -0,0 +1,25 @@
+import argparse
+import logging
+
+import pymongo
+
+from rhythm_api import analytics
+from rhythm_api.config.celeryconfig import result_backend
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Maintain the step rollups served by /analytics/steps')
+    parser.add_argument('command', choices=['rebuild', 'watch'],
+                        help='rebuild - roll up every finished task again, '
+                             'watch - roll up finished tasks as they come')
+    parser.add_argument('--interval', type=float, default=60, help='Seconds between syncs')
+    parser.add_argument('--overlap', type=float, default=600,
+                        help='Seconds of already synced tasks re-read by each sync, for tasks written late')
+
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s %(levelname)s %(name)s: %(message)s')
+
+    db = pymongo.MongoClient(result_backend).get_default_database()
+    if args.command == 'rebuild':
+        analytics.rebuild(db)
+    else:
+        analytics.watch(db, interval=args.interval, overlap=args.overlap)
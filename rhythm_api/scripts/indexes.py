@@ -0,0 +1,23 @@
+import argparse
+import json
+
+import pymongo
+
+from rhythm_api import indexes
+from rhythm_api.config.celeryconfig import result_backend
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Manage the indexes declared in rhythm_api.indexes')
+    parser.add_argument('command', choices=['apply', 'report'],
+                        help='apply - create the missing indexes, '
+                             'report - list missing, undeclared and unused indexes')
+
+    args = parser.parse_args()
+
+    db = pymongo.MongoClient(result_backend).get_default_database()
+    if args.command == 'apply':
+        errors = indexes.apply(db)
+        if errors:
+            print(json.dumps(errors, indent=2))
+    else:
+        print(json.dumps(indexes.report(db), indent=2))
@@ -0,0 +1,25 @@
+import argparse
+import logging
+
+import pymongo
+
+from rhythm_api import retention
+from rhythm_api.config import config
+from rhythm_api.config.celeryconfig import result_backend
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Archive and delete workflows past their retention policy')
+    parser.add_argument('command', choices=['run', 'watch'],
+                        help='run - archive once, watch - archive every interval seconds')
+    parser.add_argument('--interval', type=float, default=3600, help='Seconds between runs')
+    parser.add_argument('--dry_run', action='store_true',
+                        help='Print the number of workflows that would be archived')
+
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s %(levelname)s %(name)s: %(message)s')
+
+    db = pymongo.MongoClient(result_backend).get_default_database()
+    if args.command == 'run':
+        print(retention.run(db, config['retention'], dry_run=args.dry_run))
+    else:
+        retention.watch(db, config['retention'], interval=args.interval)
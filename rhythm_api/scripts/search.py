@@ -0,0 +1,17 @@
+import argparse
+
+import pymongo
+
+from rhythm_api import search
+from rhythm_api.config.celeryconfig import result_backend
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Maintain the search terms of workflows used by /workflows/search')
+    parser.add_argument('command', choices=['backfill'],
+                        help='backfill - write the search terms of the workflows created before they were added')
+    parser.add_argument('--batch_size', type=int, default=500, help='Workflows updated at a time')
+
+    args = parser.parse_args()
+
+    db = pymongo.MongoClient(result_backend).get_default_database()
+    print('updated', search.backfill(db, batch_size=args.batch_size), 'workflows')
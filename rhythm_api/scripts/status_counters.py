@@ -0,0 +1,24 @@
+import argparse
+import logging
+
+import pymongo
+
+from rhythm_api import counters
+from rhythm_api.config.celeryconfig import result_backend
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Maintain the workflow counts served by /workflows/counts_by_status')
+    parser.add_argument('command', choices=['reconcile', 'watch'],
+                        help='reconcile - rebuild the counts from workflow_meta, '
+                             'watch - keep the counts up to date with workflow_meta')
+    parser.add_argument('--poll_interval', type=float, default=5,
+                        help='Seconds between polls when change streams are not supported')
+
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s %(levelname)s %(name)s: %(message)s')
+
+    db = pymongo.MongoClient(result_backend).get_default_database()
+    if args.command == 'reconcile':
+        counters.reconcile(db)
+    else:
+        counters.watch(db, poll_interval=args.poll_interval)
@@ -0,0 +1,121 @@
+import re
+
+import pymongo
+
+from rhythm_api.bulk import batched
+
+# Search on workflows, for GET /workflows/search
+#
+# - text search on name and description, backed by a text index
+# - prefix search on name, an anchored regex on the (app_id, name, _id) index
+# - equality on step kwargs and workflow args: workflows carry their kwargs and args as an indexed array of
+#   normalized key=value terms in _search, written when they are created. ex:
+#     steps [{'kwargs': {'dataset_id': 'DS-1'}}], args ['ds-1', {'user': 'Ann'}]
+#     -> _search ['kwargs.dataset_id=ds-1', 'args=ds-1', 'args.user=ann']
+#   values are compared case-insensitively
+
+SEARCH_FIELD = '_search'
+
+# longer values are truncated, index keys have a size limit
+MAX_VALUE_LENGTH = 256
+
+
+def normalize(value) -> str:
+    if value is None:
+        return 'null'
+    if isinstance(value, bool):
+        return 'true' if value else 'false'
+    return str(value).strip().casefold()[:MAX_VALUE_LENGTH]
+
+
+def flatten(key: str, value):
+    """
+    yield (key, value) of the scalars of value, keyed by their dotted path in nested dicts.
+    list items have the key of the list
+    """
+    if isinstance(value, dict):
+        for k, v in value.items():
+            yield from flatten(f'{key}.{k}', v)
+    elif isinstance(value, (list, tuple)):
+        for v in value:
+            yield from flatten(key, v)
+    else:
+        yield key, value
+
+
+def term(key: str, value) -> str:
+    return f'{key.strip()}={normalize(value)}'
+
+
+def search_terms(steps: list[dict], args: list = None) -> list[str]:
+    """
+    _search of a workflow: the kwargs of its steps and its args
+    """
+    terms = set()
+    for step in steps:
+        for key, value in flatten('kwargs', step.get('kwargs', None) or {}):
+            terms.add(term(key, value))
+    for key, value in flatten('args', list(args or [])):
+        terms.add(term(key, value))
+    return sorted(terms)
+
+
+def parse_term(prefix: str, expr: str) -> str:
+    """
+    :param expr: key=value, ex: dataset_id=DS-1
+    """
+    key, sep, value = expr.partition('=')
+    assert sep and key.strip(), f'{expr} is not key=value'
+    return term(f'{prefix}.{key.strip()}', value)
+
+
+def search_query(text: str = None, name_prefix: str = None, kwargs: list[str] = None, args: list[str] = None) -> dict:
+    """
+    :param text: words to search in name and description
+    :param kwargs: key=value filters on the kwargs of any step
+    :param args: filters on the args, value or key=value for a dict arg
+    """
+    query = {}
+    if text:
+        query['$text'] = {'$search': text}
+    if name_prefix:
+        query['name'] = {'$regex': f'^{re.escape(name_prefix)}'}
+
+    terms = [parse_term('kwargs', expr) for expr in kwargs or []]
+    for expr in args or []:
+        terms.append(parse_term('args', expr) if '=' in expr else term('args', expr))
+    if terms:
+        query[SEARCH_FIELD] = {'$all': terms}
+    return query
+
+
+def first_task_args(db, workflow: dict):
+    """
+    args of a workflow that was created before _search, from the first task of its first step
+    (celery stores args with result_extended)
+    """
+    steps = workflow.get('steps', None) or []
+    task_runs = (steps[0].get('task_runs', None) or []) if len(steps) > 0 else []
+    if len(task_runs) == 0:
+        return None
+    task = db.get_collection('celery_taskmeta').find_one({'_id': task_runs[0]['task_id']}, {'args': 1})
+    return task.get('args', None) if task is not None else None
+
+
+def backfill(db, batch_size: int = 500) -> int:
+    """
+    write _search of the workflows that do not have it
+
+    :return: number of updated workflows
+    """
+    wf_col = db.get_collection('workflow_meta')
+    cursor = wf_col.find({SEARCH_FIELD: {'$exists': False}}, {'steps': 1})
+    updated = 0
+    for batch in batched(cursor, batch_size):
+        ops = [
+            pymongo.UpdateOne({'_id': wf['_id']},
+                              {'$set': {SEARCH_FIELD: search_terms(wf.get('steps', []), first_task_args(db, wf))}})
+            for wf in batch
+        ]
+        updated += wf_col.bulk_write(ops, ordered=False).modified_count
+    return updated
@@ -0,0 +1,86 @@
+import argparse
+import os
+import tempfile
+
+from gunicorn.app.base import BaseApplication
+
+from rhythm_api.config import config
+
+# Production server: gunicorn managing uvicorn workers, configured by config['server'].
+#
+# The app is imported once by the gunicorn master (preload) and the workers are forked from it.
+# Importing the app does not connect to anything (rhythm_api.resources), every worker creates its own clients,
+# sizes its threadpool and runs the warm-up queries in the app's lifespan, before it accepts connections.
+# On SIGTERM the workers stop accepting connections and get graceful_timeout seconds to finish in-flight requests.
+#
+# python -m rhythm_api.serve, or poetry run serve
+
+
+def default_workers() -> int:
+    # cores this process may run on, which can be fewer than os.cpu_count() in a container
+    if hasattr(os, 'sched_getaffinity'):
+        return len(os.sched_getaffinity(0))
+    return os.cpu_count() or 1
+
+
+def child_exit(server, worker) -> None:
+    # drop the live gauges of the exited worker from /metrics
+    from prometheus_client import multiprocess
+    multiprocess.mark_process_dead(worker.pid)
+
+
+def gunicorn_options(server_config: dict) -> dict:
+    options = {
+        'bind': f'{server_config["host"]}:{server_config["port"]}',
+        'workers': server_config['workers'] or default_workers(),
+        'worker_class': 'uvicorn.workers.UvicornWorker',
+        'preload_app': True,
+        'keepalive': server_config['keepalive'],
+        'backlog': server_config['backlog'],
+        'timeout': server_config['timeout'],
+        'graceful_timeout': server_config['graceful_timeout'],
+        'max_requests': server_config['max_requests'],
+        'max_requests_jitter': server_config['max_requests_jitter'],
+    }
+    if 'PROMETHEUS_MULTIPROC_DIR' in os.environ:
+        options['child_exit'] = child_exit
+    return options
+
+
+class Application(BaseApplication):
+    def __init__(self, options: dict):
+        self.options = options
+        super().__init__()
+
+    def load_config(self):
+        for key, value in self.options.items():
+            self.cfg.set(key, value)
+
+    def load(self):
+        from rhythm_api.main import app
+        return app
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Run the API with gunicorn, settings default to config["server"]')
+    parser.add_argument('--port', type=int, help='Port to listen on')
+    parser.add_argument('--workers', type=int, help='Number of worker processes')
+    parser.add_argument('--root_path', type=str, help='Path prefix of the API behind a proxy, ex: /rhythm')
+
+    args = parser.parse_args()
+
+    server_config = config['server']
+    for attr in ['port', 'workers', 'root_path']:
+        if getattr(args, attr) is not None:
+            server_config[attr] = getattr(args, attr)
+
+    server_config['workers'] = server_config['workers'] or default_workers()
+    if server_config['workers'] > 1 and 'PROMETHEUS_MULTIPROC_DIR' not in os.environ:
+        # /metrics aggregates the workers' metrics from this directory. set before prometheus_client is imported
+        os.environ['PROMETHEUS_MULTIPROC_DIR'] = tempfile.mkdtemp(prefix='rhythm_api_metrics_')
+
+    Application(gunicorn_options(server_config)).run()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,127 @@
+from sca_rhythm import Workflow
+
+# Sparse responses: ?fields=id,name,status,steps.name returns only the selected fields of each workflow.
+#
+# The selection is parsed into a tree of field names, True selects a whole field: {'id': True, 'steps': {'name': True}}
+# and is pushed down to both lookups:
+# - workflow_meta: only the selected top-level fields. the name, task, group and task runs of every step are always
+#   read, statuses are computed from them
+# - celery_taskmeta: only the status of the tasks unless task run fields are selected, so that large results and
+#   tracebacks are not read. previous task runs are only fetched if they are selected
+# The embellished workflows are then pruned to the selection.
+
+# the workflow_meta names of the fields are accepted as well
+ALIASES = {
+    '_id': 'id',
+    '_status': 'status',
+}
+
+# response field -> workflow_meta field
+DOCUMENT_FIELDS = {
+    'id': '_id',
+    'name': 'name',
+    'app_id': 'app_id',
+    'description': 'description',
+    'created_at': 'created_at',
+    'updated_at': 'updated_at',
+    Workflow.RESUME_LOCK_ATTR: Workflow.RESUME_LOCK_ATTR,
+}
+WORKFLOW_FIELDS = [*DOCUMENT_FIELDS.keys(), 'status', 'steps_done', 'total_steps', 'steps']
+STEP_FIELDS = ['name', 'task', 'group', 'status', 'last_task_run', 'prev_task_runs']
+
+
+def parse(fields: str | None) -> dict | None:
+    """
+    :param fields: comma separated paths, ex: id,name,status,steps.name,steps.last_task_run.date_done
+    :return: selection tree, None selects every field
+    """
+    if fields is None or fields.strip() == '':
+        return None
+    tree = {}
+    for path in fields.split(','):
+        parts = [part.strip() for part in path.split('.')]
+        if parts == ['']:
+            continue
+        parts[0] = ALIASES.get(parts[0], parts[0])
+        assert parts[0] in WORKFLOW_FIELDS, f'unknown field {path.strip()}'
+        assert len(parts) == 1 or parts[0] == 'steps', f'{parts[0]} has no fields'
+        assert len(parts) == 1 or parts[1] in STEP_FIELDS, f'unknown field {path.strip()}'
+        assert all(parts), f'invalid field {path.strip()}'
+
+        node = tree
+        for part in parts[:-1]:
+            if node.get(part, None) is True:
+                # the whole field is already selected
+                break
+            node = node.setdefault(part, {})
+        else:
+            node[parts[-1]] = True
+    return tree
+
+
+def subtree(tree: dict | None, *path: str) -> dict | bool:
+    """
+    selection under path. True - everything, False - nothing
+    """
+    node = True if tree is None else tree
+    for part in path:
+        if node is True:
+            return True
+        node = node.get(part, False)
+        if node is False:
+            return False
+    return node
+
+
+def selected(tree: dict | None, *path: str) -> bool:
+    return subtree(tree, *path) is not False
+
+
+def task_runs(tree: dict | None, last_task_run: bool, prev_task_runs: bool) -> tuple[bool, bool]:
+    """
+    last_task_run and prev_task_runs of hydration, without the task runs that are not selected
+    """
+    return (last_task_run and selected(tree, 'steps', 'last_task_run'),
+            prev_task_runs and selected(tree, 'steps', 'prev_task_runs'))
+
+
+def workflow_projection(tree: dict | None) -> dict | None:
+    """
+    workflow_meta projection of the selection, None reads whole documents
+    """
+    if tree is None:
+        return None
+    projection = {'steps.name': 1, 'steps.task': 1, 'steps.group': 1, 'steps.task_runs': 1}
+    for field in tree:
+        if field in DOCUMENT_FIELDS and field != 'id':
+            projection[DOCUMENT_FIELDS[field]] = 1
+    return projection
+
+
+def task_projection(tree: dict | None) -> dict | None:
+    """
+    celery_taskmeta projection of the selection, None reads whole documents
+    """
+    runs = [subtree(tree, 'steps', attr) for attr in ['last_task_run', 'prev_task_runs']]
+    if any(run is True for run in runs):
+        return None
+    # step and workflow statuses
+    projection = {'status': 1}
+    for run in runs:
+        if run is not False:
+            # date_start comes from the workflow
+            projection.update({field: 1 for field in run if field != 'date_start'})
+    return projection
+
+
+def select(doc, tree: dict | bool | None):
+    """
+    prune an embellished document to the selection
+    """
+    if tree is None or tree is True:
+        return doc
+    if isinstance(doc, list):
+        return [select(d, tree) for d in doc]
+    if not isinstance(doc, dict):
+        return doc
+    return {field: select(doc[field], sub) for field, sub in tree.items() if field in doc}
@@ -0,0 +1,68 @@
+import celery.states
+import pymongo
+
+# Queries on celery_taskmeta by step, for the /tasks endpoints.
+# Both are scoped to an app and restricted to tasks that have a step, so that they are served by the partial
+# (kwargs.app_id, ...) indexes declared in rhythm_api.indexes instead of scanning the collection.
+
+# tasks that have not finished yet
+ACTIVE_STATES = sorted(celery.states.UNREADY_STATES)
+
+
+def step_query(app_id: str, task: str = None) -> dict:
+    query = {
+        'kwargs.app_id': app_id,
+        # makes the partial indexes usable, they only have tasks with a step
+        'kwargs.step': {'$exists': True},
+    }
+    if task is not None:
+        query['name'] = task
+    return query
+
+
+async def unique_steps(task_col, app_id: str, task: str = None) -> list[str]:
+    """
+    names of the steps that have run for an app, optionally only the steps run by a task
+    """
+    return sorted(await task_col.distinct('kwargs.step', step_query(app_id, task)))
+
+
+def active_query(app_id: str, step: str = None) -> dict:
+    query = step_query(app_id)
+    query['status'] = {'$in': ACTIVE_STATES}
+    if step is not None:
+        query['kwargs.step'] = step
+    return query
+
+
+async def active_tasks(task_col, app_id: str, step: str = None, skip: int = 0, limit: int = 100) -> dict:
+    """
+    a page of the app's unfinished tasks in step order, grouped by step, and the number of them in each step
+    """
+    query = active_query(app_id, step)
+    counts = {
+        r['_id']: r['count']
+        async for r in task_col.aggregate([
+            {'$match': query},
+            {'$group': {'_id': '$kwargs.step', 'count': {'$sum': 1}}},
+        ])
+    }
+    cursor = task_col.find(query) \
+        .sort([('kwargs.step', pymongo.ASCENDING), ('_id', pymongo.ASCENDING)]) \
+        .skip(skip) \
+        .limit(limit)
+
+    results = []
+    async for task in cursor:
+        if len(results) == 0 or results[-1]['step'] != task['kwargs']['step']:
+            results.append({'step': task['kwargs']['step'], 'tasks': []})
+        results[-1]['tasks'].append(task)
+    return {
+        'metadata': {
+            'total': sum(counts.values()),
+            'skip': skip,
+            'limit': limit,
+        },
+        'counts': dict(sorted(counts.items())),
+        'results': results,
+    }
@@ -0,0 +1,162 @@
+import datetime
+import uuid
+from collections import Counter
+
+import celery.states
+from pymongo.errors import BulkWriteError
+
+from rhythm_api import counters, groups, search
+from rhythm_api.config import config
+
+# Creating and starting workflows without a sca_rhythm.Workflow per workflow, so that many workflows can be
+# inserted with one insert_many and their first tasks published over one broker connection.
+# The documents and the task messages are the same as the ones sca_rhythm.Workflow creates.
+
+
+def validate_priority(priority, name: str) -> None:
+    if priority is not None:
+        assert isinstance(priority, int) and 0 <= priority <= 9, f'{name} is not an integer between 0 and 9'
+
+
+def validate_workflow(steps: list[dict], name: str, app_id: str, priority: int = None) -> None:
+    """
+    same checks as sca_rhythm.Workflow, and priorities and groups
+    """
+    assert len(steps) > 0, 'steps is empty'
+    for i, step in enumerate(steps):
+        for attr in ['name', 'task']:
+            assert attr in step, f'step[{i}] does not have "{attr}" key'
+            assert isinstance(step[attr], str), f'step[{i}]["{attr}"] is not a string'
+            assert len(step[attr]) > 0, f'step[{i}]["{attr}"] is an empty string'
+        if step.get('queue', None) is not None:
+            assert isinstance(step['queue'], str), f'step[{i}]["queue"] is not a string'
+            assert len(step['queue']) > 0, f'step[{i}]["queue"] is an empty string'
+        validate_priority(step.get('priority', None), f'step[{i}]["priority"]')
+        if step.get('group', None) is not None:
+            assert config['workflows']['groups_enabled'], \
+                f'step[{i}] has a group, groups are not enabled (workflows.groups_enabled)'
+            assert isinstance(step['group'], str), f'step[{i}]["group"] is not a string'
+            assert len(step['group']) > 0, f'step[{i}]["group"] is an empty string'
+    names = [step['name'] for step in steps]
+    duplicate_names = [name for name, count in Counter(names).items() if count > 1]
+    assert len(duplicate_names) == 0, f'Steps with duplicate names: {duplicate_names}'
+    groups.validate_groups(steps)
+
+    assert name, 'name cannot be empty'
+    assert app_id, 'app_id cannot be empty'
+    validate_priority(priority, 'priority')
+
+
+def step_document(step: dict, priority: int | None) -> dict:
+    """
+    the step as stored in workflow_meta: with its own priority, or the priority of its workflow.
+    without either, the priority is left to the default of sca_rhythm (the position of the step)
+    """
+    step = dict(step)
+    if step.get('group', None) is None:
+        step.pop('group', None)
+    if step.get('priority', None) is None:
+        step.pop('priority', None)
+        if priority is not None:
+            step['priority'] = priority
+    return step
+
+
+def new_workflow(steps: list[dict], name: str, app_id: str, description: str = None, args: list = None,
+                 priority: int = None) -> dict:
+    """
+    :param args: args of the first task, only used for search
+    :param priority: priority (0 - 9, higher is more urgent) of the tasks of the steps that do not set their own.
+        steps keep their priority in the document, so the tasks the workers publish for the next steps have it too
+    """
+    validate_workflow(steps, name, app_id, priority)
+    workflow = {
+        '_id': str(uuid.uuid4()),
+        'created_at': datetime.datetime.utcnow(),
+        'steps': [step_document(step, priority) for step in steps],
+        'name': name,
+        'app_id': app_id,
+        'description': description,
+        '_status': celery.states.PENDING,
+        search.SEARCH_FIELD: search.search_terms(steps, args)
+    }
+    if priority is not None:
+        workflow['priority'] = priority
+    return workflow
+
+
+def send_step_task(celery_app, workflow: dict, step_idx: int, task_args: list | tuple = None, **kwargs) -> None:
+    """
+    same as sca_rhythm.Workflow.wf_send_task
+    :param kwargs: passed to celery_app.send_task, ex: producer
+    """
+    step = workflow['steps'][step_idx]
+    task_priority = max(0, min(step.get('priority', step_idx + 1), 9))  # between 0 and 9
+
+    task_kwargs = dict(step.get('kwargs', None) or {})
+    task_kwargs['workflow_id'] = workflow['_id']
+    task_kwargs['step'] = step['name']
+    task_kwargs['app_id'] = workflow['app_id']
+
+    celery_app.send_task(name=step['task'], args=task_args, kwargs=task_kwargs,
+                         queue=step.get('queue', None), priority=task_priority, **kwargs)
+
+
+def start_workflow(celery_app, workflow: dict, args: list, **kwargs) -> None:
+    """
+    launch the task of the first step, same as sca_rhythm.Workflow.start.
+    if the workflow starts with a group, the tasks of all of its steps
+    """
+    for step_idx in groups.stages(workflow['steps'])[0]:
+        send_step_task(celery_app, workflow, step_idx, task_args=tuple(args), **kwargs)
+
+
+def create_workflows(celery_app, wf_col, requests: list[dict]) -> list[dict]:
+    """
+    Insert and start many workflows.
+
+    :param requests: [{'steps', 'name', 'app_id', 'description', 'args', 'priority'}]
+    :return: one result per request, in the same order:
+        {'workflow_id': str} if the workflow was created and started,
+        {'error': str} if it was not created, or
+        {'workflow_id': str, 'error': str} if it was created but its first task could not be published
+    """
+    results: list[dict] = [{} for _ in requests]
+    workflows: list[tuple[int, dict]] = []
+    for i, request in enumerate(requests):
+        try:
+            workflow = new_workflow(steps=request['steps'],
+                                    name=request['name'],
+                                    app_id=request['app_id'],
+                                    description=request.get('description', None),
+                                    args=request.get('args', None),
+                                    priority=request.get('priority', None))
+            workflows.append((i, workflow))
+        except AssertionError as e:
+            results[i]['error'] = str(e)
+
+    if len(workflows) == 0:
+        return results
+
+    failed_inserts = {}
+    try:
+        wf_col.insert_many([workflow for _, workflow in workflows], ordered=False)
+    except BulkWriteError as e:
+        failed_inserts = {err['index']: err['errmsg'] for err in e.details['writeErrors']}
+
+    counters.record_created(wf_col.database,
+                            [workflow for j, (_, workflow) in enumerate(workflows) if j not in failed_inserts])
+
+    # one broker connection for all the messages
+    with celery_app.producer_or_acquire() as producer:
+        for j, (i, workflow) in enumerate(workflows):
+            if j in failed_inserts:
+                results[i]['error'] = failed_inserts[j]
+                continue
+            results[i]['workflow_id'] = workflow['_id']
+            try:
+                start_workflow(celery_app, workflow, requests[i].get('args', None) or [], producer=producer)
+            except Exception as e:
+                results[i]['error'] = f'workflow is created but its first task could not be published: {e}'
+
+    return results
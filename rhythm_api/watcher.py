@@ -0,0 +1,187 @@
+import asyncio
+import datetime
+import logging
+from collections import OrderedDict
+
+from pymongo.errors import OperationFailure, PyMongoError
+
+from rhythm_api.config import config
+from rhythm_api.resources import async_collection
+
+logger = logging.getLogger(__name__)
+
+
+def snapshot(workflow: dict, task_status: str = None) -> dict:
+    """
+    the part of a workflow_meta document that subscribers are notified about:
+    the workflow status and the most recently started step.
+    every step transition appends a task run, so the last started task identifies the current step.
+
+    :param task_status: status of the task of the current step (celery_taskmeta), None if it is not known
+    """
+    current_step, current_run = None, None
+    for step in workflow.get('steps', []):
+        task_runs = step.get('task_runs', None) or []
+        if len(task_runs) > 0:
+            run = task_runs[-1]
+            if current_run is None or (run.get('date_start', None) or datetime.datetime.min) >= \
+                    (current_run.get('date_start', None) or datetime.datetime.min):
+                current_step, current_run = step, run
+    return {
+        'workflow_id': workflow['_id'],
+        'app_id': workflow.get('app_id', None),
+        'status': workflow.get('_status', None),
+        'step': current_step['name'] if current_step is not None else None,
+        'task_id': current_run['task_id'] if current_run is not None else None,
+        'date_start': current_run.get('date_start', None) if current_run is not None else None,
+        'task_status': task_status,
+        'updated_at': workflow.get('updated_at', None),
+    }
+
+
+class Subscription:
+    def __init__(self, workflow_id: str = None, app_id: str = None, queue_size: int = 100):
+        self.workflow_id = workflow_id
+        self.app_id = app_id
+        self.queue: asyncio.Queue[dict] = asyncio.Queue(maxsize=queue_size)
+
+    def matches(self, event: dict) -> bool:
+        if self.workflow_id is not None and event['workflow_id'] != self.workflow_id:
+            return False
+        if self.app_id is not None and event['app_id'] != self.app_id:
+            return False
+        return True
+
+    def put(self, event: dict) -> None:
+        # a slow subscriber loses its oldest events instead of holding up the others
+        if self.queue.full():
+            self.queue.get_nowait()
+        self.queue.put_nowait(event)
+
+
+class WorkflowWatcher:
+    """
+    One watcher per process that tails workflow_meta and celery_taskmeta and fans status and step transitions out
+    to subscribers. A change of a task is published with the workflow of its kwargs.workflow_id, so that the end of
+    a step (the status of its task) is published when it happens rather than when the next step starts.
+
+    It uses a change stream on both collections, and when mongo is not a replica set, polls workflows by
+    created_at / updated_at and tasks by date_done. The watcher runs only while there are subscribers.
+    """
+
+    def __init__(self, poll_interval: float, overlap: float, queue_size: int, max_snapshots: int):
+        self.poll_interval = poll_interval
+        self.overlap = overlap
+        self.queue_size = queue_size
+        self.max_snapshots = max_snapshots
+        self.subscriptions: set[Subscription] = set()
+        # last published snapshot of each workflow, used to publish only transitions
+        self.snapshots: OrderedDict[str, dict] = OrderedDict()
+        self._task: asyncio.Task | None = None
+
+    def subscribe(self, workflow_id: str = None, app_id: str = None) -> Subscription:
+        subscription = Subscription(workflow_id=workflow_id, app_id=app_id, queue_size=self.queue_size)
+        self.subscriptions.add(subscription)
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._run())
+        return subscription
+
+    def unsubscribe(self, subscription: Subscription) -> None:
+        self.subscriptions.discard(subscription)
+        if len(self.subscriptions) == 0:
+            self.stop()
+
+    def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+        self.snapshots.clear()
+
+    def publish(self, workflow: dict, task: dict = None) -> None:
+        """
+        :param task: celery_taskmeta document that changed, the status of the current task is kept from the last
+            snapshot otherwise
+        """
+        event = snapshot(workflow)
+        prev = self.snapshots.get(event['workflow_id'], None)
+        if task is not None and task['_id'] == event['task_id']:
+            event['task_status'] = task.get('status', None)
+        elif prev is not None and prev['task_id'] == event['task_id']:
+            event['task_status'] = prev['task_status']
+        self.snapshots[event['workflow_id']] = event
+        self.snapshots.move_to_end(event['workflow_id'])
+        while len(self.snapshots) > self.max_snapshots:
+            self.snapshots.popitem(last=False)
+
+        if prev is not None and (prev['status'], prev['task_id'], prev['task_status']) == \
+                (event['status'], event['task_id'], event['task_status']):
+            return
+        for subscription in self.subscriptions:
+            if subscription.matches(event):
+                subscription.put(event)
+
+    async def publish_task(self, wf_col, task: dict) -> None:
+        kwargs = task.get('kwargs', None) or {}
+        workflow_id = kwargs.get('workflow_id', None)
+        if workflow_id is None:
+            return
+        # the workflow is only read if someone is subscribed to it
+        if not any(s.matches({'workflow_id': workflow_id, 'app_id': kwargs.get('app_id', None)})
+                   for s in self.subscriptions):
+            return
+        workflow = await wf_col.find_one({'_id': workflow_id})
+        if workflow is not None:
+            self.publish(workflow, task=task)
+
+    async def _run(self) -> None:
+        wf_col = async_collection('workflow_meta')
+        task_col = async_collection('celery_taskmeta')
+        since = datetime.datetime.utcnow()
+        resume_token = None
+        while True:
+            try:
+                pipeline = [{'$match': {'operationType': {'$in': ['insert', 'update', 'replace']},
+                                        'ns.coll': {'$in': [wf_col.name, task_col.name]}}}]
+                async with wf_col.database.watch(pipeline, full_document='updateLookup',
+                                                 resume_after=resume_token) as stream:
+                    async for change in stream:
+                        resume_token = stream.resume_token
+                        doc = change.get('fullDocument', None)
+                        if doc is None:
+                            continue
+                        if change['ns']['coll'] == task_col.name:
+                            await self.publish_task(wf_col, doc)
+                        else:
+                            self.publish(doc)
+            except OperationFailure as e:
+                # 40573 - The $changeStream stage is only supported on replica sets
+                if e.code == 40573:
+                    await self._poll(wf_col, task_col, since)
+                logger.warning('change stream failed, retrying: %s', e)
+                await asyncio.sleep(self.poll_interval)
+            except PyMongoError as e:
+                logger.warning('change stream failed, retrying: %s', e)
+                await asyncio.sleep(self.poll_interval)
+
+    async def _poll(self, wf_col, task_col, since: datetime.datetime) -> None:
+        # created_at / updated_at / date_done come from the celery workers' clocks, re-read the last "overlap" seconds
+        while True:
+            start = since - datetime.timedelta(seconds=self.overlap)
+            try:
+                cursor = wf_col.find({'$or': [{'updated_at': {'$gt': start}}, {'created_at': {'$gt': start}}]})
+                async for workflow in cursor:
+                    self.publish(workflow)
+                    since = max(since,
+                                workflow.get('updated_at', None) or since,
+                                workflow.get('created_at', None) or since)
+                # date_done is an ISO string, they sort in time order
+                cursor = task_col.find({'date_done': {'$gt': start.isoformat()}, 'kwargs.workflow_id': {'$ne': None}},
+                                       {'status': 1, 'kwargs': 1})
+                async for task in cursor:
+                    await self.publish_task(wf_col, task)
+            except PyMongoError as e:
+                logger.warning('poll failed: %s', e)
+            await asyncio.sleep(self.poll_interval)
+
+
+watcher = WorkflowWatcher(**config['events']['watcher'])
@@ -0,0 +1,219 @@
+import argparse
+import asyncio
+import json
+import random
+import statistics
+import sys
+import time
+from dataclasses import dataclass, field
+from typing import Callable
+
+import httpx
+import pymongo
+
+# Drives the API endpoints at a fixed concurrency and reports latency percentiles and throughput.
+# Seed the database first with tests.benchmark.seed, and run the API against it.
+
+
+@dataclass
+class Scenario:
+    name: str
+    method: str
+    # returns the path (and the json body) of the next request
+    request: Callable[[random.Random], tuple[str, dict | None]]
+    write: bool = False
+
+
+@dataclass
+class Result:
+    name: str
+    latencies: list[float] = field(default_factory=list)
+    errors: int = 0
+    elapsed: float = 0
+
+    def summary(self) -> dict:
+        latencies = sorted(self.latencies)
+
+        def percentile(p):
+            if not latencies:
+                return None
+            return round(latencies[min(len(latencies) - 1, int(len(latencies) * p / 100))] * 1000, 2)
+
+        return {
+            'scenario': self.name,
+            'requests': len(self.latencies) + self.errors,
+            'errors': self.errors,
+            'rps': round(len(self.latencies) / self.elapsed, 1) if self.elapsed else None,
+            'mean_ms': round(statistics.fmean(latencies) * 1000, 2) if latencies else None,
+            'p50_ms': percentile(50),
+            'p95_ms': percentile(95),
+            'p99_ms': percentile(99),
+        }
+
+
+def scenarios(workflows: list[dict], app_ids: list[str]) -> list[Scenario]:
+    """
+    :param workflows: sample of {'_id', 'app_id'} of the seeded workflows
+    """
+    def app(rnd):
+        return rnd.choice(app_ids)
+
+    def workflow_id(rnd):
+        return rnd.choice(workflows)['_id']
+
+    def new_workflow(rnd):
+        return {
+            'name': 'benchmark',
+            'app_id': app(rnd),
+            'steps': [{'name': 'inspect', 'task': 'scaworkers.workers.inspect.inspect_dataset', 'queue': 'benchmark'}],
+            'args': [1]
+        }
+
+    return [
+        Scenario('list', 'GET', lambda rnd: ('/workflows', None)),
+        Scenario('list_app', 'GET', lambda rnd: (f'/workflows?app_id={app(rnd)}', None)),
+        Scenario('list_app_active', 'GET', lambda rnd: (f'/workflows?app_id={app(rnd)}&status=ACTIVE', None)),
+        Scenario('list_app_by_name', 'GET',
+                 lambda rnd: (f'/workflows?app_id={app(rnd)}&sort_by=name&sort_order_asc=true', None)),
+        Scenario('list_prev_task_runs', 'GET',
+                 lambda rnd: (f'/workflows?app_id={app(rnd)}&prev_task_runs=true&limit=50', None)),
+        Scenario('list_deep_skip', 'GET', lambda rnd: (f'/workflows?app_id={app(rnd)}&skip=1000', None)),
+        Scenario('list_no_count', 'GET', lambda rnd: (f'/workflows?app_id={app(rnd)}&count=none', None)),
+        Scenario('counts_by_status', 'GET', lambda rnd: (f'/workflows/counts_by_status?app_id={app(rnd)}', None)),
+        Scenario('get', 'GET', lambda rnd: (f'/workflows/{workflow_id(rnd)}', None)),
+        Scenario('get_prev_task_runs', 'GET',
+                 lambda rnd: (f'/workflows/{workflow_id(rnd)}?prev_task_runs=true', None)),
+        Scenario('tasks_unique', 'GET', lambda rnd: (f'/tasks/unique?app_id={app(rnd)}', None)),
+        # publish tasks to the broker, run with --writes
+        Scenario('create', 'POST', lambda rnd: ('/workflows', new_workflow(rnd)), write=True),
+        Scenario('create_bulk', 'POST',
+                 lambda rnd: ('/workflows/bulk', [new_workflow(rnd) for _ in range(100)]), write=True),
+    ]
+
+
+async def run_scenario(client: httpx.AsyncClient, scenario: Scenario,
+                       concurrency: int, requests: int, warmup: int, seed: int) -> Result:
+    result = Result(scenario.name)
+    rnd = random.Random(seed)
+    remaining = warmup + requests
+
+    async def worker():
+        nonlocal remaining
+        while remaining > 0:
+            remaining -= 1
+            measured = remaining < requests
+            path, body = scenario.request(rnd)
+            t0 = time.perf_counter()
+            try:
+                response = await client.request(scenario.method, path, json=body)
+                ok = response.status_code < 400
+            except httpx.HTTPError:
+                ok = False
+            if not measured:
+                continue
+            if ok:
+                result.latencies.append(time.perf_counter() - t0)
+            else:
+                result.errors += 1
+
+    t0 = time.perf_counter()
+    await asyncio.gather(*[worker() for _ in range(concurrency)])
+    result.elapsed = time.perf_counter() - t0
+    return result
+
+
+def sample_workflows(uri: str, size: int) -> list[dict]:
+    db = pymongo.MongoClient(uri).get_default_database()
+    return list(db.get_collection('workflow_meta').aggregate([
+        {'$sample': {'size': size}},
+        {'$project': {'_id': 1, 'app_id': 1}}
+    ]))
+
+
+def regressions(summaries: list[dict], baseline: list[dict], max_regression: float) -> list[str]:
+    """
+    scenarios whose p95 is more than max_regression (a fraction) slower than in the baseline
+    """
+    baseline_p95 = {s['scenario']: s['p95_ms'] for s in baseline}
+    messages = []
+    for s in summaries:
+        prev = baseline_p95.get(s['scenario'], None)
+        if prev and s['p95_ms'] is not None and s['p95_ms'] > prev * (1 + max_regression):
+            messages.append(f'{s["scenario"]}: p95 {s["p95_ms"]}ms, baseline {prev}ms')
+    return messages
+
+
+def print_table(summaries: list[dict]) -> None:
+    columns = ['scenario', 'requests', 'errors', 'rps', 'mean_ms', 'p50_ms', 'p95_ms', 'p99_ms']
+    widths = [max(len(c), *(len(str(s[c])) for s in summaries)) for c in columns]
+    print('  '.join(c.ljust(w) for c, w in zip(columns, widths)))
+    for s in summaries:
+        print('  '.join(str(s[c]).ljust(w) for c, w in zip(columns, widths)))
+
+
+async def main(args) -> int:
+    workflows = sample_workflows(args.uri, args.sample)
+    assert workflows, 'workflow_meta is empty, seed it with python -m tests.benchmark.seed'
+    app_ids = sorted({wf['app_id'] for wf in workflows if wf.get('app_id', None)})
+
+    selected = [
+        s for s in scenarios(workflows, app_ids)
+        if (args.writes or not s.write) and (not args.scenario or s.name in args.scenario)
+    ]
+    headers = {'Authorization': f'Bearer {args.token}'}
+    limits = httpx.Limits(max_connections=args.concurrency, max_keepalive_connections=args.concurrency)
+    summaries = []
+    async with httpx.AsyncClient(base_url=args.url, headers=headers, limits=limits, timeout=args.timeout) as client:
+        for i, scenario in enumerate(selected):
+            result = await run_scenario(client, scenario, concurrency=args.concurrency,
+                                        requests=args.requests, warmup=args.warmup, seed=args.seed + i)
+            summaries.append(result.summary())
+    print_table(summaries)
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(summaries, f, indent=2)
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            messages = regressions(summaries, json.load(f), args.max_regression)
+        for message in messages:
+            print('regression', message)
+        if messages:
+            return 1
+    return 0
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Load test the API with workflows seeded by tests.benchmark.seed')
+    parser.add_argument('--url', type=str, default='http://localhost:5000', help='Base url of the API')
+    parser.add_argument('--token', type=str, default=None,
+                        help='Bearer token. Default is a token issued with the local keys.')
+    parser.add_argument('--uri', type=str, default=None,
+                        help='Mongo connection string of the seeded database, to sample workflow ids from. '
+                             'Default is the celery result backend.')
+    parser.add_argument('--concurrency', type=int, default=16, help='Requests in flight')
+    parser.add_argument('--requests', type=int, default=1000, help='Measured requests per scenario')
+    parser.add_argument('--warmup', type=int, default=50, help='Unmeasured requests before each scenario')
+    parser.add_argument('--timeout', type=float, default=30, help='Request timeout in seconds')
+    parser.add_argument('--sample', type=int, default=1000, help='Number of workflow ids to request')
+    parser.add_argument('--seed', type=int, default=0, help='Random seed of the requests')
+    parser.add_argument('--scenario', type=str, action='append', help='Run only this scenario, can be repeated')
+    parser.add_argument('--writes', action='store_true',
+                        help='Include the scenarios that create workflows, requires a broker')
+    parser.add_argument('--output', type=str, default=None, help='Write the results to this json file')
+    parser.add_argument('--baseline', type=str, default=None,
+                        help='Results of a previous run (--output), exit with 1 if a scenario regressed')
+    parser.add_argument('--max_regression', type=float, default=0.2,
+                        help='Tolerated p95 increase over the baseline, as a fraction')
+
+    args = parser.parse_args()
+
+    if args.uri is None:
+        from rhythm_api.config.celeryconfig import result_backend
+        args.uri = result_backend
+    if args.token is None:
+        from rhythm_api.auth import issue_JWT
+        args.token = issue_JWT(sub='benchmark', expires_in=3600)
+
+    sys.exit(asyncio.run(main(args)))
@@ -0,0 +1,140 @@
+import argparse
+import datetime
+import random
+import time
+import uuid
+
+import celery.states
+import pymongo
+
+from rhythm_api import counters, indexes
+from rhythm_api.bulk import batched
+
+# Generates workflow_meta / celery_taskmeta documents shaped like mongo/workflow_meta.json and
+# mongo/celery_taskmeta.json: workflows of 4 to 6 steps, run up to the current step, with a task per run.
+
+STEPS = ['inspect', 'archive', 'stage', 'validate', 'setup_download', 'delete']
+
+# share of the workflows in each status
+STATUS_WEIGHTS = {
+    celery.states.SUCCESS: 70,
+    celery.states.FAILURE: 10,
+    celery.states.REVOKED: 5,
+    celery.states.STARTED: 10,
+    celery.states.PENDING: 5,
+}
+
+
+def generate(n: int, apps: int = 10, seed: int = 0, start: datetime.datetime = None):
+    """
+    yield (workflow, tasks) pairs
+
+    :param n: number of workflows
+    :param apps: number of distinct app_ids, app-0 ... app-{apps-1}
+    """
+    rnd = random.Random(seed)
+    start = start or datetime.datetime(2023, 1, 1)
+    statuses = list(STATUS_WEIGHTS.keys())
+    weights = list(STATUS_WEIGHTS.values())
+
+    for i in range(n):
+        app_id = f'app-{rnd.randrange(apps)}'
+        workflow_id = str(uuid.UUID(int=rnd.getrandbits(128), version=4))
+        status = rnd.choices(statuses, weights)[0]
+        step_names = STEPS[:rnd.randint(4, len(STEPS))]
+        created_at = start + datetime.timedelta(seconds=i * 30 + rnd.randint(0, 29))
+
+        # index of the last step that has run
+        if status == celery.states.SUCCESS:
+            current = len(step_names) - 1
+        else:
+            current = rnd.randrange(len(step_names))
+
+        steps = []
+        tasks = []
+        t = created_at
+        for j, name in enumerate(step_names):
+            step = {'name': name, 'task': f'scaworkers.workers.{name}.{name}_dataset'}
+            if j <= current:
+                step['task_runs'] = []
+                # some steps failed and were resumed
+                runs = 2 if rnd.random() < 0.05 else 1
+                for r in range(runs):
+                    last = j == current and r == runs - 1
+                    if last:
+                        task_status = status
+                    else:
+                        task_status = celery.states.FAILURE if r < runs - 1 else celery.states.SUCCESS
+                    task_id = str(uuid.UUID(int=rnd.getrandbits(128), version=4))
+                    t = t + datetime.timedelta(seconds=rnd.randint(1, 3600))
+                    step['task_runs'].append({'date_start': t, 'task_id': task_id})
+                    # the task of a PENDING workflow is queued, it has no result yet
+                    if task_status == celery.states.PENDING:
+                        continue
+                    tasks.append({
+                        '_id': task_id,
+                        'status': task_status,
+                        'result': f'[{rnd.randint(1, 1000)}]' if task_status == celery.states.SUCCESS else None,
+                        'traceback': 'Traceback ...' if task_status == celery.states.FAILURE else None,
+                        'children': [],
+                        'date_done': (t + datetime.timedelta(seconds=rnd.randint(1, 600))).strftime('%Y-%m-%dT%H:%M:%S.%f'),
+                        'name': step['task'],
+                        'args': [i],
+                        'kwargs': {'workflow_id': workflow_id, 'step': name, 'app_id': app_id},
+                        'worker': 'celery@localhost',
+                        'retries': 0,
+                        'queue': 'celery'
+                    })
+            steps.append(step)
+
+        workflow = {
+            '_id': workflow_id,
+            'created_at': created_at,
+            'steps': steps,
+            'name': f'{step_names[-1]}-{i}',
+            'app_id': app_id,
+            'description': None,
+            '_status': status,
+            'updated_at': t,
+        }
+        yield workflow, tasks
+
+
+def seed(db, n: int, apps: int = 10, batch_size: int = 5000, drop: bool = False, random_seed: int = 0) -> None:
+    wf_col = db.get_collection('workflow_meta')
+    task_col = db.get_collection('celery_taskmeta')
+    if drop:
+        wf_col.drop()
+        task_col.drop()
+
+    t0 = time.perf_counter()
+    seeded = 0
+    for batch in batched(generate(n, apps=apps, seed=random_seed), batch_size):
+        wf_col.insert_many([wf for wf, _ in batch], ordered=False)
+        tasks = [task for _, wf_tasks in batch for task in wf_tasks]
+        if tasks:
+            task_col.insert_many(tasks, ordered=False)
+        seeded += len(batch)
+        print(f'{seeded}/{n} workflows, {time.perf_counter() - t0:.0f}s')
+
+    indexes.apply(db)
+    counters.reconcile(db)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Seed workflow_meta and celery_taskmeta with generated workflows')
+    parser.add_argument('--workflows', type=int, default=10000, help='Number of workflows')
+    parser.add_argument('--apps', type=int, default=10, help='Number of distinct app ids')
+    parser.add_argument('--batch_size', type=int, default=5000, help='Workflows per insert')
+    parser.add_argument('--seed', type=int, default=0, help='Random seed, the same seed generates the same data')
+    parser.add_argument('--drop', action='store_true', help='Drop both collections first')
+    parser.add_argument('--uri', type=str, default=None,
+                        help='Mongo connection string with the database. Default is the celery result backend.')
+
+    args = parser.parse_args()
+
+    if args.uri is None:
+        from rhythm_api.config.celeryconfig import result_backend
+        args.uri = result_backend
+    db = pymongo.MongoClient(args.uri).get_default_database()
+    seed(db, args.workflows, apps=args.apps, batch_size=args.batch_size, drop=args.drop, random_seed=args.seed)
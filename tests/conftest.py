@@ -0,0 +1,23 @@
+from pathlib import Path
+
+import mongomock
+import pytest
+from bson import json_util
+
+MONGO_SEED_DIR = Path(__file__).resolve().parent.parent / 'mongo'
+
+
+def load_seed(name: str) -> list[dict]:
+    with open(MONGO_SEED_DIR / f'{name}.json') as f:
+        return json_util.loads(f.read())
+
+
+@pytest.fixture
+def db():
+    """
+    mongomock database seeded with mongo/workflow_meta.json and mongo/celery_taskmeta.json
+    """
+    _db = mongomock.MongoClient()['celery']
+    _db.get_collection('workflow_meta').insert_many(load_seed('workflow_meta'))
+    _db.get_collection('celery_taskmeta').insert_many(load_seed('celery_taskmeta'))
+    return _db
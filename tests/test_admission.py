@@ -0,0 +1,138 @@
+import datetime
+import math
+
+import mongomock
+import pytest
+
+from rhythm_api import admission, counters
+from rhythm_api.admission import AdmissionController, AdmissionRejected, TokenBucket
+
+
+class Clock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    _clock = Clock()
+    monkeypatch.setattr(admission.time, 'monotonic', _clock)
+    return _clock
+
+
+def controller(**overrides) -> AdmissionController:
+    return AdmissionController({
+        'enabled': True,
+        'rate': 10,
+        'burst': 20,
+        'max_active': None,
+        'active_retry_after': 60,
+        'counters_heartbeat_timeout': 120,
+        'limits': {},
+        **overrides
+    })
+
+
+def test_token_bucket_refills_at_rate(clock):
+    bucket = TokenBucket(rate=10, burst=20)
+    assert bucket.take(15) == 0
+    assert bucket.take(10) == pytest.approx(0.5)
+
+    clock.now += 0.5
+    assert bucket.take(10) == 0
+    # never more than burst
+    clock.now += 100
+    assert bucket.take(20) == 0
+    assert math.isinf(bucket.take(21))
+
+
+def test_rate_limit_is_per_caller(clock):
+    c = controller()
+    db = mongomock.MongoClient()['celery']
+    c.admit(db, 'alice', ['app'] * 20)
+    with pytest.raises(AdmissionRejected) as e:
+        c.admit(db, 'alice', ['app'])
+    assert e.value.retry_after == pytest.approx(0.1)
+    c.admit(db, 'bob', ['app'] * 20)
+
+    with pytest.raises(AdmissionRejected) as e:
+        c.admit(db, 'carol', ['app'] * 21)
+    assert math.isinf(e.value.retry_after)
+
+
+def test_limits_overrides(clock):
+    c = controller(limits={'batch-user': {'rate': None}, 'app-small': {'max_active': 1}})
+    db = mongomock.MongoClient()['celery']
+    c.admit(db, 'batch-user', ['app'] * 100)
+    assert c.limits('app-small')['max_active'] == 1
+    assert c.limits('app')['max_active'] is None
+
+
+def watched_db():
+    db = mongomock.MongoClient()['celery']
+    db.get_collection(counters.STATE).insert_one({'_id': counters.STATE_ID, 'heartbeat_at': datetime.datetime.utcnow()})
+    return db
+
+
+def test_active_limit(clock):
+    c = controller(max_active=5)
+    db = watched_db()
+    db.get_collection(counters.COUNTS).insert_many([
+        {'app_id': 'app', 'status': 'PENDING', 'count': 2},
+        {'app_id': 'app', 'status': 'STARTED', 'count': 2},
+        {'app_id': 'app', 'status': 'SUCCESS', 'count': 100},
+        {'app_id': 'other', 'status': 'STARTED', 'count': 5},
+    ])
+
+    c.admit(db, 'alice', ['app'])
+    with pytest.raises(AdmissionRejected) as e:
+        c.admit(db, 'alice', ['app', 'app'])
+    assert e.value.retry_after == 60
+    with pytest.raises(AdmissionRejected):
+        c.admit(db, 'alice', ['other'])
+
+    # rejected submissions did not take tokens
+    c.admit(db, 'alice', ['new-app'] * 5 + ['another-app'] * 5 + ['app-3'] * 5 + ['app-4'] * 4)
+
+
+def test_active_limit_needs_the_counters_watcher(clock, caplog):
+    c = controller(max_active=1)
+    db = watched_db()
+    db.get_collection(counters.COUNTS).insert_one({'app_id': 'app', 'status': 'STARTED', 'count': 1})
+    with pytest.raises(AdmissionRejected):
+        c.admit(db, 'alice', ['app'])
+
+    db.get_collection(counters.STATE).update_one(
+        {'_id': counters.STATE_ID},
+        {'$set': {'heartbeat_at': datetime.datetime.utcnow() - datetime.timedelta(minutes=5)}}
+    )
+    c.admit(db, 'alice', ['app'])
+    assert 'status counters watcher is not running' in caplog.text
+
+
+def test_disabled(clock):
+    c = controller(enabled=False, max_active=0)
+    c.admit(mongomock.MongoClient()['celery'], 'alice', ['app'] * 100)
+
+
+def test_rejections_are_429():
+    from fastapi import FastAPI
+    from fastapi.testclient import TestClient
+    from rhythm_api.main import admission_rejected_exception
+
+    app = FastAPI()
+    app.add_exception_handler(AdmissionRejected, admission_rejected_exception)
+
+    @app.get('/_test_admission')
+    def rejected(wait: float):
+        raise AdmissionRejected('slow down', wait)
+
+    client = TestClient(app)
+    response = client.get('/_test_admission', params={'wait': 1.2})
+    assert response.status_code == 429
+    assert response.headers['Retry-After'] == '2'
+    assert response.json() == {'message': 'slow down'}
+    assert 'Retry-After' not in client.get('/_test_admission', params={'wait': 'inf'}).headers
@@ -0,0 +1,169 @@
+import asyncio
+import contextlib
+import datetime
+import io
+
+import mongomock
+import pytest
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+from mongomock_motor import AsyncMongoMockClient
+from pymongo.errors import BulkWriteError
+
+from rhythm_api import analytics
+from rhythm_api.routers import analytics as analytics_router
+from tests.benchmark.seed import seed
+
+
+def seeded_db(n: int):
+    db = mongomock.MongoClient()['celery']
+    with contextlib.redirect_stdout(io.StringIO()):
+        seed(db, n, apps=2)
+    return db
+
+
+def test_rollups_count_every_finished_step_task_once():
+    db = seeded_db(300)
+    task_col = db.get_collection('celery_taskmeta')
+    finished = {'status': {'$in': analytics.FINISHED_STATES}, 'kwargs.step': {'$exists': True}}
+
+    since = analytics.sync(db, None)
+    # re-reading the overlap window does not count tasks twice
+    analytics.sync(db, since, overlap=10 ** 9)
+
+    rollups = list(db.get_collection(analytics.ROLLUPS).find())
+    assert sum(r['count'] for r in rollups) == task_col.count_documents(finished)
+    assert sum(r.get('duration_count', 0) for r in rollups) == \
+        task_col.count_documents({**finished, 'status': 'SUCCESS'})
+
+    # a task finished after the last sync is rolled up by the next one
+    task = task_col.find_one({'status': 'SUCCESS'})
+    task['_id'] = 'new-task'
+    task['date_done'] = (since + datetime.timedelta(minutes=5)).strftime('%Y-%m-%dT%H:%M:%S.%f')
+    task_col.insert_one(task)
+    assert analytics.sync(db, since, overlap=0) > since
+    assert sum(r['count'] for r in db.get_collection(analytics.ROLLUPS).find()) == \
+        task_col.count_documents(finished)
+
+
+def finished_tasks(n: int) -> list[dict]:
+    return [
+        {'_id': f'task-{i}', 'status': 'SUCCESS', 'date_done': f'2026-10-01T1{i % 2}:00:00.000000',
+         'kwargs': {'app_id': 'app', 'step': 'archive'}}
+        for i in range(n)
+    ]
+
+
+def rolled_up(db) -> int:
+    return sum(r['count'] for r in db.get_collection(analytics.ROLLUPS).find())
+
+
+def test_tasks_of_a_failed_rollup_write_are_rolled_up_again(monkeypatch):
+    db = mongomock.MongoClient()['celery']
+    tasks = finished_tasks(4)
+    bulk_write = mongomock.collection.Collection.bulk_write
+
+    def failing_bulk_write(self, ops, **kwargs):
+        # the first rollup is written, the second fails
+        bulk_write(self, ops[:1], **kwargs)
+        raise BulkWriteError({'writeErrors': [{'index': 1, 'code': 11000, 'errmsg': 'duplicate key'}]})
+
+    monkeypatch.setattr(mongomock.collection.Collection, 'bulk_write', failing_bulk_write)
+    with pytest.raises(BulkWriteError):
+        analytics.record_tasks(db, tasks)
+    monkeypatch.undo()
+    assert rolled_up(db) == 2
+
+    assert analytics.record_tasks(db, tasks) == 2
+    assert rolled_up(db) == 4
+    assert analytics.record_tasks(db, tasks) == 0
+    assert db.get_collection(analytics.LEDGER).count_documents({'claim': {'$ne': None}}) == 0
+
+
+def test_tasks_claimed_by_a_sync_that_died_are_claimed_again():
+    db = mongomock.MongoClient()['celery']
+    tasks = finished_tasks(2)
+    now = datetime.datetime.utcnow()
+    db.get_collection(analytics.LEDGER).insert_many([
+        {'_id': 'task-0', 'recorded_at': now - datetime.timedelta(hours=1), 'claim': 'dead-sync'},
+        # still being rolled up
+        {'_id': 'task-1', 'recorded_at': now - datetime.timedelta(minutes=1), 'claim': 'running-sync'},
+    ])
+    assert analytics.record_tasks(db, tasks) == 1
+    assert analytics.record_tasks(db, tasks, claim_timeout=30) == 1
+    assert rolled_up(db) == 2
+
+
+def test_other_ledger_errors_are_not_counted_as_rolled_up(monkeypatch):
+    db = mongomock.MongoClient()['celery']
+
+    def insert_many(self, docs, **kwargs):
+        raise BulkWriteError({'writeErrors': [{'index': 0, 'code': 121, 'errmsg': 'validation failed'}]})
+
+    monkeypatch.setattr(mongomock.collection.Collection, 'insert_many', insert_many)
+    with pytest.raises(BulkWriteError):
+        analytics.record_tasks(db, finished_tasks(2))
+
+
+def test_summarize():
+    bucket = datetime.datetime(2024, 1, 1, 10)
+    rollups = [
+        {'step': 'archive', 'bucket': bucket, 'count': 4, 'status': {'SUCCESS': 3, 'FAILURE': 1},
+         'duration_count': 3, 'duration_sum': 150, 'duration_min': 40, 'duration_max': 60,
+         # 40, 50 and 60 seconds are in the same bin
+         'histogram': {str(analytics.bin_index(40)): 3}},
+        {'step': 'archive', 'bucket': bucket.replace(hour=11), 'count': 1, 'status': {'SUCCESS': 1},
+         'duration_count': 1, 'duration_sum': 500, 'duration_min': 500, 'duration_max': 500,
+         'histogram': {str(analytics.bin_index(500)): 1}},
+    ]
+    summary = analytics.summarize(rollups, bucket='day')
+    step = summary['steps'][0]
+    assert step['count'] == 5
+    assert step['success_rate'] == 0.8
+    assert step['failure_rate'] == 0.2
+    assert step['duration']['mean'] == 162.5
+    assert (step['duration']['min'], step['duration']['max']) == (40, 500)
+    assert 30 <= step['duration']['p50'] <= 60
+    assert 300 <= step['duration']['p99'] <= 600
+    assert summary['series'] == [{'bucket': datetime.datetime(2024, 1, 1), 'step': 'archive',
+                                  'completed': 5, 'SUCCESS': 4, 'FAILURE': 1}]
+
+
+@pytest.fixture
+def rollups_db(monkeypatch):
+    db = AsyncMongoMockClient()['celery']
+    monkeypatch.setattr(analytics_router, 'async_collection', lambda name, reads=None: db.get_collection(name))
+    return db
+
+
+@pytest.fixture
+def client(rollups_db):
+    app = FastAPI()
+    app.include_router(analytics_router.router)
+    return TestClient(app)
+
+
+def test_step_analytics_accepts_timezone_aware_dates(client):
+    response = client.get('/analytics/steps', params={'start': '2026-10-01T02:00:00+02:00'})
+    assert response.status_code == 200
+    assert analytics.parse_date(response.json()['start']) == datetime.datetime(2026, 10, 1)
+
+    end = datetime.datetime.utcnow() - datetime.timedelta(days=1)
+    response = client.get('/analytics/steps', params={'end': end.isoformat() + 'Z'})
+    assert response.status_code == 200
+    assert analytics.parse_date(response.json()['end']) == end
+    assert analytics.naive_utc(end) is end
+
+
+def test_step_analytics_of_every_app(client, rollups_db):
+    bucket = datetime.datetime(2026, 10, 1, 10)
+    asyncio.run(rollups_db.get_collection(analytics.ROLLUPS).insert_many([
+        {'app_id': 'app-1', 'step': 'archive', 'bucket': bucket, 'count': 2, 'status': {'SUCCESS': 2}},
+        {'app_id': 'app-2', 'step': 'archive', 'bucket': bucket, 'count': 3, 'status': {'SUCCESS': 3}},
+    ]))
+    params = {'start': '2026-10-01T00:00:00', 'end': '2026-10-02T00:00:00'}
+
+    steps = client.get('/analytics/steps', params=params).json()['steps']
+    assert [(s['step'], s['count']) for s in steps] == [('archive', 5)]
+    steps = client.get('/analytics/steps', params={**params, 'app_id': 'app-2'}).json()['steps']
+    assert [(s['step'], s['count']) for s in steps] == [('archive', 3)]
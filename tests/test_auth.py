@@ -0,0 +1,47 @@
+import time
+
+import pytest
+
+from rhythm_api.auth import TokenCache, issue_JWT, validate_JWT_cached, token_cache
+
+
+def test_token_cache_counts_hits_and_misses():
+    cache = TokenCache(max_size=2, ttl=60)
+    assert cache.get('a') is None
+    cache.put('a', {'sub': 'a'})
+    assert cache.get('a') == {'sub': 'a'}
+    assert cache.stats() == {'size': 1, 'hits': 1, 'misses': 1}
+
+
+def test_token_cache_is_bounded():
+    cache = TokenCache(max_size=2, ttl=60)
+    cache.put('a', {'sub': 'a'})
+    cache.put('b', {'sub': 'b'})
+    cache.get('a')
+    cache.put('c', {'sub': 'c'})
+    # b is the least recently used
+    assert cache.get('b') is None
+    assert cache.get('a') is not None
+    assert cache.get('c') is not None
+
+
+def test_token_cache_honors_exp(monkeypatch):
+    cache = TokenCache(max_size=2, ttl=60)
+    now = time.time()
+    cache.put('a', {'sub': 'a', 'exp': now + 5})
+    monkeypatch.setattr(time, 'time', lambda: now + 10)
+    assert cache.get('a') is None
+
+
+def test_validate_JWT_cached():
+    token = issue_JWT(sub='test_app', expires_in=60)
+    misses = token_cache.stats()['misses']
+    hits = token_cache.stats()['hits']
+
+    assert validate_JWT_cached(token)['sub'] == 'test_app'
+    assert validate_JWT_cached(token)['sub'] == 'test_app'
+    assert token_cache.stats()['misses'] == misses + 1
+    assert token_cache.stats()['hits'] == hits + 1
+
+    with pytest.raises(Exception):
+        validate_JWT_cached(token[:-2])
@@ -0,0 +1,46 @@
+import asyncio
+
+import httpx
+import mongomock
+
+from rhythm_api.hydration import fetch_embellished_workflows
+from tests.benchmark.run import Scenario, run_scenario, regressions
+from tests.benchmark.seed import seed
+
+
+def test_seeded_workflows_match_their_tasks():
+    db = mongomock.MongoClient()['celery']
+    seed(db, 500, apps=3, batch_size=200)
+    assert db.get_collection('workflow_meta').count_documents({}) == 500
+    assert sum(c['count'] for c in db.get_collection('workflow_status_counts').find()) == 500
+
+    workflows = {wf['_id']: wf for wf in db.get_collection('workflow_meta').find()}
+    embellished = fetch_embellished_workflows(db.get_collection('workflow_meta'),
+                                              db.get_collection('celery_taskmeta'),
+                                              list(workflows.keys()))
+    for wf in embellished:
+        status = workflows[wf['id']]['_status']
+        # a pending workflow that has finished steps is reported as started
+        assert wf['status'] == status or (status, wf['status']) == ('PENDING', 'STARTED')
+
+
+def test_run_scenario():
+    def handler(request: httpx.Request) -> httpx.Response:
+        return httpx.Response(500 if request.url.params.get('fail') else 200, json={})
+
+    scenario = Scenario('test', 'GET', lambda rnd: ('/workflows?fail=1' if rnd.random() < 0.1 else '/workflows', None))
+
+    async def run():
+        async with httpx.AsyncClient(base_url='http://api', transport=httpx.MockTransport(handler)) as client:
+            return await run_scenario(client, scenario, concurrency=4, requests=200, warmup=10, seed=0)
+
+    summary = asyncio.run(run()).summary()
+    assert summary['requests'] == 200
+    assert 0 < summary['errors'] < 50
+    assert summary['p50_ms'] <= summary['p95_ms'] <= summary['p99_ms']
+
+
+def test_regressions():
+    baseline = [{'scenario': 'get', 'p95_ms': 10}, {'scenario': 'list', 'p95_ms': 10}]
+    summaries = [{'scenario': 'get', 'p95_ms': 11}, {'scenario': 'list', 'p95_ms': 13}, {'scenario': 'new', 'p95_ms': 1}]
+    assert [m.split(':')[0] for m in regressions(summaries, baseline, 0.2)] == ['list']
@@ -0,0 +1,53 @@
+import pytest
+
+from rhythm_api import counters
+from rhythm_api.bulk import apply_concurrently, delete_workflows, find_workflow_ids
+
+
+def test_find_workflow_ids_requires_a_narrow_filter(db):
+    wf_col = db.get_collection('workflow_meta')
+    with pytest.raises(AssertionError):
+        find_workflow_ids(wf_col, {}, limit=100)
+    wf_ids = [wf['_id'] for wf in wf_col.find({}, {'_id': 1})]
+    with pytest.raises(AssertionError):
+        find_workflow_ids(wf_col, {'_id': {'$in': wf_ids}}, limit=len(wf_ids) - 1)
+    assert sorted(find_workflow_ids(wf_col, {'_id': {'$in': wf_ids}}, limit=len(wf_ids))) == sorted(wf_ids)
+
+
+def test_apply_concurrently_reports_failures():
+    def fn(workflow_id):
+        if workflow_id == 'bad':
+            raise ValueError('boom')
+        return {'paused': True}
+
+    summary = apply_concurrently(fn, ['a', 'bad', 'b'], max_workers=2)
+    assert summary['matched'] == 3
+    assert summary['results'] == {'a': {'paused': True}, 'b': {'paused': True}}
+    assert summary['failed'] == [{'workflow_id': 'bad', 'error': 'boom'}]
+
+
+def test_delete_workflows_removes_task_results(db):
+    wf_col = db.get_collection('workflow_meta')
+    task_col = db.get_collection('celery_taskmeta')
+    wf_col.update_many({}, {'$set': {'app_id': 'app', '_status': 'SUCCESS'}})
+    counters.reconcile(db)
+
+    wf_ids = [wf['_id'] for wf in wf_col.find({}, {'_id': 1})][:3]
+    task_ids = [
+        run['task_id']
+        for wf in wf_col.find({'_id': {'$in': wf_ids}})
+        for step in wf['steps']
+        for run in step.get('task_runs', [])
+    ]
+    total = wf_col.count_documents({})
+    task_count = task_col.count_documents({'_id': {'$in': task_ids}})
+    assert task_count > 0
+
+    summary = delete_workflows(db, wf_ids, batch_size=2)
+
+    assert summary['deleted_count'] == 3
+    assert summary['deleted_task_count'] == task_count
+    assert wf_col.count_documents({'_id': {'$in': wf_ids}}) == 0
+    assert task_col.count_documents({'_id': {'$in': task_ids}}) == 0
+    count = db.get_collection(counters.COUNTS).find_one({'app_id': 'app', 'status': 'SUCCESS'})
+    assert count['count'] == total - 3
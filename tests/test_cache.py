@@ -0,0 +1,117 @@
+import asyncio
+import time
+
+from starlette.requests import Request
+
+from rhythm_api.cache import MemoryBackend, ResponseCache, create_cache
+from rhythm_api.config import config
+
+
+def request(if_none_match: str = None) -> Request:
+    headers = [(b'if-none-match', if_none_match.encode())] if if_none_match else []
+    return Request({'type': 'http', 'headers': headers})
+
+
+def test_memory_backend_is_bounded_and_expires(monkeypatch):
+    backend = MemoryBackend(max_size=2)
+    backend.set('a', b'a')
+    backend.set('b', b'b', ttl=5)
+    backend.get('a')
+    backend.set('c', b'c')
+    # b is the least recently used
+    assert backend.get('b') is None
+    assert backend.get('a') == b'a'
+
+    now = time.monotonic()
+    backend.set('d', b'd', ttl=5)
+    monkeypatch.setattr(time, 'monotonic', lambda: now + 10)
+    assert backend.get('d') is None
+    assert backend.get('a') == b'a'
+
+
+def test_response_is_cached_until_invalidated():
+    cache = ResponseCache(MemoryBackend(max_size=100), active_ttl=60, list_ttl=60)
+    calls = []
+
+    async def compute():
+        calls.append(1)
+        return {'id': 'wf1', 'status': 'SUCCESS', 'n': len(calls)}
+
+    async def get(if_none_match=None):
+        key = cache.workflow_key('wf1', last_task_run=True)
+        return await cache.response(request(if_none_match), key, compute, ttl=cache.workflow_ttl)
+
+    async def run():
+        first = await get()
+        assert first.status_code == 200
+        tag = first.headers['etag']
+
+        # served from the cache, 304 when the client has it
+        assert (await get()).body == first.body
+        not_modified = await get(if_none_match=tag)
+        assert not_modified.status_code == 304
+        assert not_modified.body == b''
+        assert len(calls) == 1
+
+        cache.invalidate(['wf1'])
+        changed = await get(if_none_match=tag)
+        assert changed.status_code == 200
+        assert changed.headers['etag'] != tag
+        assert len(calls) == 2
+
+    asyncio.run(run())
+
+
+def test_response_computed_before_invalidation_is_not_served():
+    cache = ResponseCache(MemoryBackend(max_size=100), active_ttl=60, list_ttl=60)
+    key = cache.workflow_key('wf1')
+    # the workflow is resumed while its response is being computed
+    cache.invalidate(['wf1'])
+    cache.put(key, b'{"status":"FAILURE"}')
+    assert cache.get(cache.workflow_key('wf1')) is None
+
+
+def test_invalidate_drops_lists():
+    cache = ResponseCache(MemoryBackend(max_size=100), active_ttl=60, list_ttl=60)
+    cache.put(cache.list_key(app_id='a'), b'[]', ttl=60)
+    assert cache.get(cache.list_key(app_id='a')) is not None
+    cache.invalidate(['wf1'])
+    assert cache.get(cache.list_key(app_id='a')) is None
+
+
+def test_active_workflows_expire():
+    cache = ResponseCache(MemoryBackend(max_size=100), active_ttl=5, list_ttl=5)
+    assert cache.workflow_ttl({'status': 'STARTED'}) == 5
+    assert cache.workflow_ttl({'status': 'REVOKED'}) is None
+
+
+def test_memory_backend_bounds_terminal_workflows(monkeypatch):
+    # other processes cannot invalidate its entries
+    monkeypatch.setitem(config['cache'], 'backend', 'memory')
+    monkeypatch.setitem(config['cache'], 'memory_terminal_ttl', 30)
+    cache = create_cache()
+    assert cache.workflow_ttl({'status': 'FAILURE'}) == 30
+    assert cache.workflow_ttl({'status': 'STARTED'}) == config['cache']['active_ttl']
+
+
+def test_failed_group_with_running_steps_is_not_settled():
+    cache = ResponseCache(MemoryBackend(max_size=100), active_ttl=5, list_ttl=5)
+    workflow = {
+        'status': 'FAILURE',
+        'steps': [
+            {'name': 'stage', 'status': 'SUCCESS'},
+            {'name': 'validate_a', 'group': 'validate', 'status': 'FAILURE'},
+            {'name': 'validate_b', 'group': 'validate', 'status': 'STARTED'},
+            {'name': 'archive', 'status': 'PENDING'},
+        ]
+    }
+    assert cache.workflow_ttl(workflow) == 5
+
+    workflow['steps'][2]['status'] = 'SUCCESS'
+    assert cache.workflow_ttl(workflow) is None
+    # without the groups of the steps, the response cannot tell
+    assert cache.workflow_ttl(workflow, {'status': True, 'steps': {'status': True}}) == 5
+    assert cache.workflow_ttl(workflow, {'status': True, 'steps': True}) is None
+    # a linear workflow that failed
+    assert cache.workflow_ttl({'status': 'FAILURE', 'steps': [{'name': 'a', 'status': 'FAILURE'},
+                                                              {'name': 'b', 'status': 'PENDING'}]}) is None
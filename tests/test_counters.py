@@ -0,0 +1,87 @@
+import datetime
+
+import pytest
+
+from rhythm_api import counters
+
+
+def counts(db, app_id=None):
+    return {
+        doc['status']: doc['count']
+        for doc in db.get_collection(counters.COUNTS).find({'app_id': app_id})
+        if doc['count'] != 0
+    }
+
+
+def test_record_status_moves_between_counters(db):
+    counters.record_status(db, 'wf-1', 'app', 'PENDING')
+    counters.record_status(db, 'wf-2', 'app', 'PENDING')
+    assert counts(db, 'app') == {'PENDING': 2}
+
+    counters.record_status(db, 'wf-1', 'app', 'STARTED')
+    # the same transition recorded twice is counted once
+    counters.record_status(db, 'wf-1', 'app', 'STARTED')
+    assert counts(db, 'app') == {'PENDING': 1, 'STARTED': 1}
+
+    counters.record_deletes(db, ['wf-1', 'wf-2', 'unknown'])
+    assert counts(db, 'app') == {}
+
+
+def test_reconcile_matches_workflow_meta(db):
+    wf_col = db.get_collection('workflow_meta')
+    for i, wf in enumerate(wf_col.find({}, {'_id': 1})):
+        wf_col.update_one({'_id': wf['_id']}, {'$set': {'app_id': f'app-{i % 2}', '_status': 'SUCCESS'}})
+    wf_col.update_one({}, {'$set': {'_status': 'FAILURE'}})
+    # drift that reconcile should repair
+    counters.record_status(db, 'deleted-workflow', 'app-0', 'STARTED')
+
+    counters.reconcile(db)
+
+    for app_id in ['app-0', 'app-1']:
+        expected = {}
+        for wf in wf_col.find({'app_id': app_id}):
+            expected[wf['_status']] = expected.get(wf['_status'], 0) + 1
+        assert counts(db, app_id) == expected
+
+    # counting continues from the rebuilt ledger
+    wf = wf_col.find_one({'app_id': 'app-1', '_status': 'SUCCESS'})
+    before = counts(db, 'app-1')
+    counters.record_status(db, wf['_id'], 'app-1', 'REVOKED')
+    after = counts(db, 'app-1')
+    assert after['REVOKED'] == before.get('REVOKED', 0) + 1
+    assert after.get('SUCCESS', 0) == before['SUCCESS'] - 1
+
+
+def test_reconcile_repairs_statuses_set_without_the_watcher(db):
+    wf_col = db.get_collection('workflow_meta')
+    wf_col.update_many({}, {'$set': {'app_id': 'app', '_status': 'PENDING'}})
+    counters.reconcile(db)
+    total = wf_col.count_documents({})
+    assert counts(db, 'app') == {'PENDING': total}
+
+    # the workers finish the workflows while the watcher is not running
+    wf_col.update_many({}, {'$set': {'_status': 'SUCCESS'}})
+    assert counts(db, 'app') == {'PENDING': total}
+    counters.reconcile(db)
+    assert counts(db, 'app') == {'SUCCESS': total}
+
+
+def test_watcher_heartbeat(db, monkeypatch):
+    assert not counters.watcher_alive(db, timeout=60)
+
+    class Stop(Exception):
+        pass
+
+    def sleep(seconds):
+        raise Stop()
+
+    monkeypatch.setattr(counters.time, 'sleep', sleep)
+    with pytest.raises(Stop):
+        counters.watch_polling(db, since=datetime.datetime.utcnow())
+    assert counters.watcher_alive(db, timeout=60)
+
+    db.get_collection(counters.STATE).update_one(
+        {'_id': counters.STATE_ID},
+        {'$set': {'heartbeat_at': datetime.datetime.utcnow() - datetime.timedelta(minutes=5)}}
+    )
+    assert not counters.watcher_alive(db, timeout=60)
@@ -0,0 +1,43 @@
+import datetime
+import json
+
+from bson import ObjectId
+from fastapi.encoders import jsonable_encoder
+
+from rhythm_api import encoding
+from rhythm_api.hydration import fetch_embellished_workflows
+from rhythm_api.main import app  # noqa: F401 - sets the datetime format of jsonable_encoder
+
+
+def reference(content) -> bytes:
+    # what fastapi's JSONResponse produced for handlers that return dicts
+    return json.dumps(jsonable_encoder(content), ensure_ascii=False, allow_nan=False,
+                      indent=None, separators=(',', ':')).encode('utf-8')
+
+
+def test_same_output_as_jsonable_encoder(db):
+    wf_col = db.get_collection('workflow_meta')
+    ids = [wf['_id'] for wf in wf_col.find({}, {'_id': 1})]
+    workflows = fetch_embellished_workflows(wf_col, db.get_collection('celery_taskmeta'), ids, prev_task_runs=True)
+    content = {'metadata': {'total': len(workflows)}, 'results': workflows}
+    assert encoding.dumps(content) == reference(content)
+
+
+def test_types():
+    content = {
+        'oid': ObjectId('65a0f0c2b3c4d5e6f7a8b9c0'),
+        'at': datetime.datetime(2023, 2, 2, 21, 16, 37),
+        'day': datetime.date(2023, 2, 2),
+        'tags': {'a'},
+        'text': 'naïve',
+    }
+    assert json.loads(encoding.dumps(content)) == {
+        'oid': '65a0f0c2b3c4d5e6f7a8b9c0',
+        'at': '2023-02-02T21:16:37.000000Z',
+        'day': '2023-02-02',
+        'tags': ['a'],
+        'text': 'naïve',
+    }
+    # jsonable_encoder does not know ObjectId
+    del content['oid']
+    assert encoding.dumps(content) == reference(content)
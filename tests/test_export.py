@@ -0,0 +1,42 @@
+import asyncio
+import gzip
+import json
+
+from mongomock_motor import AsyncMongoMockClient
+
+from rhythm_api import encoding
+from rhythm_api.export import export_workflows, gzip_chunks
+from rhythm_api.hydration import fetch_embellished_workflows
+from rhythm_api.listing import wf_query
+
+
+def test_export_matches_hydration(db):
+    wf_col = db.get_collection('workflow_meta')
+    task_col = db.get_collection('celery_taskmeta')
+    wf_ids = [wf['_id'] for wf in wf_col.find({}, {'_id': 1}).sort([('created_at', 1), ('_id', 1)])]
+    expected = fetch_embellished_workflows(wf_col, task_col, wf_ids, prev_task_runs=True)
+
+    async_db = AsyncMongoMockClient()['celery']
+
+    async def run(compress: bool) -> bytes:
+        await async_db['workflow_meta'].delete_many({})
+        await async_db['celery_taskmeta'].delete_many({})
+        await async_db['workflow_meta'].insert_many(list(wf_col.find()))
+        await async_db['celery_taskmeta'].insert_many(list(task_col.find()))
+        chunks = export_workflows(async_db['workflow_meta'], async_db['celery_taskmeta'], query={},
+                                  batch_size=2, prev_task_runs=True)
+        if compress:
+            chunks = gzip_chunks(chunks)
+        return b''.join([chunk async for chunk in chunks])
+
+    lines = asyncio.run(run(compress=False)).splitlines()
+    assert [json.loads(line)['id'] for line in lines] == wf_ids
+    assert lines == [encoding.dumps(wf) for wf in expected]
+
+    assert gzip.decompress(asyncio.run(run(compress=True))).splitlines() == lines
+
+
+def test_date_range_query():
+    query = wf_query(app_id='a', created_after='2024-01-01', created_before='2024-02-01')
+    assert query == {'app_id': 'a', 'created_at': {'$gte': '2024-01-01', '$lt': '2024-02-01'}}
+    assert 'created_at' not in wf_query(app_id='a')
@@ -0,0 +1,198 @@
+import copy
+from types import SimpleNamespace
+
+import mongomock
+import pytest
+
+from rhythm_api import groups
+from rhythm_api.config import config
+from rhythm_api.hydration import embellish, workflow_status
+from rhythm_api.submission import new_workflow, start_workflow
+
+STEPS = [
+    {'name': 'stage', 'task': 'tasks.stage', 'queue': 'q1'},
+    {'name': 'validate_a', 'task': 'tasks.validate_a', 'queue': 'q2', 'group': 'validate'},
+    {'name': 'validate_b', 'task': 'tasks.validate_b', 'queue': 'q3', 'group': 'validate'},
+    {'name': 'archive', 'task': 'tasks.archive', 'queue': 'q1'},
+]
+
+
+class FakeBackend:
+    def __init__(self, db):
+        self.database = db
+        self.collection = db.get_collection('celery_taskmeta')
+
+    def get_status(self, task_id):
+        task = self.collection.find_one({'_id': task_id})
+        return task['status'] if task is not None else 'PENDING'
+
+
+class FakeCeleryApp:
+    def __init__(self, db):
+        self.backend = FakeBackend(db)
+        self.sent = []
+        self.revoked = []
+        self.control = SimpleNamespace(revoke=lambda task_id, terminate: self.revoked.append(task_id))
+
+    def send_task(self, **kwargs):
+        self.sent.append(kwargs)
+
+
+@pytest.fixture(autouse=True)
+def groups_enabled(monkeypatch):
+    monkeypatch.setitem(config['workflows'], 'groups_enabled', True)
+
+
+@pytest.fixture
+def celery_app():
+    return FakeCeleryApp(mongomock.MongoClient()['celery'])
+
+
+def run_step(celery_app, workflow_id: str, step: str, task_id: str, status: str = 'SUCCESS'):
+    # what WorkflowTask does in a worker
+    wf = groups.Workflow(celery_app, workflow_id)
+    wf.on_step_start(step, task_id)
+    celery_app.backend.collection.insert_one({'_id': task_id, 'status': status, 'args': ['ds-1']})
+    if status == 'SUCCESS':
+        wf.on_step_success(('ds-1',), step)
+    else:
+        wf.on_step_failure()
+
+
+def sent_steps(celery_app) -> list[str]:
+    return [msg['kwargs']['step'] for msg in celery_app.sent]
+
+
+def test_stages():
+    assert groups.stages(STEPS) == [[0], [1, 2], [3]]
+    assert groups.stages([{'group': 'a'}, {'group': 'b'}, {}, {}]) == [[0], [1], [2], [3]]
+
+    steps = copy.deepcopy(STEPS)
+    steps[2]['group'] = 'other'
+    steps[3]['group'] = 'validate'
+    with pytest.raises(AssertionError, match='steps of group validate are not consecutive'):
+        new_workflow(steps, 'wf', 'app')
+
+
+def test_groups_are_rejected_unless_enabled(monkeypatch):
+    monkeypatch.setitem(config['workflows'], 'groups_enabled', False)
+    with pytest.raises(AssertionError, match=r'step\[1\] has a group, groups are not enabled'):
+        new_workflow(copy.deepcopy(STEPS), 'wf', 'app')
+    new_workflow([step for step in copy.deepcopy(STEPS) if 'group' not in step], 'wf', 'app')
+
+
+def test_workflow_status():
+    stages = groups.stages(STEPS)
+    assert workflow_status(['PENDING'] * 4, stages) == ('PENDING', 0)
+    assert workflow_status(['SUCCESS', 'SUCCESS', 'STARTED', 'PENDING'], stages) == ('STARTED', 2)
+    # the other step of the group keeps running
+    assert workflow_status(['SUCCESS', 'FAILURE', 'STARTED', 'PENDING'], stages) == ('FAILURE', 1)
+    assert workflow_status(['SUCCESS'] * 4, stages) == ('SUCCESS', None)
+    # without groups
+    assert workflow_status(['SUCCESS', 'REVOKED', 'PENDING']) == ('REVOKED', 1)
+
+
+def test_group_runs_in_parallel_and_joins(celery_app):
+    db = celery_app.backend.database
+    workflow = new_workflow(copy.deepcopy(STEPS), 'wf', 'app')
+    db.get_collection('workflow_meta').insert_one(workflow)
+    wf_id = workflow['_id']
+
+    start_workflow(celery_app, workflow, ['ds-1'])
+    run_step(celery_app, wf_id, 'stage', 't-stage')
+    assert sent_steps(celery_app) == ['stage', 'validate_a', 'validate_b']
+    assert all(msg['args'] == ('ds-1',) for msg in celery_app.sent[1:])
+
+    run_step(celery_app, wf_id, 'validate_b', 't-b')
+    assert sent_steps(celery_app)[3:] == []
+    run_step(celery_app, wf_id, 'validate_a', 't-a')
+    assert sent_steps(celery_app)[3:] == ['archive']
+    # a success that was already joined does not start the next step again
+    groups.Workflow(celery_app, wf_id).on_step_success(('ds-1',), 'validate_a')
+    assert sent_steps(celery_app)[3:] == ['archive']
+
+    run_step(celery_app, wf_id, 'archive', 't-archive')
+    doc = db.get_collection('workflow_meta').find_one({'_id': wf_id})
+    assert doc['_status'] == 'SUCCESS'
+    assert [len(step['task_runs']) for step in doc['steps']] == [1, 1, 1, 1]
+
+    tasks = {t['_id']: t for t in celery_app.backend.collection.find()}
+    embellished = embellish(doc, tasks)
+    assert embellished['status'] == 'SUCCESS'
+    assert [step.get('group', None) for step in embellished['steps']] == [None, 'validate', 'validate', None]
+
+
+def test_pause_and_resume_group(celery_app):
+    db = celery_app.backend.database
+    workflow = new_workflow(copy.deepcopy(STEPS), 'wf', 'app')
+    db.get_collection('workflow_meta').insert_one(workflow)
+    wf_id = workflow['_id']
+
+    run_step(celery_app, wf_id, 'stage', 't-stage')
+    run_step(celery_app, wf_id, 'validate_a', 't-a', status='FAILURE')
+    groups.Workflow(celery_app, wf_id).on_step_start('validate_b', 't-b')
+    celery_app.backend.collection.insert_one({'_id': 't-b', 'status': 'STARTED', 'args': ['ds-1']})
+
+    paused = groups.Workflow(celery_app, wf_id).pause()
+    assert paused['paused']
+    assert celery_app.revoked == ['t-b']
+    celery_app.backend.collection.update_one({'_id': 't-b'}, {'$set': {'status': 'REVOKED'}})
+
+    resumed = groups.Workflow(celery_app, wf_id).resume()
+    assert [step['name'] for step in resumed['restarted_steps']] == ['validate_a', 'validate_b']
+    assert sent_steps(celery_app)[-2:] == ['validate_a', 'validate_b']
+    assert not groups.Workflow(celery_app, wf_id).resume()['resumed']
+
+
+def stored_status(celery_app, workflow_id: str) -> str:
+    return celery_app.backend.database.get_collection('workflow_meta').find_one({'_id': workflow_id})['_status']
+
+
+def embellished_status(celery_app, workflow_id: str) -> str:
+    doc = celery_app.backend.database.get_collection('workflow_meta').find_one({'_id': workflow_id})
+    return embellish(doc, {t['_id']: t for t in celery_app.backend.collection.find()})['status']
+
+
+def test_failed_step_keeps_its_group_failed(celery_app):
+    db = celery_app.backend.database
+    workflow = new_workflow(copy.deepcopy(STEPS), 'wf', 'app')
+    db.get_collection('workflow_meta').insert_one(workflow)
+    wf_id = workflow['_id']
+
+    run_step(celery_app, wf_id, 'stage', 't-stage')
+    run_step(celery_app, wf_id, 'validate_a', 't-a', status='FAILURE')
+    # the other step of the group starts and succeeds after the failure
+    run_step(celery_app, wf_id, 'validate_b', 't-b')
+    assert stored_status(celery_app, wf_id) == embellished_status(celery_app, wf_id) == 'FAILURE'
+
+    assert groups.Workflow(celery_app, wf_id).resume()['resumed']
+    groups.Workflow(celery_app, wf_id).on_step_start('validate_a', 't-a2')
+    assert stored_status(celery_app, wf_id) == 'STARTED'
+    celery_app.backend.collection.insert_one({'_id': 't-a2', 'status': 'SUCCESS'})
+    groups.Workflow(celery_app, wf_id).on_step_success(('ds-1',), 'validate_a')
+    assert sent_steps(celery_app)[-1] == 'archive'
+
+
+def test_start_does_not_overwrite_a_concurrent_failure(celery_app, monkeypatch):
+    db = celery_app.backend.database
+    workflow = new_workflow(copy.deepcopy(STEPS), 'wf', 'app')
+    db.get_collection('workflow_meta').insert_one(workflow)
+    wf_id = workflow['_id']
+    run_step(celery_app, wf_id, 'stage', 't-stage')
+
+    wf = groups.Workflow(celery_app, wf_id)
+    get_workflow_status = wf.get_workflow_status
+    raced = []
+
+    def racing_status(**kwargs):
+        status = get_workflow_status(**kwargs)
+        if not raced:
+            # validate_a fails after validate_b read the statuses, before it writes its own
+            raced.append(status)
+            run_step(celery_app, wf_id, 'validate_a', 't-a', status='FAILURE')
+        return status
+
+    monkeypatch.setattr(wf, 'get_workflow_status', racing_status)
+    wf.on_step_start('validate_b', 't-b')
+    assert raced == ['STARTED']
+    assert stored_status(celery_app, wf_id) == 'FAILURE'
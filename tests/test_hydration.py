@@ -0,0 +1,70 @@
+import asyncio
+
+import celery.states
+from mongomock_motor import AsyncMongoMockClient
+from sca_rhythm import Workflow
+
+from rhythm_api.hydration import fetch_embellished_workflows, async_fetch_embellished_workflows
+
+
+class FakeBackend:
+    def __init__(self, db):
+        self.database = db
+        self.collection = db.get_collection('celery_taskmeta')
+
+    def get_status(self, task_id):
+        task = self.collection.find_one({'_id': task_id})
+        return task['status'] if task is not None else celery.states.PENDING
+
+
+class FakeCeleryApp:
+    def __init__(self, db):
+        self.backend = FakeBackend(db)
+
+
+def test_batched_hydration_matches_workflow(db):
+    celery_app = FakeCeleryApp(db)
+    wf_col = db.get_collection('workflow_meta')
+    task_col = db.get_collection('celery_taskmeta')
+    wf_ids = [wf['_id'] for wf in wf_col.find({}, {'_id': 1})]
+
+    for last_task_run, prev_task_runs in [(True, False), (True, True), (False, False)]:
+        expected = [
+            Workflow(celery_app=celery_app, workflow_id=wf_id).get_embellished_workflow(
+                last_task_run=last_task_run,
+                prev_task_runs=prev_task_runs,
+                refresh=False
+            )
+            for wf_id in wf_ids
+        ]
+        actual = fetch_embellished_workflows(wf_col, task_col, wf_ids,
+                                             last_task_run=last_task_run,
+                                             prev_task_runs=prev_task_runs)
+        assert actual == expected
+
+
+def test_batched_hydration_skips_missing_and_keeps_order(db):
+    wf_col = db.get_collection('workflow_meta')
+    task_col = db.get_collection('celery_taskmeta')
+    wf_ids = [wf['_id'] for wf in wf_col.find({}, {'_id': 1})][::-1]
+
+    results = fetch_embellished_workflows(wf_col, task_col, wf_ids[:2] + ['missing'] + wf_ids[2:])
+    assert [r['id'] for r in results] == wf_ids
+    assert fetch_embellished_workflows(wf_col, task_col, []) == []
+
+
+def test_async_hydration_matches_sync(db):
+    wf_col = db.get_collection('workflow_meta')
+    task_col = db.get_collection('celery_taskmeta')
+    wf_ids = [wf['_id'] for wf in wf_col.find({}, {'_id': 1})]
+
+    client = AsyncMongoMockClient()
+    async_db = client['celery']
+
+    async def run():
+        await async_db['workflow_meta'].insert_many(list(wf_col.find()))
+        await async_db['celery_taskmeta'].insert_many(list(task_col.find()))
+        return await async_fetch_embellished_workflows(async_db['workflow_meta'], async_db['celery_taskmeta'],
+                                                       wf_ids, prev_task_runs=True)
+
+    assert asyncio.run(run()) == fetch_embellished_workflows(wf_col, task_col, wf_ids, prev_task_runs=True)
@@ -0,0 +1,170 @@
+import datetime
+import random
+import uuid
+
+import pymongo
+import pytest
+from pymongo.errors import PyMongoError
+
+from rhythm_api import counters, indexes, search, sparse, steps
+from rhythm_api.listing import SortBy, page_pipeline, wf_query, Status
+
+# explain() needs a real mongod, the tests are skipped when the result backend is not reachable
+
+APP_IDS = ['app-a', 'app-b', 'app-c']
+STATUSES = ['PENDING', 'STARTED', 'SUCCESS', 'FAILURE', 'REVOKED']
+
+
+@pytest.fixture(scope='module')
+def mongo_db():
+    from rhythm_api.config.celeryconfig import result_backend
+    client = pymongo.MongoClient(result_backend, serverSelectionTimeoutMS=1000)
+    try:
+        client.admin.command('ping')
+    except PyMongoError:
+        pytest.skip('mongo is not reachable')
+
+    db = client['rhythm_api_test_indexes']
+    client.drop_database(db.name)
+    start = datetime.datetime(2024, 1, 1)
+    workflows = []
+    for i in range(2000):
+        created_at = start + datetime.timedelta(minutes=i)
+        workflows.append({
+            '_id': str(uuid.uuid4()),
+            'name': f'wf-{random.randint(0, 100)}',
+            'app_id': random.choice(APP_IDS),
+            '_status': random.choice(STATUSES),
+            'created_at': created_at,
+            'updated_at': created_at + datetime.timedelta(seconds=random.randint(0, 3600)),
+            'steps': [{'name': 'inspect', 'task': 'inspect', 'task_runs': [{'task_id': str(uuid.uuid4())}]}],
+            '_search': search.search_terms([{'kwargs': {'dataset_id': f'DS-{i}'}}], args=[f'user-{i % 50}'])
+        })
+    db.get_collection('workflow_meta').insert_many(workflows)
+    db.get_collection('celery_taskmeta').insert_many([
+        {
+            '_id': wf['steps'][0]['task_runs'][0]['task_id'],
+            'status': wf['_status'],
+            'kwargs': {'workflow_id': wf['_id'], 'step': 'inspect', 'app_id': wf['app_id']}
+        }
+        for wf in workflows
+    ])
+    counters.reconcile(db)
+    assert indexes.apply(db) == {}
+    yield db
+    client.drop_database(db.name)
+    client.close()
+
+
+def plan_stages(plan: dict) -> list[str]:
+    stages = [plan['stage']] if 'stage' in plan else []
+    for key in ['inputStage', 'queryPlan']:
+        if key in plan:
+            stages += plan_stages(plan[key])
+    for child in plan.get('inputStages', []):
+        stages += plan_stages(child)
+    return stages
+
+
+def assert_indexed(explain: dict, scans=('IXSCAN',)):
+    # only the winning plan, the rejected plans are allowed to sort or scan the collection
+    stages = plan_stages(explain['queryPlanner']['winningPlan'])
+    assert any(stage in scans for stage in stages), stages
+    assert 'COLLSCAN' not in stages, stages
+    assert 'SORT' not in stages, stages
+
+
+def explain_aggregate(db, collection: str, pipeline: list[dict]) -> dict:
+    explain = db.command('explain', {'aggregate': collection, 'pipeline': pipeline, 'cursor': {}})
+    # the stages run by the query layer are explained under $cursor, unless it runs the whole pipeline
+    if 'queryPlanner' in explain:
+        return explain
+    return explain['stages'][0]['$cursor']
+
+
+def explain_list(db, query: dict, sort_by: SortBy = None, sort_order_asc: bool = True, fields: str = None) -> dict:
+    # the page of rhythm_api.listing.list_workflows
+    selection = sparse.parse(fields)
+    return explain_aggregate(db, 'workflow_meta', page_pipeline(query, skip=0, limit=26,
+                                                                sort_by=sort_by, sort_order_asc=sort_order_asc,
+                                                                projection=sparse.workflow_projection(selection),
+                                                                task_projection=sparse.task_projection(selection)))
+
+
+def explain_count(db, query: dict) -> dict:
+    # what count_documents sends
+    return explain_aggregate(db, 'workflow_meta', [{'$match': query}, {'$group': {'_id': 1, 'n': {'$sum': 1}}}])
+
+
+def test_apply_is_idempotent(mongo_db):
+    assert indexes.apply(mongo_db) == {}
+    assert all(len(r['missing']) == 0 for r in indexes.report(mongo_db).values())
+
+
+@pytest.mark.parametrize('sort_by', list(SortBy))
+@pytest.mark.parametrize('sort_order_asc', [True, False])
+@pytest.mark.parametrize('query', [
+    {'app_id': 'app-a'},
+    wf_query(app_id='app-a', status=Status.FAILURE),
+    wf_query(app_id='app-a', status=Status.ACTIVE),
+])
+def test_list_workflows(mongo_db, sort_by, sort_order_asc, query):
+    # GET /workflows - sorted and paginated, optionally filtered by app_id and status, and counted
+    assert_indexed(explain_list(mongo_db, query, sort_by=sort_by, sort_order_asc=sort_order_asc))
+    assert_indexed(explain_count(mongo_db, query), scans=('IXSCAN', 'COUNT_SCAN'))
+
+
+@pytest.mark.parametrize('sort_by', list(SortBy))
+@pytest.mark.parametrize('fields', [None, 'id,name,status,steps.last_task_run.status'])
+def test_list_all_workflows(mongo_db, sort_by, fields):
+    assert_indexed(explain_list(mongo_db, {}, sort_by=sort_by, fields=fields))
+
+
+def test_counts_by_status(mongo_db):
+    cursor = mongo_db.get_collection(counters.COUNTS).find({'app_id': 'app-a'})
+    assert_indexed(cursor.explain())
+
+
+def test_unique_steps(mongo_db):
+    explain = mongo_db.command('explain', {'distinct': 'celery_taskmeta', 'key': 'kwargs.step',
+                                           'query': steps.step_query('app-a')})
+    assert_indexed(explain, scans=('IXSCAN', 'DISTINCT_SCAN'))
+
+
+def test_active_tasks(mongo_db):
+    cursor = mongo_db.get_collection('celery_taskmeta') \
+        .find(steps.active_query('app-a')) \
+        .sort([('kwargs.step', 1), ('_id', 1)]) \
+        .limit(100)
+    assert_indexed(cursor.explain())
+
+
+def test_bulk_filter(mongo_db):
+    # rhythm_api.bulk.find_workflow_ids
+    query = wf_query(app_id='app-b', status=Status.ACTIVE)
+    cursor = mongo_db.get_collection('workflow_meta').find(query, {'_id': 1}).limit(1001)
+    assert_indexed(cursor.explain())
+
+
+def test_watcher_poll(mongo_db):
+    start = datetime.datetime(2024, 1, 2)
+    cursor = mongo_db.get_collection('workflow_meta') \
+        .find({'$or': [{'updated_at': {'$gt': start}}, {'created_at': {'$gt': start}}]})
+    assert_indexed(cursor.explain())
+
+
+def test_search_kwargs(mongo_db):
+    query = search.search_query(kwargs=['dataset_id=ds-7'], args=['USER-7'])
+    cursor = mongo_db.get_collection('workflow_meta').find(query).limit(10)
+    assert_indexed(cursor.explain())
+    assert len(list(cursor.clone())) == 1
+
+
+def test_search_name_prefix(mongo_db):
+    query = {'app_id': 'app-a', **search.search_query(name_prefix='wf-1')}
+    assert_indexed(explain_list(mongo_db, query, sort_by=SortBy.NAME))
+
+
+def test_search_text(mongo_db):
+    cursor = mongo_db.get_collection('workflow_meta').find(search.search_query(text='wf')).limit(25)
+    assert_indexed(cursor.explain(), scans=('TEXT_MATCH', 'TEXT_OR', 'IXSCAN'))
@@ -0,0 +1,201 @@
+import asyncio
+
+import pymongo
+import pytest
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+from motor.motor_asyncio import AsyncIOMotorClient
+from pymongo.errors import PyMongoError
+
+from rhythm_api import sparse
+from rhythm_api.cache import response_cache
+from rhythm_api.routers import workflows as workflows_router
+from rhythm_api.hydration import fetch_embellished_workflows, referenced_task_ids
+from rhythm_api.listing import CountMode, SortBy, after_query, decode_cursor, encode_cursor, list_workflows, sort_spec
+from tests.conftest import load_seed
+
+
+class AsyncList:
+    def __init__(self, docs: list[dict]):
+        self.docs = docs
+
+    async def to_list(self, length):
+        return self.docs
+
+
+class JoinedCollection:
+    """
+    motor-like workflow_meta collection for list_workflows.
+    mongomock cannot evaluate the task join of page_pipeline ($last / $reduce), the stages before it run on mongomock
+    and the join is done in python, the same way hydration reads the task runs of a workflow.
+    """
+
+    def __init__(self, db):
+        self.wf_col = db.get_collection('workflow_meta')
+        self.task_col = db.get_collection('celery_taskmeta')
+
+    def aggregate(self, pipeline: list[dict]) -> AsyncList:
+        i = next(i for i, stage in enumerate(pipeline) if '_task_ids' in stage.get('$addFields', {}))
+        lookup = pipeline[i + 1]['$lookup']
+        assert (lookup['from'], lookup['localField'], lookup['foreignField'], lookup['as']) == \
+               ('celery_taskmeta', '_task_ids', '_id', '_tasks')
+        assert pipeline[i + 2:] == [{'$project': {'_task_ids': 0}}]
+        prev_task_runs = '$reduce' in pipeline[i]['$addFields']['_task_ids']
+        task_projection = lookup['pipeline'][0]['$project'] if 'pipeline' in lookup else None
+
+        docs = list(self.wf_col.aggregate(pipeline[:i]))
+        for doc in docs:
+            task_ids = referenced_task_ids(doc, prev_task_runs=prev_task_runs)
+            doc['_tasks'] = list(self.task_col.find({'_id': {'$in': task_ids}}, task_projection))
+        return AsyncList(docs)
+
+    async def count_documents(self, query: dict, **kwargs) -> int:
+        return self.wf_col.count_documents(query, **kwargs)
+
+    async def estimated_document_count(self) -> int:
+        return self.wf_col.estimated_document_count()
+
+
+def pages(wf_col, sort_by, sort_order_asc, limit):
+    sort = list(sort_spec(sort_by, sort_order_asc).items())
+    query = {}
+    while True:
+        docs = list(wf_col.find(query).sort(sort).limit(limit + 1))
+        yield [d['_id'] for d in docs[:limit]]
+        if len(docs) <= limit:
+            return
+        value, _id = decode_cursor(sort_by, encode_cursor(sort_by, docs[limit - 1]))
+        query = after_query(sort_by, sort_order_asc, value, _id)
+
+
+@pytest.mark.parametrize('sort_by', list(SortBy))
+@pytest.mark.parametrize('sort_order_asc', [True, False])
+def test_cursor_pages_cover_the_sorted_collection(db, sort_by, sort_order_asc):
+    wf_col = db.get_collection('workflow_meta')
+    # some seeded workflows have a null name and none has a status, mix in values to exercise both branches
+    for i, wf in enumerate(wf_col.find({}, {'_id': 1})):
+        if i % 3 == 0:
+            wf_col.update_one({'_id': wf['_id']}, {'$set': {'name': f'wf-{i % 2}', '_status': 'SUCCESS'}})
+
+    expected = [d['_id'] for d in wf_col.find().sort(list(sort_spec(sort_by, sort_order_asc).items()))]
+    for limit in [1, 2, 4]:
+        actual = [_id for page in pages(wf_col, sort_by, sort_order_asc, limit) for _id in page]
+        assert actual == expected
+
+
+def test_cursor_is_bound_to_sort_key(db):
+    wf = db.get_collection('workflow_meta').find_one()
+    token = encode_cursor(SortBy.NAME, wf)
+    with pytest.raises(AssertionError):
+        decode_cursor(SortBy.CREATED_AT, token)
+    with pytest.raises(AssertionError):
+        decode_cursor(SortBy.NAME, 'not-a-cursor')
+
+
+@pytest.mark.parametrize('fields', [None, 'id,status,steps.name,steps.last_task_run.status'])
+@pytest.mark.parametrize('prev_task_runs', [False, True])
+def test_list_workflows(db, fields, prev_task_runs):
+    wf_col = JoinedCollection(db)
+    selection = sparse.parse(fields)
+    sort = list(sort_spec(SortBy.UPDATED_AT, False).items())
+    expected_ids = [d['_id'] for d in db.get_collection('workflow_meta').find().sort(sort)]
+    expected = fetch_embellished_workflows(db.get_collection('workflow_meta'), db.get_collection('celery_taskmeta'),
+                                           expected_ids, prev_task_runs=prev_task_runs, fields=selection)
+
+    workflows, after = [], None
+    while True:
+        page, total, after = asyncio.run(list_workflows(wf_col, {}, skip=0, limit=4, sort_by=SortBy.UPDATED_AT,
+                                                        sort_order_asc=False, prev_task_runs=prev_task_runs,
+                                                        after=after, fields=selection))
+        assert total == len(expected_ids)
+        workflows.extend(page)
+        if after is None:
+            break
+        # the sort key of the last workflow is read for the cursor, it is not returned unless it is selected
+        assert len(page) == 4 and ('updated_at' in page[-1]) == (fields is None)
+    assert workflows == expected
+
+
+def test_list_workflows_skip_limit_and_count(db):
+    wf_col = JoinedCollection(db)
+    query = {'_id': {'$in': [d['_id'] for d in db.get_collection('workflow_meta').find().limit(5)]}}
+    page, total, after = asyncio.run(list_workflows(wf_col, query, skip=2, limit=2, count=CountMode.ESTIMATED))
+    assert len(page) == 2 and total == 5 and after is not None
+    page, total, after = asyncio.run(list_workflows(wf_col, query, skip=3, limit=2, count=CountMode.NONE))
+    assert len(page) == 2 and total is None and after is None
+    assert asyncio.run(list_workflows(wf_col, query, skip=0, limit=0))[0:3:2] == ([], None)
+
+
+@pytest.mark.parametrize('sort_by', list(SortBy))
+@pytest.mark.parametrize('sort_order_asc', [True, False])
+def test_get_workflows_pages_with_after(db, monkeypatch, sort_by, sort_order_asc):
+    wf_col = db.get_collection('workflow_meta')
+    # null and missing sort keys: fresh workflows have no updated_at, most seeded workflows have no name or status
+    for i, wf in enumerate(wf_col.find({}, {'_id': 1})):
+        if i % 3 == 0:
+            wf_col.update_one({'_id': wf['_id']}, {'$set': {'name': f'wf-{i % 2}', '_status': 'SUCCESS'}})
+        if i % 4 == 1:
+            wf_col.update_one({'_id': wf['_id']}, {'$set': {'updated_at': None}})
+        if i % 4 == 2:
+            wf_col.update_one({'_id': wf['_id']}, {'$unset': {'updated_at': ''}})
+    monkeypatch.setattr(workflows_router, 'async_collection', lambda name, reads=None: JoinedCollection(db))
+    response_cache.invalidate_lists()
+    app = FastAPI()
+    app.include_router(workflows_router.router)
+    client = TestClient(app)
+
+    expected = [d['_id'] for d in wf_col.find().sort(list(sort_spec(sort_by, sort_order_asc).items()))]
+    ids = []
+    params = {'sort_by': sort_by.value, 'sort_order_asc': sort_order_asc, 'limit': 2, 'count': 'estimated',
+              'fields': 'id'}
+    while True:
+        response = client.get('/workflows', params=params)
+        assert response.status_code == 200
+        body = response.json()
+        assert body['metadata']['total'] == len(expected)
+        ids.extend(wf['id'] for wf in body['results'])
+        if body['metadata']['next'] is None:
+            break
+        params['after'] = body['metadata']['next']
+    assert ids == expected
+
+
+@pytest.fixture
+def mongo_url():
+    # page_pipeline itself needs a real mongod, the test is skipped when the result backend is not reachable
+    from rhythm_api.config.celeryconfig import result_backend
+    client = pymongo.MongoClient(result_backend, serverSelectionTimeoutMS=1000)
+    try:
+        client.admin.command('ping')
+    except PyMongoError:
+        pytest.skip('mongo is not reachable')
+    db = client['rhythm_api_test_listing']
+    client.drop_database(db.name)
+    db.get_collection('workflow_meta').insert_many(load_seed('workflow_meta'))
+    db.get_collection('celery_taskmeta').insert_many(load_seed('celery_taskmeta'))
+    yield result_backend
+    client.drop_database(db.name)
+    client.close()
+
+
+@pytest.mark.parametrize('prev_task_runs', [False, True])
+def test_list_workflows_on_mongo(db, mongo_url, prev_task_runs):
+    fields = sparse.parse('id,status,steps.name,steps.last_task_run.status')
+
+    async def list_all(wf_col) -> list[dict]:
+        workflows, after = [], None
+        while True:
+            page, _, after = await list_workflows(wf_col, {}, skip=0, limit=4, sort_by=SortBy.NAME,
+                                                  prev_task_runs=prev_task_runs, after=after, fields=fields)
+            workflows.extend(page)
+            if after is None:
+                return workflows
+
+    async def list_on_mongo() -> list[dict]:
+        client = AsyncIOMotorClient(mongo_url)
+        try:
+            return await list_all(client['rhythm_api_test_listing'].get_collection('workflow_meta'))
+        finally:
+            client.close()
+
+    assert asyncio.run(list_on_mongo()) == asyncio.run(list_all(JoinedCollection(db)))
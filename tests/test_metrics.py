@@ -0,0 +1,59 @@
+from types import SimpleNamespace
+
+from fastapi.testclient import TestClient
+from prometheus_client import REGISTRY
+
+from rhythm_api import metrics
+from rhythm_api.main import app
+
+
+def sample(name: str, **labels) -> float:
+    return REGISTRY.get_sample_value(name, labels) or 0
+
+
+def test_requests_are_labelled_by_route():
+    client = TestClient(app)
+    labels = {'method': 'GET', 'route': '/health', 'status': '200'}
+    before = sample('rhythm_api_request_duration_seconds_count', **labels)
+    assert client.get('/health').status_code == 200
+    assert sample('rhythm_api_request_duration_seconds_count', **labels) == before + 1
+
+    # unauthenticated, and a failed auth is timed by route template rather than by path
+    assert client.get('/workflows/abc').status_code == 401
+    assert sample('rhythm_api_request_duration_seconds_count',
+                  method='GET', route='/workflows/{workflow_id}', status='401') >= 1
+
+    response = client.get('/metrics')
+    assert response.status_code == 200
+    assert 'rhythm_api_threadpool_threads_total' in response.text
+
+
+def test_command_listener_labels_by_collection():
+    listener = metrics.CommandListener()
+    labels = {'collection': 'workflow_meta', 'command': 'find'}
+    before = sample('rhythm_api_mongo_command_duration_seconds_count', **labels)
+    listener.started(SimpleNamespace(command_name='find', command={'find': 'workflow_meta'}, request_id=1))
+    listener.succeeded(SimpleNamespace(command_name='find', request_id=1, duration_micros=1500))
+    assert sample('rhythm_api_mongo_command_duration_seconds_count', **labels) == before + 1
+    assert listener._collections == {}
+
+
+def test_threadpool_is_observed_by_every_request():
+    from fastapi import FastAPI
+
+    in_handler = []
+    test_app = FastAPI()
+    test_app.add_middleware(metrics.MetricsMiddleware)
+
+    @test_app.get('/_test_threads')
+    def sync_handler():
+        in_handler.append(sample('rhythm_api_threadpool_threads_in_use'))
+
+    metrics.THREADS_TOTAL.set(0)
+    metrics.THREADS_IN_USE.set(5)
+    client = TestClient(test_app)
+    assert client.get('/_test_threads').status_code == 200
+    # set when the request entered, before it borrowed a thread, and again when it left
+    assert in_handler == [0]
+    assert sample('rhythm_api_threadpool_threads_in_use') == 0
+    assert sample('rhythm_api_threadpool_threads_total') == 40
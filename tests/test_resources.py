@@ -0,0 +1,78 @@
+import json
+import subprocess
+import sys
+import threading
+from pathlib import Path
+
+from rhythm_api import resources
+
+# importing the app in a fresh interpreter, so that modules imported by other tests do not count
+IMPORT_BUDGET_SECONDS = 2
+
+IMPORT_APP = '''
+import gc, json, time
+start = time.perf_counter()
+import rhythm_api.main
+elapsed = time.perf_counter() - start
+
+import pymongo
+from rhythm_api import auth, resources
+print(json.dumps({
+    'seconds': elapsed,
+    'resources': resources._resources is not None,
+    'mongo_clients': sum(1 for o in gc.get_objects() if isinstance(o, pymongo.MongoClient)),
+    'keys': auth.public_key.cache_info().currsize + auth.private_key.cache_info().currsize,
+}))
+'''
+
+
+def test_import_is_fast_and_connects_to_nothing():
+    output = subprocess.run([sys.executable, '-c', IMPORT_APP], capture_output=True, text=True, check=True,
+                            cwd=Path(__file__).resolve().parent.parent).stdout
+    result = json.loads(output.strip().splitlines()[-1])
+    assert result['seconds'] < IMPORT_BUDGET_SECONDS, result
+    assert result == {**result, 'resources': False, 'mongo_clients': 0, 'keys': 0}
+
+
+def test_celery_backends_share_the_mongo_client():
+    r = resources.Resources()
+    try:
+        backends = [r.celery_app.backend]
+        # celery creates a backend per thread
+        thread = threading.Thread(target=lambda: backends.append(r.celery_app.backend))
+        thread.start()
+        thread.join()
+
+        assert backends[0] is not backends[1]
+        for backend in backends:
+            assert backend._get_connection() is r.client
+            assert backend.database.name == r.client.get_default_database().name
+        assert r.async_client.delegate is r.client
+    finally:
+        r.close()
+
+
+def test_read_preferences(monkeypatch):
+    from pymongo.read_preferences import ReadPreference, SecondaryPreferred
+
+    monkeypatch.setitem(resources.config['mongo'], 'read_preferences', {
+        'listing': {'mode': 'secondaryPreferred', 'max_staleness_seconds': 120, 'tags': [{'use': 'reporting'}]},
+        'counts': {'mode': 'nearest', 'max_staleness_seconds': None},
+    })
+    assert resources.read_preference(None) == ReadPreference.PRIMARY
+    assert resources.read_preference('unknown') == ReadPreference.PRIMARY
+    assert resources.read_preference('listing') == SecondaryPreferred([{'use': 'reporting'}], max_staleness=120)
+    assert resources.read_preference('counts').document == {'mode': 'nearest'}
+
+    try:
+        assert resources.async_collection('workflow_meta').read_preference == ReadPreference.PRIMARY
+        listing = resources.async_collection('workflow_meta', reads='listing')
+        assert listing.read_preference.document == {'mode': 'secondaryPreferred', 'maxStalenessSeconds': 120,
+                                                    'tags': [{'use': 'reporting'}]}
+    finally:
+        resources.close()
+
+
+def test_configured_read_preferences_are_valid():
+    for name in resources.config['mongo']['read_preferences']:
+        assert resources.read_preference(name).mongos_mode != 'primary'
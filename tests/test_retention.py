@@ -0,0 +1,107 @@
+import contextlib
+import datetime
+import io
+
+import mongomock
+import pytest
+
+from rhythm_api import counters, retention
+from tests.benchmark.seed import seed
+
+NOW = datetime.datetime(2030, 1, 1)
+
+
+def seeded_db(n: int):
+    db = mongomock.MongoClient()['celery']
+    with contextlib.redirect_stdout(io.StringIO()):
+        seed(db, n, apps=2)
+    return db
+
+
+def retention_config(**kwargs) -> dict:
+    return {
+        'archive_after_days': 30,
+        'apps': {},
+        'batch_size': 40,
+        'target': 'collection',
+        'archive_dir': 'archive',
+        'expire_archived_after_days': None,
+        **kwargs
+    }
+
+
+@pytest.mark.parametrize('target', ['collection', 'files'])
+def test_archives_terminal_workflows_with_their_tasks(tmp_path, target):
+    db = seeded_db(200)
+    wf_col = db.get_collection('workflow_meta')
+    task_col = db.get_collection('celery_taskmeta')
+    terminal = {'_status': {'$in': retention.TERMINAL_STATES}}
+    archivable = list(wf_col.find(terminal))
+    expected_tasks = {task_id for wf in archivable for task_id in retention.task_ids_of(wf)}
+    remaining = wf_col.count_documents({}) - len(archivable)
+
+    cfg = retention_config(target=target, archive_dir=str(tmp_path))
+    assert retention.run(db, cfg, now=NOW, dry_run=True)['archived_count'] == len(archivable)
+    summary = retention.run(db, cfg, now=NOW)
+
+    assert summary['archived_count'] == len(archivable)
+    assert summary['archived_task_count'] == len(expected_tasks)
+    assert wf_col.count_documents(terminal) == 0
+    assert wf_col.count_documents({}) == remaining
+    assert task_col.count_documents({'_id': {'$in': list(expected_tasks)}}) == 0
+    # the counters follow the deletes
+    assert sum(c['count'] for c in db.get_collection(counters.COUNTS).find()) == remaining
+
+    wf = archivable[0]
+    record = retention.read_archived(db, wf['_id'])
+    assert record['workflow'] == wf
+    assert {task['_id'] for task in record['tasks']} == set(retention.task_ids_of(wf))
+    assert retention.read_archived(db, 'missing') is None
+
+    # nothing left to archive
+    assert retention.run(db, cfg, now=NOW)['archived_count'] == 0
+
+
+def test_policies_per_app():
+    db = seeded_db(200)
+    wf_col = db.get_collection('workflow_meta')
+    terminal = {'_status': {'$in': retention.TERMINAL_STATES}}
+    app_0 = wf_col.count_documents({**terminal, 'app_id': 'app-0'})
+    app_1 = wf_col.count_documents({**terminal, 'app_id': 'app-1'})
+
+    # app-0 is kept longer than its workflows are old, apps without a policy are kept forever
+    cfg = retention_config(archive_after_days=None, apps={'app-0': 365 * 10, 'app-1': 30})
+    summary = retention.run(db, cfg, now=NOW)
+
+    assert summary['archived_count'] == app_1 > 0
+    assert wf_col.count_documents({**terminal, 'app_id': 'app-1'}) == 0
+    assert wf_col.count_documents({**terminal, 'app_id': 'app-0'}) == app_0
+
+
+def test_workflow_resumed_after_it_was_read_is_kept(tmp_path):
+    db = seeded_db(100)
+    wf_col = db.get_collection('workflow_meta')
+    task_col = db.get_collection('celery_taskmeta')
+    query = retention.archivable_query({}, 30, NOW)
+    workflows = list(wf_col.find(query).limit(10))
+    resumed, others = workflows[0], workflows[1:]
+    # resumed before the batch is deleted, its new task is running
+    wf_col.update_one({'_id': resumed['_id']}, {'$set': {'updated_at': NOW, '_status': 'STARTED'}})
+
+    result = retention.archive_batch(db, workflows, NOW, query)
+
+    assert result['deleted_count'] == len(others)
+    assert wf_col.count_documents({'_id': resumed['_id']}) == 1
+    assert task_col.count_documents({'_id': {'$in': retention.task_ids_of(resumed)}}) == \
+        len(retention.task_ids_of(resumed))
+    assert retention.read_archived(db, resumed['_id']) is None
+    assert retention.read_archived(db, others[0]['_id'])['workflow'] == others[0]
+
+
+def test_missing_archive_file(tmp_path, caplog):
+    db = seeded_db(50)
+    retention.run(db, retention_config(target='files', archive_dir=str(tmp_path / 'archive')), now=NOW)
+    entry = db.get_collection(retention.ARCHIVE).find_one()
+    (tmp_path / 'archive').rename(tmp_path / 'moved')
+    assert retention.read_archived(db, entry['_id']) is None
+    assert f'workflow {entry["_id"]} is missing' in caplog.text
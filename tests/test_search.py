@@ -0,0 +1,59 @@
+import pytest
+
+from rhythm_api import search
+from rhythm_api.submission import new_workflow
+
+
+def test_search_terms():
+    steps = [
+        {'name': 'inspect', 'task': 'inspect', 'kwargs': {'dataset_id': ' DS-1 ', 'options': {'deep': True}}},
+        {'name': 'archive', 'task': 'archive', 'kwargs': {'paths': ['/a', '/B'], 'dataset_id': 'ds-1'}},
+        {'name': 'stage', 'task': 'stage'},
+    ]
+    assert search.search_terms(steps, args=['DS-1', {'user': 'Ann'}, 3, None]) == [
+        'args.user=ann',
+        'args=3',
+        'args=ds-1',
+        'args=null',
+        'kwargs.dataset_id=ds-1',
+        'kwargs.options.deep=true',
+        'kwargs.paths=/a',
+        'kwargs.paths=/b',
+    ]
+    assert search.search_terms(steps[2:]) == []
+
+
+def test_search_query():
+    assert search.search_query() == {}
+    assert search.search_query(text='genome run', name_prefix='wf.1', kwargs=['dataset_id=DS-1'],
+                               args=['x', 'user=Ann']) == {
+        '$text': {'$search': 'genome run'},
+        'name': {'$regex': r'^wf\.1'},
+        '_search': {'$all': ['kwargs.dataset_id=ds-1', 'args=x', 'args.user=ann']},
+    }
+    for expr in ['dataset_id', '=DS-1']:
+        with pytest.raises(AssertionError):
+            search.search_query(kwargs=[expr])
+
+
+def test_new_workflows_are_searchable(db):
+    wf_col = db.get_collection('workflow_meta')
+    workflow = new_workflow(steps=[{'name': 'inspect', 'task': 'inspect', 'kwargs': {'dataset_id': 'DS-42'}}],
+                            name='inspect DS-42', app_id='app', args=['DS-42'])
+    wf_col.insert_one(workflow)
+
+    assert [wf['_id'] for wf in wf_col.find(search.search_query(kwargs=['dataset_id=ds-42']))] == [workflow['_id']]
+    assert wf_col.count_documents(search.search_query(kwargs=['dataset_id=ds-42'], args=['other'])) == 0
+    assert wf_col.count_documents(search.search_query(name_prefix='inspect')) == 1
+
+
+def test_backfill(db):
+    wf_col = db.get_collection('workflow_meta')
+    task_col = db.get_collection('celery_taskmeta')
+    wf = wf_col.find_one({'steps.0.task_runs.0': {'$exists': True}})
+    task_col.update_one({'_id': wf['steps'][0]['task_runs'][0]['task_id']}, {'$set': {'args': ['DS-7']}})
+
+    assert search.backfill(db, batch_size=2) == wf_col.count_documents({})
+    assert wf_col.count_documents({search.SEARCH_FIELD: {'$exists': False}}) == 0
+    assert wf_col.find_one(search.search_query(args=['ds-7']))['_id'] == wf['_id']
+    assert search.backfill(db) == 0
@@ -0,0 +1,23 @@
+from rhythm_api import serve
+from rhythm_api.config import config
+
+
+def test_gunicorn_settings_come_from_the_config(monkeypatch):
+    monkeypatch.delenv('PROMETHEUS_MULTIPROC_DIR', raising=False)
+    server_config = {**config['server'], 'port': 5099, 'workers': None, 'keepalive': 7, 'backlog': 512}
+    options = serve.gunicorn_options(server_config)
+    assert options['workers'] == serve.default_workers() >= 1
+    assert 'child_exit' not in options
+
+    cfg = serve.Application(options).cfg
+    assert cfg.bind == ['0.0.0.0:5099']
+    assert cfg.worker_class_str == 'uvicorn.workers.UvicornWorker'
+    assert cfg.preload_app is True
+    assert (cfg.keepalive, cfg.backlog) == (7, 512)
+    assert cfg.graceful_timeout == config['server']['graceful_timeout']
+
+
+def test_exited_workers_are_dropped_from_metrics(monkeypatch, tmp_path):
+    monkeypatch.setenv('PROMETHEUS_MULTIPROC_DIR', str(tmp_path))
+    options = serve.gunicorn_options({**config['server'], 'workers': 2})
+    assert serve.Application(options).cfg.child_exit is serve.child_exit
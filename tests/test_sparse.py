@@ -0,0 +1,75 @@
+import pytest
+
+from rhythm_api import sparse
+from rhythm_api.hydration import fetch_embellished_workflows
+from rhythm_api.listing import page_pipeline
+
+
+def test_parse():
+    assert sparse.parse(None) is None
+    assert sparse.parse('') is None
+    assert sparse.parse('_id, name,_status,steps.name') == {'id': True, 'name': True, 'status': True,
+                                                            'steps': {'name': True}}
+    # a whole field wins over its sub-fields
+    assert sparse.parse('steps.name,steps') == {'steps': True}
+    assert sparse.parse('steps,steps.name') == {'steps': True}
+    assert sparse.parse('steps.last_task_run.status,steps.last_task_run.date_done') == \
+        {'steps': {'last_task_run': {'status': True, 'date_done': True}}}
+
+    for fields in ['unknown', 'name.first', 'steps.unknown', 'steps..name']:
+        with pytest.raises(AssertionError):
+            sparse.parse(fields)
+
+
+def test_projections():
+    assert sparse.workflow_projection(None) is None
+    assert sparse.task_projection(None) is None
+
+    selection = sparse.parse('id,name,status,steps.name')
+    assert sparse.workflow_projection(selection) == {'name': 1, 'steps.name': 1, 'steps.task': 1,
+                                                     'steps.group': 1, 'steps.task_runs': 1}
+    # statuses only, no results or tracebacks
+    assert sparse.task_projection(selection) == {'status': 1}
+    assert sparse.task_projection(sparse.parse('steps.last_task_run.date_done,steps.last_task_run.date_start')) == \
+        {'status': 1, 'date_done': 1}
+    assert sparse.task_projection(sparse.parse('steps.last_task_run')) is None
+    assert sparse.task_projection(sparse.parse('steps')) is None
+
+    assert sparse.task_runs(selection, True, True) == (False, False)
+    assert sparse.task_runs(sparse.parse('steps.prev_task_runs'), True, True) == (False, True)
+    assert sparse.task_runs(None, True, False) == (True, False)
+
+
+@pytest.mark.parametrize('fields', [
+    'id,name,status,steps.name',
+    'id,status,steps_done,total_steps',
+    'id,steps.status,steps.last_task_run.status,steps.last_task_run.date_done,steps.last_task_run.date_start',
+    'id,steps.prev_task_runs',
+    'steps',
+])
+def test_sparse_hydration_matches_full(db, fields):
+    wf_col = db.get_collection('workflow_meta')
+    task_col = db.get_collection('celery_taskmeta')
+    wf_ids = [wf['_id'] for wf in wf_col.find({}, {'_id': 1})]
+
+    selection = sparse.parse(fields)
+    full = fetch_embellished_workflows(wf_col, task_col, wf_ids, prev_task_runs=True)
+    actual = fetch_embellished_workflows(wf_col, task_col, wf_ids, prev_task_runs=True, fields=selection)
+    assert actual == [sparse.select(wf, selection) for wf in full]
+    assert all(set(wf.keys()) <= set(selection.keys()) for wf in actual)
+
+
+def test_page_pipeline_projections():
+    selection = sparse.parse('id,name,steps.last_task_run.status')
+    stages = page_pipeline({}, skip=0, limit=10,
+                           projection=sparse.workflow_projection(selection),
+                           task_projection=sparse.task_projection(selection))
+    project = next(stage['$project'] for stage in stages if '$project' in stage)
+    # the sort key is kept for the cursor of the next page
+    assert project['created_at'] == 1 and project['name'] == 1
+    lookup = next(stage['$lookup'] for stage in stages if '$lookup' in stage)
+    assert lookup['pipeline'] == [{'$project': {'status': 1}}]
+
+    # no projection without a selection
+    stages = page_pipeline({}, skip=0, limit=10)
+    assert 'pipeline' not in next(stage['$lookup'] for stage in stages if '$lookup' in stage)
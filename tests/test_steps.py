@@ -0,0 +1,45 @@
+import asyncio
+import contextlib
+import io
+
+import mongomock
+from mongomock_motor import AsyncMongoMockClient
+
+from rhythm_api import steps
+from tests.benchmark.seed import seed
+
+
+def seeded_tasks():
+    db = mongomock.MongoClient()['celery']
+    with contextlib.redirect_stdout(io.StringIO()):
+        seed(db, 300, apps=2)
+    tasks = list(db.get_collection('celery_taskmeta').find())
+    # a task outside of any workflow
+    tasks.append({'_id': 'no-step', 'status': 'STARTED', 'kwargs': {'app_id': 'app-0'}})
+    return tasks
+
+
+def test_unique_steps_and_active_tasks():
+    tasks = seeded_tasks()
+    task_col = AsyncMongoMockClient()['celery']['celery_taskmeta']
+
+    async def run():
+        await task_col.insert_many(tasks)
+        unique = await steps.unique_steps(task_col, 'app-0')
+        unique_by_task = await steps.unique_steps(task_col, 'app-0', task='scaworkers.workers.stage.stage_dataset')
+        pages = [await steps.active_tasks(task_col, 'app-0', skip=skip, limit=7) for skip in range(0, 200, 7)]
+        return unique, unique_by_task, pages
+
+    unique, unique_by_task, pages = asyncio.run(run())
+    assert unique == sorted({t['kwargs']['step'] for t in tasks
+                             if t['kwargs'].get('app_id') == 'app-0' and 'step' in t['kwargs']})
+    assert unique_by_task == ['stage']
+
+    active = sorted(
+        (t['kwargs']['step'], t['_id']) for t in tasks
+        if t['kwargs'].get('app_id') == 'app-0' and 'step' in t['kwargs'] and t['status'] in steps.ACTIVE_STATES
+    )
+    paged = [(group['step'], task['_id']) for page in pages for group in page['results'] for task in group['tasks']]
+    assert paged == active
+    assert pages[0]['metadata']['total'] == len(active)
+    assert sum(pages[0]['counts'].values()) == len(active)
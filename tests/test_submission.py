@@ -0,0 +1,92 @@
+import contextlib
+import copy
+
+from sca_rhythm import Workflow
+
+from rhythm_api import counters
+from rhythm_api.submission import create_workflows
+
+
+class FakeBackend:
+    def __init__(self, db):
+        self.database = db
+
+
+class FakeCeleryApp:
+    def __init__(self, db):
+        self.backend = FakeBackend(db)
+        self.sent = []
+        self.producers = 0
+
+    def send_task(self, **kwargs):
+        self.sent.append(kwargs)
+
+    @contextlib.contextmanager
+    def producer_or_acquire(self):
+        self.producers += 1
+        yield 'producer'
+
+
+STEPS = [
+    {'name': 'inspect', 'task': 'tasks.inspect', 'queue': 'q1', 'kwargs': {'a': 1}},
+    {'name': 'archive', 'task': 'tasks.archive', 'queue': 'q2', 'kwargs': None},
+]
+
+
+def test_bulk_create_matches_workflow_start(db):
+    wf_col = db.get_collection('workflow_meta')
+
+    expected_app = FakeCeleryApp(db)
+    wf = Workflow(celery_app=expected_app, steps=copy.deepcopy(STEPS), name='wf', app_id='app')
+    wf.start('dataset-1')
+
+    celery_app = FakeCeleryApp(db)
+    results = create_workflows(celery_app, wf_col, [
+        {'steps': copy.deepcopy(STEPS), 'name': 'wf', 'app_id': 'app', 'args': ['dataset-1']},
+        {'steps': [], 'name': 'wf', 'app_id': 'app', 'args': ['dataset-2']},
+        {'steps': copy.deepcopy(STEPS), 'name': 'wf', 'app_id': 'app', 'args': ['dataset-3']},
+    ])
+
+    assert [sorted(r.keys()) for r in results] == [['workflow_id'], ['error'], ['workflow_id']]
+    assert results[1]['error'] == 'steps is empty'
+    assert celery_app.producers == 1
+    assert len(celery_app.sent) == 2
+
+    expected_msg = dict(expected_app.sent[0])
+    actual_msg = dict(celery_app.sent[0])
+    assert actual_msg.pop('producer') == 'producer'
+    assert expected_msg['kwargs'].pop('workflow_id') == wf.workflow['_id']
+    assert actual_msg['kwargs'].pop('workflow_id') == results[0]['workflow_id']
+    assert actual_msg == expected_msg
+
+    created = wf_col.find_one({'_id': results[2]['workflow_id']})
+    expected = wf_col.find_one({'_id': wf.workflow['_id']})
+    for key in ['steps', 'name', 'app_id', 'description', '_status']:
+        assert created[key] == expected[key]
+
+    count = db.get_collection(counters.COUNTS).find_one({'app_id': 'app', 'status': 'PENDING'})
+    assert count['count'] == 2
+
+
+def test_priority(db):
+    wf_col = db.get_collection('workflow_meta')
+    steps = copy.deepcopy(STEPS)
+    steps[1]['priority'] = 2
+
+    celery_app = FakeCeleryApp(db)
+    results = create_workflows(celery_app, wf_col, [
+        {'steps': copy.deepcopy(steps), 'name': 'wf', 'app_id': 'app', 'args': [], 'priority': 9},
+        {'steps': copy.deepcopy(STEPS), 'name': 'wf', 'app_id': 'app', 'args': []},
+        {'steps': copy.deepcopy(STEPS), 'name': 'wf', 'app_id': 'app', 'args': [], 'priority': 10},
+    ])
+    assert results[2]['error'] == 'priority is not an integer between 0 and 9'
+    assert [msg['priority'] for msg in celery_app.sent] == [9, 1]
+
+    urgent = wf_col.find_one({'_id': results[0]['workflow_id']})
+    assert urgent['priority'] == 9
+    # the workers publish the next steps with the priority of the step
+    assert [step['priority'] for step in urgent['steps']] == [9, 2]
+
+    default = wf_col.find_one({'_id': results[1]['workflow_id']})
+    assert 'priority' not in default
+    assert all('priority' not in step for step in default['steps'])
@@ -0,0 +1,97 @@
+import asyncio
+import datetime
+
+from mongomock_motor import AsyncMongoMockClient
+
+from rhythm_api.watcher import Subscription, WorkflowWatcher
+
+
+def workflow(_id, app_id, status, *task_ids):
+    start = datetime.datetime(2023, 1, 1)
+    return {
+        '_id': _id,
+        'app_id': app_id,
+        '_status': status,
+        'steps': [
+            {
+                'name': f'step-{i}',
+                'task': 'task',
+                'task_runs': [{'task_id': task_id, 'date_start': start + datetime.timedelta(minutes=i)}]
+            }
+            for i, task_id in enumerate(task_ids)
+        ]
+    }
+
+
+def drain(subscription):
+    events = []
+    while not subscription.queue.empty():
+        events.append(subscription.queue.get_nowait())
+    return events
+
+
+def test_publish_fans_out_transitions_only():
+    async def run():
+        watcher = WorkflowWatcher(poll_interval=1, overlap=0, queue_size=10, max_snapshots=10)
+        by_app = Subscription(app_id='app')
+        by_id = Subscription(workflow_id='wf-1')
+        other = Subscription(app_id='other')
+        watcher.subscriptions.update([by_app, by_id, other])
+
+        watcher.publish(workflow('wf-1', 'app', 'STARTED', 't1'))
+        watcher.publish(workflow('wf-1', 'app', 'STARTED', 't1'))  # no transition
+        watcher.publish(workflow('wf-1', 'app', 'STARTED', 't1', 't2'))
+        watcher.publish(workflow('wf-2', 'app', 'PENDING'))
+
+        assert [(e['workflow_id'], e['step'], e['task_id']) for e in drain(by_app)] == [
+            ('wf-1', 'step-0', 't1'),
+            ('wf-1', 'step-1', 't2'),
+            ('wf-2', None, None),
+        ]
+        assert [e['task_id'] for e in drain(by_id)] == ['t1', 't2']
+        assert drain(other) == []
+
+    asyncio.run(run())
+
+
+def test_slow_subscriber_keeps_latest_events():
+    async def run():
+        subscription = Subscription(queue_size=2)
+        for i in range(3):
+            subscription.put({'i': i})
+        assert [e['i'] for e in drain(subscription)] == [1, 2]
+
+    asyncio.run(run())
+
+
+def test_task_status_is_published_with_its_workflow():
+    async def run():
+        db = AsyncMongoMockClient()['celery']
+        wf_col = db.get_collection('workflow_meta')
+        await wf_col.insert_one(workflow('wf-1', 'app', 'STARTED', 't1', 't2'))
+        watcher = WorkflowWatcher(poll_interval=1, overlap=0, queue_size=10, max_snapshots=10)
+        subscription = Subscription(workflow_id='wf-1')
+        watcher.subscriptions.add(subscription)
+
+        def task(_id, status, workflow_id='wf-1'):
+            return {'_id': _id, 'status': status, 'kwargs': {'workflow_id': workflow_id, 'app_id': 'app'}}
+
+        await watcher.publish_task(wf_col, task('t2', 'STARTED'))
+        await watcher.publish_task(wf_col, task('t2', 'STARTED'))  # no transition
+        await watcher.publish_task(wf_col, task('t2', 'SUCCESS'))
+        # a task that is not the current one of its workflow, and a task of another workflow
+        await watcher.publish_task(wf_col, task('t1', 'SUCCESS'))
+        await watcher.publish_task(wf_col, task('t3', 'SUCCESS', workflow_id='wf-2'))
+        # a change of the workflow keeps the status of its current task
+        watcher.publish(await wf_col.find_one({'_id': 'wf-1'}))
+
+        assert [(e['step'], e['task_id'], e['task_status']) for e in drain(subscription)] == [
+            ('step-1', 't2', 'STARTED'),
+            ('step-1', 't2', 'SUCCESS'),
+        ]
+
+        await wf_col.update_one({'_id': 'wf-1'}, {'$set': {'_status': 'SUCCESS'}})
+        watcher.publish(await wf_col.find_one({'_id': 'wf-1'}))
+        assert [(e['status'], e['task_status']) for e in drain(subscription)] == [('SUCCESS', 'SUCCESS')]
+
+    asyncio.run(run())